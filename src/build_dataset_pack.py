@@ -0,0 +1,15 @@
+import typer
+from flowagent import DataManager
+
+app = typer.Typer()
+
+@app.command()
+def build_pack(
+    workflow_dataset: str = typer.Argument(..., help="Workflow dataset, the subdir of `dataset/`"),
+):
+    """ compile `dataset/{workflow_dataset}/` into `dataset/{workflow_dataset}.pack`, loaded instead of the subdir """
+    fn = DataManager.build_pack(workflow_dataset)
+    print(f"dataset `{workflow_dataset}` compiled into {fn}")
+
+if __name__ == "__main__":
+    app()
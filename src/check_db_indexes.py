@@ -0,0 +1,28 @@
+import typer
+import pandas as pd
+from flowagent import Config, DataManager, DBManager
+from flowagent.data import LogUtils
+
+app = typer.Typer()
+
+@app.command()
+def check_indexes(
+    config: str = typer.Option("default.yaml", help="Configuration file, for the db_* options"),
+    create: bool = typer.Option(True, help="Create the missing indexes before checking"),
+    conversation_id: str = typer.Option(None, help="Explain the queries with this conversation (default: the most recent one)"),
+):
+    """ run `explain` on the hot queries of `DBManager`, and flag the collection scans (exit code 1 if any) """
+    cfg = Config.from_yaml(DataManager.normalize_config_name(config))
+    db = DBManager.from_config(cfg, ensure_indexes=False)
+    if create: db.ensure_indexes(force=True)
+    sample = db.query_config_by_conversation_id(conversation_id) if conversation_id else None
+    rows = db.explain_hot_queries(sample)
+    print(LogUtils.format_infos_with_tabulate(pd.DataFrame(rows).set_index("query")))
+    collscans = [row["query"] for row in rows if row["collscan"]]
+    if collscans:
+        print(f"WARNING: collection scans in {collscans}" + ("" if create else ", run with `--create` to create the indexes"))
+        raise typer.Exit(code=1)
+    print("all hot queries use indexes")
+
+if __name__ == "__main__":
+    app()
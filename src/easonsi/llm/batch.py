@@ -0,0 +1,186 @@
+"""
+Offline batch submission of chat completions (OpenAI Batch API format)
+https://platform.openai.com/docs/guides/batch
+
+USAGE:
+    lines = [make_batch_line(custom_id, messages, model="gpt-4o", max_tokens=4096) for ...]
+    runner = BatchRunner(client)                      # or `BatchRunner(LocalBatchServer(llm).make_client())`
+    results = runner.run(lines, fn="judge_batch.jsonl") # {custom_id: ChatCompletion | error message}
+"""
+
+import io, json, time, uuid, threading, email, concurrent.futures
+from typing import Dict, List, Union, Any
+import httpx, openai
+from openai.types import Batch
+from openai.types.chat import ChatCompletion
+
+_ENDPOINT = "/v1/chat/completions"
+_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def make_batch_line(custom_id: str, messages: List[Dict], **body) -> Dict:
+    """ one request of the batch input file """
+    return {"custom_id": custom_id, "method": "POST", "url": _ENDPOINT, "body": {"messages": messages, **body}}
+
+
+def write_batch_file(lines: List[Dict], fn: str) -> None:
+    with open(fn, "w") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def parse_batch_output(content: str) -> Dict[str, Union[ChatCompletion, str]]:
+    """ parse the output/error file: {custom_id: ChatCompletion, or the error message} """
+    results = {}
+    for line in content.splitlines():
+        if not line.strip(): continue
+        item = json.loads(line)
+        response = item.get("response")
+        if response and response.get("status_code") == 200:
+            results[item["custom_id"]] = ChatCompletion.model_validate(response["body"])
+        else:
+            error = item.get("error") or (response or {}).get("body")
+            results[item["custom_id"]] = str(error)
+    return results
+
+
+class BatchRunner:
+    """ submit a batch file, poll until finished & collect the results
+    NOTE: `client` can be any openai client supporting files/batches, e.g. `LocalBatchServer.make_client()`
+    """
+    client: openai.OpenAI = None
+    poll_interval: float = 30.0
+    timeout: float = 24 * 3600
+
+    def __init__(self, client: openai.OpenAI, poll_interval: float = None, timeout: float = None) -> None:
+        self.client = client
+        if poll_interval is not None: self.poll_interval = poll_interval
+        if timeout is not None: self.timeout = timeout
+
+    def submit(self, fn: str) -> Batch:
+        with open(fn, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        return self.client.batches.create(input_file_id=input_file.id, endpoint=_ENDPOINT, completion_window="24h")
+
+    def wait(self, batch_id: str, verbose: bool = True) -> Batch:
+        start = time.time()
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in _FINAL_STATUSES:
+                return batch
+            if time.time() - start > self.timeout:
+                raise TimeoutError(f"batch {batch_id} is still {batch.status} after {self.timeout}s")
+            if verbose and batch.request_counts:
+                counts = batch.request_counts
+                print(f"  <batch> {batch_id} {batch.status}: {counts.completed + counts.failed}/{counts.total}")
+            time.sleep(self.poll_interval)
+
+    def fetch_results(self, batch: Batch) -> Dict[str, Union[ChatCompletion, str]]:
+        results = {}
+        for file_id in (batch.error_file_id, batch.output_file_id):
+            if file_id:
+                results |= parse_batch_output(self.client.files.content(file_id).text)
+        return results
+
+    def run(self, lines: List[Dict], fn: str, verbose: bool = True) -> Dict[str, Union[ChatCompletion, str]]:
+        """ the whole flow: write the jsonl file -> submit -> poll -> results """
+        write_batch_file(lines, fn)
+        batch = self.submit(fn)
+        if verbose: print(f"  <batch> submitted {len(lines)} requests as {batch.id} (input: {fn})")
+        batch = self.wait(batch.id, verbose=verbose)
+        if batch.status != "completed":
+            print(f"[WARNING] batch {batch.id} ended with status {batch.status}: {batch.errors}")
+        return self.fetch_results(batch)
+
+
+class LocalBatchServer:
+    """ in-process stand-in of the files & batches endpoints, for offline runs/tests or endpoints without a batch API
+    the requests are executed by an `OpenAIClient` (so its cache & rate limiter apply)
+    USAGE:
+        server = LocalBatchServer(llm, max_workers=10)
+        runner = BatchRunner(server.make_client(), poll_interval=0.1)
+    """
+    def __init__(self, llm, max_workers: int = 10) -> None:
+        self.llm = llm
+        self.max_workers = max_workers
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def make_client(self) -> openai.OpenAI:
+        http_client = httpx.Client(transport=httpx.MockTransport(self.handle))
+        return openai.OpenAI(api_key="local", base_url="http://local-batch/v1", http_client=http_client, max_retries=0)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        method, parts = request.method, request.url.path.strip("/").split("/")[1:]     # drop "v1"
+        if method == "POST" and parts == ["files"]:
+            return httpx.Response(200, json=self._create_file(request))
+        if method == "GET" and len(parts) == 3 and parts[0] == "files" and parts[2] == "content":
+            return httpx.Response(200, content=self.files[parts[1]])
+        if method == "POST" and parts == ["batches"]:
+            return httpx.Response(200, json=self._create_batch(json.loads(request.content)))
+        if method == "GET" and len(parts) == 2 and parts[0] == "batches":
+            with self._lock:
+                return httpx.Response(200, json=dict(self.batches[parts[1]]))
+        return httpx.Response(404, json={"error": {"message": f"{method} {request.url.path} not supported"}})
+
+    def _add_file(self, content: bytes) -> str:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self._lock:
+            self.files[file_id] = content
+        return file_id
+
+    def _create_file(self, request: httpx.Request) -> Dict:
+        # multipart form: purpose, file
+        header = f"Content-Type: {request.headers['content-type']}\r\n\r\n".encode()
+        form = email.message_from_bytes(header + request.read())
+        content, filename = b"", None
+        for part in form.get_payload():
+            if part.get_param("name", header="content-disposition") == "file":
+                content, filename = part.get_payload(decode=True), part.get_filename()
+        return {
+            "id": self._add_file(content), "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename or "batch.jsonl", "purpose": "batch", "status": "processed",
+        }
+
+    def _create_batch(self, params: Dict) -> Dict:
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": params["endpoint"], "input_file_id": params["input_file_id"],
+            "completion_window": params["completion_window"], "status": "validating", "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self._lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+        return dict(batch)
+
+    def _run_one(self, line: Dict) -> Dict:
+        body = {k: v for k, v in line["body"].items() if k not in self.llm.extra_body}
+        messages = body.pop("messages")
+        try:
+            chat_completion = self.llm._chat_completion_cached(messages, **body)
+            return {"custom_id": line["custom_id"], "response": {"status_code": 200, "body": chat_completion.model_dump()}, "error": None}
+        except Exception as e:
+            return {"custom_id": line["custom_id"], "response": None, "error": {"code": "request_failed", "message": str(e)}}
+
+    def _run_batch(self, batch_id: str) -> None:
+        batch = self.batches[batch_id]
+        lines = [json.loads(l) for l in self.files[batch["input_file_id"]].decode().splitlines() if l.strip()]
+        with self._lock:
+            batch.update(status="in_progress", in_progress_at=int(time.time()))
+            batch["request_counts"]["total"] = len(lines)
+        outputs, errors = io.StringIO(), io.StringIO()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for item in executor.map(self._run_one, lines):
+                ok = item["error"] is None
+                (outputs if ok else errors).write(json.dumps(item, ensure_ascii=False) + "\n")
+                with self._lock:
+                    batch["request_counts"]["completed" if ok else "failed"] += 1
+        output_file_id = self._add_file(outputs.getvalue().encode())
+        error_file_id = self._add_file(errors.getvalue().encode()) if errors.getvalue() else None
+        with self._lock:
+            batch.update(
+                status="completed", completed_at=int(time.time()),
+                output_file_id=output_file_id, error_file_id=error_file_id,
+            )
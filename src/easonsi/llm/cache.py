@@ -0,0 +1,191 @@
+"""
+Persistent, content-addressed cache of LLM responses (sqlite based)
+
+USAGE:
+    cache = LLMCache("llm_cache.sqlite", max_size_mb=512)
+    key = LLMCache.make_key(model="gpt-4o", messages=[...], temperature=0.0, max_tokens=4096)
+    value = cache.get_or_create(key, lambda: query_upstream())
+"""
+
+import os, json, time, hashlib, sqlite3, threading, asyncio
+from concurrent.futures import Future
+from typing import Dict, Tuple, Callable, Awaitable, Optional, Any
+
+
+class LLMCache:
+    """ on-disk key-value store with size-based LRU eviction
+    - key: sha256 of the request (model, prompt, temperature, max_tokens, extra_body)
+    - value: the serialized response (str)
+    - identical requests in flight are coalesced into one upstream call
+    """
+    fn: str = None
+    max_size: int = 0           # in bytes, 0 for unlimited
+
+    def __init__(self, fn: str, max_size_mb: float = 1024) -> None:
+        self.fn = str(fn)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        os.makedirs(os.path.dirname(os.path.abspath(self.fn)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.fn, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed)")
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        self._inflight: Dict[str, Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(**request) -> str:
+        """ content address of a request. NOTE: all values should be json-serializable """
+        s = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[str]:
+        """ NOTE: call with lock, not counted """
+        row = self._conn.execute("SELECT value FROM cache WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE cache SET accessed=? WHERE key=?", (time.time(), key))
+        return row[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM cache WHERE key=?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self._total_size += size - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self) -> None:
+        """ drop the least recently accessed entries until the size limit is satisfied. NOTE: call with lock """
+        if self.max_size <= 0 or self._total_size <= self.max_size:
+            return
+        cursor = self._conn.execute("SELECT key, size FROM cache ORDER BY accessed ASC")
+        to_delete, freed = [], 0
+        for key, size in cursor:
+            if self._total_size - freed <= self.max_size: break
+            to_delete.append((key,))
+            freed += size
+        cursor.close()
+        self._conn.executemany("DELETE FROM cache WHERE key=?", to_delete)
+        self._total_size -= freed
+        self.evictions += len(to_delete)
+
+    def _acquire_inflight(self, key: str) -> Tuple[Optional[str], Future, bool]:
+        """ -> (the cached value, the in-flight future of `key`, whether the caller owns (should compute) it)
+        NOTE: the cache is checked under the same lock, so a value set after the caller's miss is not re-computed.
+            only the owner counts as a miss, the coalesced callers are hits
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value, None, False
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+                return None, future, True
+            self.hits += 1
+            self.coalesced += 1
+            return None, future, False
+
+    def _release_inflight(self, key: str, future: Future, value: str = None, error: BaseException = None) -> None:
+        """ store the value & resolve the waiters. NOTE: a failed cache write does not lose the value, the waiters get it """
+        try:
+            if error is None:
+                self.set(key, value)
+        except Exception as e:
+            print(f"  <llm_cache> WARNING: failed to write {self.fn}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            if error is None:
+                future.set_result(value)
+            else:
+                future.set_exception(error)
+
+    def get_or_create(self, key: str, f_create: Callable[[], str]) -> str:
+        """ return the cached value, or call `f_create` once for all concurrent callers with the same key """
+        value, future, is_owner = self._acquire_inflight(key)
+        if value is not None:
+            return value
+        if not is_owner:
+            return future.result()
+        try:
+            value = f_create()
+        except BaseException as e:
+            self._release_inflight(key, future, error=e)
+            raise
+        self._release_inflight(key, future, value=value)
+        return value
+
+    async def aget_or_create(self, key: str, f_create: Callable[[], Awaitable[str]]) -> str:
+        """ async version of `get_or_create`, coalesces callers across threads and coroutines """
+        value, future, is_owner = self._acquire_inflight(key)
+        if value is not None:
+            return value
+        if not is_owner:
+            return await asyncio.wrap_future(future)
+        try:
+            value = await f_create()
+        except BaseException as e:
+            self._release_inflight(key, future, error=e)
+            raise
+        self._release_inflight(key, future, value=value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._total_size = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get_stat(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "fn": self.fn,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "size_mb": self._total_size / 1024 / 1024,
+        }
+
+
+_CACHES: Dict[str, LLMCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+def get_cache(fn: str, max_size_mb: float = 1024) -> LLMCache:
+    """ process-wide cache instances, one per file """
+    fn = os.path.abspath(str(fn))
+    with _CACHES_LOCK:
+        if fn not in _CACHES:
+            _CACHES[fn] = LLMCache(fn, max_size_mb=max_size_mb)
+        return _CACHES[fn]
+
+def get_all_cache_stats() -> Dict[str, Dict[str, Any]]:
+    with _CACHES_LOCK:
+        return { fn: cache.get_stat() for fn, cache in _CACHES.items() }
@@ -0,0 +1,85 @@
+"""
+Per-call accounting of LLM calls: tokens, cached tokens, wall time, retries, hedges
+
+USAGE:
+    with collect_call_stats() as stats:     # collects the calls in this thread / asyncio task
+        client.query_one("hello")
+    llm_stat = merge_call_stats(stats)      # {"model", "num_calls", "prompt_tokens", ...}
+"""
+
+import time, contextlib, contextvars
+from typing import Dict, List, Iterator, Optional, Any
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion
+
+_COLLECTOR: contextvars.ContextVar[Optional[List[Dict]]] = contextvars.ContextVar("llm_call_stats", default=None)
+_CURRENT_CALL: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("llm_current_call", default=None)
+
+_SUM_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens", "wall_time", "retries", "num_cache_hits", "num_hedges")
+
+
+@contextlib.contextmanager
+def collect_call_stats() -> Iterator[List[Dict]]:
+    """ collect the stats of all LLM calls made within the block (by the current thread / asyncio task) """
+    stats = []
+    token = _COLLECTOR.set(stats)
+    try:
+        yield stats
+    finally:
+        _COLLECTOR.reset(token)
+
+
+@contextlib.contextmanager
+def track_call(model: str) -> Iterator[Dict]:
+    """ track one (client-level) call: the stat is filled by `note_retry`/`note_upstream`/`note_hedge`/`fill_usage` & then collected """
+    stat = {"model": model, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+            "wall_time": 0.0, "retries": 0, "num_cache_hits": 1, "num_hedges": 0, "estimated": False}
+    collector = _COLLECTOR.get()
+    token = _CURRENT_CALL.set(stat)
+    start = time.perf_counter()
+    try:
+        yield stat
+    finally:
+        _CURRENT_CALL.reset(token)
+        stat["wall_time"] = time.perf_counter() - start
+        if collector is not None:
+            collector.append(stat)
+
+
+def note_upstream() -> None:
+    """ the call reached the endpoint (i.e. not served by the cache) """
+    stat = _CURRENT_CALL.get()
+    if stat is not None: stat["num_cache_hits"] = 0
+
+def note_retry() -> None:
+    stat = _CURRENT_CALL.get()
+    if stat is not None: stat["retries"] += 1
+
+def note_hedge() -> None:
+    """ a duplicate request was sent. NOTE: the tokens of the losing request are billed but not counted """
+    stat = _CURRENT_CALL.get()
+    if stat is not None: stat["num_hedges"] += 1
+
+
+def fill_usage(stat: Dict, chat_completion: ChatCompletion) -> None:
+    """ NOTE: a response served by the cache costs no tokens, its `usage` (the one of the original call) is zeroed """
+    usage = chat_completion.usage
+    stat["model"] = chat_completion.model or stat["model"]
+    if usage is None: return
+    if stat["num_cache_hits"]:
+        chat_completion.usage = CompletionUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+        return
+    stat["prompt_tokens"] = usage.prompt_tokens or 0
+    stat["completion_tokens"] = usage.completion_tokens or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    stat["cached_tokens"] = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+
+def merge_call_stats(stats: List[Dict]) -> Optional[Dict[str, Any]]:
+    """ the stat of a message produced by (possibly several, e.g. parsing retries) LLM calls, None if no calls """
+    if not stats: return None
+    merged = {"model": stats[-1]["model"], "num_calls": len(stats)}
+    for k in _SUM_KEYS:
+        merged[k] = sum(s[k] for s in stats)
+    merged["estimated"] = any(s["estimated"] for s in stats)
+    return merged
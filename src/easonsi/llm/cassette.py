@@ -0,0 +1,136 @@
+"""
+Record/replay ("cassette") of LLM calls, for reproducible & network-free runs
+
+USAGE:
+    cassette = get_cassette("llm_cassette.jsonl")
+    client = CassetteOpenAIClient(model_name="gpt-4o", api_key=..., cassette=cassette, mode="record")   # calls the endpoint
+    client = CassetteOpenAIClient(model_name="gpt-4o", api_key="replay", cassette=cassette, mode="replay", latency=0.1)
+"""
+
+import os, re, json, time, asyncio, threading, collections
+from typing import Dict, List, Tuple, Iterator, AsyncIterator, Any
+from openai.types.chat import ChatCompletion
+from .cache import LLMCache
+from .openai_client import AsyncOpenAIClient
+from .call_stats import note_upstream
+
+# volatile parts of the prompts (e.g. "Current time" in the bot prompt) are masked in the fingerprint
+_RE_DATETIME = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?")
+
+
+class CassetteMissError(KeyError):
+    pass
+
+
+class Cassette:
+    """ jsonl file of recorded calls: {"key", "request", "response", "latency"}
+    a fingerprint can have several recordings (e.g. sampled at temperature > 0), they are replayed in order (cycling)
+    """
+    def __init__(self, fn: str) -> None:
+        self.fn = str(fn)
+        self._lock = threading.Lock()
+        self._records: Dict[str, List[Dict]] = collections.defaultdict(list)
+        self._cursors: Dict[str, int] = collections.defaultdict(int)
+        if os.path.exists(self.fn):
+            with open(self.fn, "r") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._records[record["key"]].append(record)
+
+    @staticmethod
+    def fingerprint(messages: List[Dict], **args) -> str:
+        messages = [
+            {**m, "content": _RE_DATETIME.sub("<datetime>", m["content"])} if isinstance(m.get("content"), str) else m
+            for m in messages
+        ]
+        args = {k: v for k, v in args.items() if k != "stream"}
+        return LLMCache.make_key(messages=messages, **args)
+
+    def record(self, key: str, request: Dict, response: ChatCompletion, latency: float) -> None:
+        record = {"key": key, "request": request, "response": response.model_dump(exclude_unset=True), "latency": latency}
+        with self._lock:
+            self._records[key].append(record)
+            os.makedirs(os.path.dirname(os.path.abspath(self.fn)), exist_ok=True)
+            with open(self.fn, "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def play(self, key: str) -> Tuple[ChatCompletion, float]:
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                raise CassetteMissError(f"request {key} not recorded in {self.fn}")
+            record = records[self._cursors[key] % len(records)]
+            self._cursors[key] += 1
+        return ChatCompletion.model_validate(record["response"]), record["latency"]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._records.values())
+
+
+_CASSETTES: Dict[str, Cassette] = {}
+_CASSETTES_LOCK = threading.Lock()
+
+def get_cassette(fn: str) -> Cassette:
+    """ process-wide cassette instances, one per file """
+    fn = os.path.abspath(str(fn))
+    with _CASSETTES_LOCK:
+        if fn not in _CASSETTES:
+            _CASSETTES[fn] = Cassette(fn)
+        return _CASSETTES[fn]
+
+
+class CassetteOpenAIClient(AsyncOpenAIClient):
+    """ client that records all calls to a cassette (mode=record), or serves them from it without network (mode=replay)
+    latency (replay): None for the recorded latency, or fixed seconds
+    NOTE: streaming is served from the full (recorded) completion, so that streamed & non-streamed runs share recordings
+    """
+    cassette: Cassette = None
+    mode: str = "replay"
+    latency: float = None
+
+    def __init__(self, *args, cassette: Cassette = None, mode: str = "replay", latency: float = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert mode in ("record", "replay"), f"Unknown cassette mode: {mode}"
+        assert cassette is not None, "cassette is None"
+        self.cassette, self.mode, self.latency = cassette, mode, latency
+
+    def _replay_latency(self, recorded: float) -> float:
+        return recorded if self.latency is None else self.latency
+
+    def _chat_completion(self, messages: List[Dict], **args) -> ChatCompletion:
+        key = Cassette.fingerprint(messages, **args)
+        if self.mode == "replay":
+            note_upstream()
+            chat_completion, latency = self.cassette.play(key)
+            time.sleep(self._replay_latency(latency))
+            return chat_completion
+        start = time.perf_counter()
+        chat_completion = super()._chat_completion(messages, **args)
+        self.cassette.record(key, {"messages": messages, **args}, chat_completion, time.perf_counter() - start)
+        return chat_completion
+
+    async def _achat_completion(self, messages: List[Dict], **args) -> ChatCompletion:
+        key = Cassette.fingerprint(messages, **args)
+        if self.mode == "replay":
+            note_upstream()
+            chat_completion, latency = self.cassette.play(key)
+            await asyncio.sleep(self._replay_latency(latency))
+            return chat_completion
+        start = time.perf_counter()
+        chat_completion = await super()._achat_completion(messages, **args)
+        await asyncio.to_thread(
+            self.cassette.record, key, {"messages": messages, **args}, chat_completion, time.perf_counter() - start
+        )
+        return chat_completion
+
+    def query_one_stream_generator(self, text, stop=None, **args) -> Iterator[str]:
+        if stop is not None: args["stop"] = stop
+        yield self.query_one(text, **args)
+
+    async def query_one_stream_generator_async(self, text, stop=None, **args) -> AsyncIterator[str]:
+        if stop is not None: args["stop"] = stop
+        async def stream():
+            yield await self.query_one_async(text, **args)
+        return stream()
@@ -0,0 +1,199 @@
+"""
+Process-wide registry of OpenAI clients, to share HTTP connection pools across roles & conversations
+
+USAGE:
+    client = LLMClientRegistry.get_openai(base_url, api_key, model_name, max_connections=200)
+    print(LLMClientRegistry.get_stats())
+NOTE: the connections of an async client belong to the event loop using them, so the async clients are shared per running loop
+    (e.g. the two `asyncio.run` of the simulations & the judges get their own clients)
+"""
+
+import time, asyncio, threading, importlib.util
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, Union, Any
+import httpx, openai
+
+# the first event after a request got a connection from the pool (a new one or a reused one)
+_ACQUIRED_EVENTS = {
+    "connection.connect_tcp.started",
+    "http11.send_request_headers.started",
+    "http2.send_request_headers.started",
+}
+
+
+@dataclass
+class PoolOptions:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+
+    def to_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+class PoolStat:
+    """ request counters & pool wait time of a transport """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.in_flight = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def on_start(self) -> None:
+        with self._lock:
+            self.num_requests += 1
+            self.in_flight += 1
+
+    def on_acquired(self, wait: float) -> None:
+        with self._lock:
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def on_end(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "num_requests": self.num_requests,
+            "in_flight": self.in_flight,
+            "avg_wait": self.total_wait / self.num_requests if self.num_requests else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+def _pool_stat(pool) -> Dict[str, int]:
+    """ connection infos of a httpcore (Async)ConnectionPool """
+    connections = list(pool.connections)
+    return {
+        "open_connections": len(connections),
+        "idle_connections": sum(1 for c in connections if c.is_idle()),
+        "queued_requests": sum(1 for r in list(pool._requests) if r.is_queued()),
+    }
+
+
+class StatHTTPTransport(httpx.HTTPTransport):
+    """ httpx transport recording the time each request waits for a pooled connection """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stat = PoolStat()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start, acquired = time.perf_counter(), []
+        def trace(event_name, info):
+            if not acquired and event_name in _ACQUIRED_EVENTS:
+                acquired.append(True)
+                self.stat.on_acquired(time.perf_counter() - start)
+        request.extensions["trace"] = trace
+        self.stat.on_start()
+        try:
+            return super().handle_request(request)
+        finally:
+            self.stat.on_end()
+
+    def get_stat(self) -> Dict[str, Any]:
+        return {**self.stat.to_dict(), **_pool_stat(self._pool)}
+
+
+class AsyncStatHTTPTransport(httpx.AsyncHTTPTransport):
+    """ async version of `StatHTTPTransport` """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stat = PoolStat()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start, acquired = time.perf_counter(), []
+        async def trace(event_name, info):
+            if not acquired and event_name in _ACQUIRED_EVENTS:
+                acquired.append(True)
+                self.stat.on_acquired(time.perf_counter() - start)
+        request.extensions["trace"] = trace
+        self.stat.on_start()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.stat.on_end()
+
+    def get_stat(self) -> Dict[str, Any]:
+        return {**self.stat.to_dict(), **_pool_stat(self._pool)}
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class LLMClientRegistry:
+    """ shared, thread-safe openai clients keyed by (base_url, api_key, model_name, is_async, loop)
+    NOTE: the pool options of the first request of a key take effect
+    NOTE: the SDK-level retries are disabled, `OpenAIClient` retries itself (with the shared rate limiter)
+    NOTE: the async clients are keyed by the running loop (call `get_openai` from the loop), the ones of closed loops are dropped
+    """
+    _clients: Dict[Tuple, Union[openai.OpenAI, openai.AsyncOpenAI]] = {}
+    _transports: Dict[Tuple, Union[StatHTTPTransport, AsyncStatHTTPTransport]] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _check_http2(http2: bool) -> bool:
+        if http2 and importlib.util.find_spec("h2") is None:
+            print(f"[WARNING] http2 requires the `h2` package (pip install httpx[http2]), fall back to HTTP/1.1")
+            return False
+        return http2
+
+    @classmethod
+    def get_openai(
+        cls, base_url: str, api_key: str, model_name: str, is_async: bool = False, **pool_kwargs
+    ) -> Union[openai.OpenAI, openai.AsyncOpenAI]:
+        key = (base_url, api_key, model_name, is_async, _running_loop() if is_async else None)
+        with cls._lock:
+            if key not in cls._clients:
+                if is_async: cls._drop_closed_loops()
+                options = PoolOptions(**pool_kwargs)
+                http2 = cls._check_http2(options.http2)
+                if is_async:
+                    transport = AsyncStatHTTPTransport(limits=options.to_limits(), http2=http2)
+                    client = openai.AsyncOpenAI(
+                        api_key=api_key, base_url=base_url, max_retries=0,
+                        http_client=openai.DefaultAsyncHttpxClient(transport=transport),
+                    )
+                else:
+                    transport = StatHTTPTransport(limits=options.to_limits(), http2=http2)
+                    client = openai.OpenAI(
+                        api_key=api_key, base_url=base_url, max_retries=0,
+                        http_client=openai.DefaultHttpxClient(transport=transport),
+                    )
+                cls._clients[key] = client
+                cls._transports[key] = transport
+            return cls._clients[key]
+
+    @classmethod
+    def _drop_closed_loops(cls) -> None:
+        """ NOTE: the connections of a closed loop cannot be closed anymore, they are released with the client """
+        for key in [key for key in cls._clients if key[-1] is not None and key[-1].is_closed()]:
+            del cls._clients[key], cls._transports[key]
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, Any]]:
+        """ pool statistics of each client: open/idle connections, queued/in-flight requests, wait time """
+        with cls._lock:
+            items = list(cls._transports.items())
+        stats = {}
+        for (base_url, api_key, model_name, is_async, loop), transport in items:
+            name = f"{model_name}@{base_url}" + (" (async)" if is_async else "")
+            if name in stats: name += f" #{sum(k.startswith(name) for k in stats) + 1}"      # e.g. several running loops
+            stats[name] = transport.get_stat()
+        return stats
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._clients.clear()
+            cls._transports.clear()
@@ -0,0 +1,166 @@
+"""
+Hedged requests: once a call is slower than the (adaptive) p95 latency of its model, send a duplicate and take the first response
+
+USAGE:
+    hedger = get_hedger("gpt-4o", quantile=0.95, max_ratio=0.1)
+    res = hedger.run(lambda: client.chat.completions.create(...))            # or `await hedger.arun(lambda: ...)`
+    print(get_all_hedger_stats())
+NOTE: hedge the HTTP request only (below the rate limiter & the retries), so that limiter waits are not counted as latency
+"""
+
+import time, math, queue, asyncio, threading, collections, contextvars
+from typing import Dict, Callable, Awaitable, Optional, TypeVar, Any
+from .call_stats import note_hedge
+
+T = TypeVar("T")
+
+
+class Hedger:
+    """ hedging policy & latency estimate of one model
+    - the hedge delay is the `quantile` of the last `window` latencies (no hedging during the first `min_samples` calls)
+    - at most `max_ratio` of the calls are hedged
+    NOTE: in the thread engine the losing call is not interrupted (its result is dropped), in asyncio it is cancelled
+    """
+    def __init__(self, quantile: float = 0.95, max_ratio: float = 0.1, window: int = 500, min_samples: int = 20) -> None:
+        assert 0 < quantile < 1, f"quantile should be in (0, 1): {quantile}"
+        self.quantile, self.max_ratio, self.min_samples = quantile, max_ratio, min_samples
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.num_hedges = 0
+        self.num_wins = 0       # the hedge returned first
+
+    def delay(self) -> Optional[float]:
+        """ seconds to wait before hedging, None while warming up """
+        with self._lock:
+            if len(self._latencies) < self.min_samples: return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, math.ceil(self.quantile * len(latencies)) - 1)]
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _start(self) -> None:
+        with self._lock:
+            self.num_requests += 1
+
+    def _can_hedge(self) -> bool:
+        with self._lock:
+            return self.num_hedges + 1 <= self.max_ratio * self.num_requests
+
+    def _acquire_hedge(self) -> bool:
+        """ take one hedge from the budget `max_ratio * num_requests` """
+        with self._lock:
+            if self.num_hedges + 1 > self.max_ratio * self.num_requests: return False
+            self.num_hedges += 1
+            return True
+
+    def _on_win(self) -> None:
+        with self._lock:
+            self.num_wins += 1
+
+    def _timed(self, fn: Callable[[], T]) -> T:
+        start = time.perf_counter()
+        res = fn()
+        self.record(time.perf_counter() - start)
+        return res
+
+    async def _atimed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        start = time.perf_counter()
+        res = await fn()
+        self.record(time.perf_counter() - start)
+        return res
+
+    def run(self, fn: Callable[[], T]) -> T:
+        """ call `fn`, and a duplicate of it if it is slow
+        NOTE: while no hedge can follow (warming up, or the budget is spent) `fn` runs on the caller's thread. Otherwise the
+            calls run in their own threads (with a copy of the caller's context), so that the first response is returned
+            right away; a losing call keeps its thread until its request ends
+        """
+        self._start()
+        delay = self.delay()
+        if delay is None or not self._can_hedge():
+            return self._timed(fn)
+        outcomes = queue.SimpleQueue()
+        def call(is_hedge: bool):
+            try:
+                outcomes.put((is_hedge, self._timed(fn), None))
+            except Exception as e:
+                outcomes.put((is_hedge, None, e))
+        def start(is_hedge: bool):
+            ctx = contextvars.copy_context()
+            threading.Thread(target=ctx.run, args=(call, is_hedge), name="llm-hedge", daemon=True).start()
+
+        start(False)
+        num_calls = 1
+        try:
+            outcome = outcomes.get(timeout=delay)
+        except queue.Empty:
+            if self._acquire_hedge():
+                note_hedge()
+                start(True)
+                num_calls = 2
+            outcome = outcomes.get()
+        errors = []
+        while True:
+            is_hedge, res, error = outcome
+            if error is None:
+                if is_hedge: self._on_win()
+                return res
+            errors.append(error)
+            if len(errors) == num_calls: raise errors[0]
+            outcome = outcomes.get()
+
+    async def arun(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """ async version of `run`, the slower call is cancelled """
+        self._start()
+        delay = self.delay()
+        if delay is None or not self._can_hedge():
+            return await self._atimed(fn)
+        primary = asyncio.ensure_future(self._atimed(fn))
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done or not self._acquire_hedge():
+            return await primary
+        note_hedge()
+        hedge = asyncio.ensure_future(self._atimed(fn))
+        pending, errors = {primary, hedge}, []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    if task is hedge: self._on_win()
+                    return task.result()
+            raise errors[0]
+        finally:
+            for task in pending: task.cancel()
+
+    def get_stat(self) -> Dict[str, Any]:
+        delay = self.delay()
+        with self._lock:
+            return {
+                "num_requests": self.num_requests,
+                "num_hedges": self.num_hedges,
+                "num_wins": self.num_wins,
+                "hedge_ratio": self.num_hedges / self.num_requests if self.num_requests else 0.0,
+                "hedge_delay": delay,
+            }
+
+
+_HEDGERS: Dict[str, Hedger] = {}
+_HEDGERS_LOCK = threading.Lock()
+
+def get_hedger(model_name: str, **kwargs) -> Hedger:
+    """ process-wide hedger per model. NOTE: the options of the first call take effect """
+    with _HEDGERS_LOCK:
+        if model_name not in _HEDGERS:
+            _HEDGERS[model_name] = Hedger(**kwargs)
+        return _HEDGERS[model_name]
+
+def get_all_hedger_stats() -> Dict[str, Dict[str, Any]]:
+    with _HEDGERS_LOCK:
+        items = list(_HEDGERS.items())
+    return {model_name: hedger.get_stat() for model_name, hedger in items}
@@ -0,0 +1,279 @@
+"""
+Load balancing & failover over several endpoints (replicas / provider keys) of one logical model
+
+USAGE:
+    pool = get_endpoint_pool("Qwen/Qwen3-8B", [
+        {"base_url": "http://vllm-0:8000/v1", "api_key": "EMPTY", "weight": 1},
+        {"base_url": "http://vllm-1:8000/v1", "api_key": "EMPTY", "weight": 2},
+    ], health_check_interval=30)
+    client = BalancedOpenAIClient(model_name="Qwen/Qwen3-8B", pool=pool)
+    print(get_all_endpoint_pool_stats())
+"""
+
+import time, asyncio, threading, collections
+from typing import Dict, List, Tuple, Set, Any
+import httpx, openai
+from openai.types.chat import ChatCompletion
+from .client_registry import LLMClientRegistry
+from .rate_limiter import RateLimiter, get_rate_limiter, estimate_tokens, jittered_backoff, parse_retry_after
+from .openai_client import AsyncOpenAIClient
+from .call_stats import note_upstream, note_retry
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """ the endpoint is (probably) unhealthy: 5xx, timeouts, connection errors """
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError))     # incl. openai.APITimeoutError
+
+
+class CircuitBreaker:
+    """ closed --(`failure_threshold` consecutive failures)--> open --(`recovery_time`)--> half-open (one probe request)
+    --> closed on success / open again on failure
+    NOTE: not thread-safe, guarded by the lock of the `EndpointPool`
+    """
+    def __init__(self, failure_threshold: int = 3, recovery_time: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = "closed"
+        self.n_failures = 0
+        self.opened_at = 0.0
+        self.num_opened = 0
+
+    def is_available(self, now: float) -> bool:
+        if self.state == "closed": return True
+        if self.state == "open": return now - self.opened_at >= self.recovery_time
+        return False        # half-open: the probe is in flight
+
+    def on_acquire(self) -> None:
+        if self.state == "open": self.state = "half_open"
+
+    def on_success(self) -> None:
+        self.state, self.n_failures = "closed", 0
+
+    def on_failure(self, now: float) -> None:
+        self.n_failures += 1
+        if self.state == "open":        # e.g. a failed health check: stay open
+            self.opened_at = now
+        elif self.state == "half_open" or self.n_failures >= self.failure_threshold:
+            self.state, self.opened_at = "open", now
+            self.num_opened += 1
+
+
+class Endpoint:
+    """ one replica / provider key of a model. The openai clients are shared by `LLMClientRegistry` """
+    def __init__(
+        self, model_name: str, base_url: str, api_key: str, weight: float = 1.0, name: str = None,
+        rate_limiter: RateLimiter = None, breaker: CircuitBreaker = None, pool_kwargs: Dict = None,
+    ) -> None:
+        assert weight > 0, f"weight of {base_url} should be positive"
+        self.model_name, self.base_url, self.api_key, self.weight = model_name, base_url, api_key, weight
+        self.name = name or base_url
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.pool_kwargs = pool_kwargs or {}
+        self.in_flight = 0
+        self.num_requests = 0
+        self.num_failures = 0
+
+    @property
+    def client(self) -> openai.OpenAI:
+        return LLMClientRegistry.get_openai(self.base_url, self.api_key, self.model_name, **self.pool_kwargs)
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        return LLMClientRegistry.get_openai(self.base_url, self.api_key, self.model_name, is_async=True, **self.pool_kwargs)
+
+    def load(self) -> float:
+        return (self.in_flight + 1) / self.weight
+
+    def get_stat(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight, "state": self.breaker.state, "in_flight": self.in_flight,
+            "num_requests": self.num_requests, "num_failures": self.num_failures, "num_opened": self.breaker.num_opened,
+        }
+
+
+class EndpointPool:
+    """ routes each request to the healthy endpoint with the least outstanding requests (per unit of weight)
+    - endpoints failing with 5xx / timeouts are taken out by their circuit breaker, and probed again after `recovery_time`
+    - with `health_check_interval`, a background thread also pings `GET /models` of each endpoint
+    """
+    def __init__(self, endpoints: List[Endpoint]) -> None:
+        assert endpoints, "no endpoints"
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+        self._health_thread: threading.Thread = None
+
+    def acquire(self, exclude: Set[str] = frozenset()) -> Endpoint:
+        """ pick an endpoint for one request (prefer the ones not in `exclude`, i.e. already tried), call `release` after it """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e.breaker.is_available(now)]
+            if not candidates:      # all open: probe the one opened first, rather than failing
+                candidates = [min(self.endpoints, key=lambda e: e.breaker.opened_at)]
+            candidates = [e for e in candidates if e.name not in exclude] or candidates
+            # endpoints blocked by a 429 go last
+            endpoint = min(candidates, key=lambda e: (e.rate_limiter is not None and e.rate_limiter.blocked_for() > 0, e.load()))
+            endpoint.breaker.on_acquire()
+            endpoint.in_flight += 1
+            endpoint.num_requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, error: Exception = None) -> None:
+        """ NOTE: only 5xx / timeouts count as failures, other errors (e.g. 400, 429) show that the endpoint is alive """
+        with self._lock:
+            endpoint.in_flight -= 1
+            if error is not None and is_endpoint_failure(error):
+                endpoint.num_failures += 1
+                endpoint.breaker.on_failure(time.monotonic())
+            else:
+                endpoint.breaker.on_success()
+
+    def has_alternative(self, endpoint: Endpoint) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            return any(e is not endpoint and e.breaker.is_available(now) for e in self.endpoints)
+
+    def check_health(self, timeout: float = 5.0) -> Dict[str, bool]:
+        """ ping each endpoint, close the breakers of the healthy ones & count failures of the others """
+        res = {}
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.with_options(timeout=timeout).models.list()
+                ok = True
+            except Exception as e:
+                ok = not is_endpoint_failure(e)     # e.g. 404 if `/models` is not served
+            with self._lock:
+                if ok:
+                    if endpoint.breaker.state != "half_open": endpoint.breaker.on_success()
+                else:
+                    endpoint.breaker.on_failure(time.monotonic())
+            res[endpoint.name] = ok
+        return res
+
+    def start_health_checks(self, interval: float) -> None:
+        """ run `check_health` every `interval` seconds in a daemon thread (once per pool) """
+        with self._lock:
+            if self._health_thread is not None: return
+            def loop():
+                while True:
+                    time.sleep(interval)
+                    self.check_health()
+            self._health_thread = threading.Thread(target=loop, name="llm-health-check", daemon=True)
+            self._health_thread.start()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {e.name: e.get_stat() for e in self.endpoints}
+
+
+_POOLS: Dict[Tuple, EndpointPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_endpoint_pool(
+    model_name: str, endpoints: List[Dict], pool_kwargs: Dict = None, rpm: int = None, tpm: int = None,
+    failure_threshold: int = 3, recovery_time: float = 30.0, health_check_interval: float = None,
+) -> EndpointPool:
+    """ process-wide pool per (model_name, endpoints). NOTE: the options of the first call take effect
+    endpoints: [{"base_url", "api_key", ["weight"], ["rpm"], ["tpm"]}], each endpoint has its own rate limiter
+    """
+    key = (model_name, tuple((e["base_url"], e.get("api_key")) for e in endpoints))
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            n_urls = collections.Counter(e["base_url"] for e in endpoints)
+            _endpoints = []
+            for i, e in enumerate(endpoints):
+                # several provider keys of the same base_url are distinct endpoints (with their own limits)
+                name = e["base_url"] if n_urls[e["base_url"]] == 1 else f"{e['base_url']}#{i}"
+                _endpoints.append(Endpoint(
+                    model_name, e["base_url"], e.get("api_key"), weight=e.get("weight", 1.0), name=name,
+                    rate_limiter=get_rate_limiter(model_name, name, rpm=e.get("rpm", rpm), tpm=e.get("tpm", tpm)),
+                    breaker=CircuitBreaker(failure_threshold, recovery_time), pool_kwargs=pool_kwargs,
+                ))
+            _POOLS[key] = EndpointPool(_endpoints)
+            if health_check_interval:
+                _POOLS[key].start_health_checks(health_check_interval)
+        return _POOLS[key]
+
+def get_all_endpoint_pool_stats() -> Dict[str, Dict[str, Any]]:
+    with _POOLS_LOCK:
+        items = list(_POOLS.items())
+    return {
+        f"{model_name}@{name}": stat
+        for (model_name, _), pool in items for name, stat in pool.get_stats().items()
+    }
+
+
+class BalancedOpenAIClient(AsyncOpenAIClient):
+    """ client of a model served by several endpoints (see `EndpointPool`)
+    on 5xx / timeouts / 429 the request fails over to another endpoint right away (up to `max_failovers` times),
+    then retries with backoff as `OpenAIClient` does
+    NOTE: a streamed request counts as outstanding until its response headers are received
+    """
+    pool: EndpointPool = None
+    max_failovers: int = None       # default: the number of endpoints
+
+    def __init__(self, *args, pool: EndpointPool = None, **kwargs):
+        assert pool is not None, "pool is None"
+        endpoint = pool.endpoints[0]
+        kwargs.setdefault("base_url", endpoint.base_url)
+        kwargs.setdefault("api_key", endpoint.api_key)
+        super().__init__(*args, client=endpoint.client, **kwargs)
+        self.pool = pool
+        if self.max_failovers is None: self.max_failovers = len(pool.endpoints)
+
+    def _failover_delay(self, endpoint: Endpoint, error: Exception, n_failed: Dict[str, int]) -> float:
+        """ 0 to switch to another endpoint, or the delay of a normal retry (raise if the retry budget is used up) """
+        if (is_endpoint_failure(error) or isinstance(error, openai.RateLimitError)) \
+                and n_failed["failover"] < self.max_failovers and self.pool.has_alternative(endpoint):
+            n_failed["failover"] += 1
+            note_retry()
+            if isinstance(error, openai.RateLimitError) and endpoint.rate_limiter is not None:
+                delay = parse_retry_after(error.response.headers)
+                endpoint.rate_limiter.penalize(jittered_backoff(self.backoff_factor, 0) if delay is None else delay)
+            print(f"Request to {endpoint.name} failed with error: {error}, failing over")
+            return 0.0
+        return self._retry_delay(error, n_failed, rate_limiter=endpoint.rate_limiter)
+
+    def _chat_completion(self, messages: List[Dict], **args) -> ChatCompletion:
+        note_upstream()
+        n_tokens = estimate_tokens(messages)
+        n_failed = {"rate_limit": 0, "other": 0, "failover": 0}
+        tried = set()
+        while True:
+            endpoint = self.pool.acquire(exclude=tried)
+            tried.add(endpoint.name)
+            try:
+                if endpoint.rate_limiter is not None:
+                    time.sleep(endpoint.rate_limiter.reserve(n_tokens))
+                chat_completion = self._create(endpoint.client, messages, **args)
+            except BaseException as e:
+                self.pool.release(endpoint, e)
+                if not isinstance(e, Exception): raise
+                time.sleep(self._failover_delay(endpoint, e, n_failed))
+                continue
+            self.pool.release(endpoint)
+            self._record_usage(n_tokens, chat_completion, rate_limiter=endpoint.rate_limiter)
+            return chat_completion
+
+    async def _achat_completion(self, messages: List[Dict], **args) -> ChatCompletion:
+        note_upstream()
+        n_tokens = estimate_tokens(messages)
+        n_failed = {"rate_limit": 0, "other": 0, "failover": 0}
+        tried = set()
+        while True:
+            endpoint = self.pool.acquire(exclude=tried)
+            tried.add(endpoint.name)
+            try:
+                if endpoint.rate_limiter is not None:
+                    await asyncio.sleep(endpoint.rate_limiter.reserve(n_tokens))
+                chat_completion = await self._acreate(endpoint.async_client, messages, **args)
+            except BaseException as e:     # incl. asyncio.CancelledError
+                self.pool.release(endpoint, e)
+                if not isinstance(e, Exception): raise
+                await asyncio.sleep(self._failover_delay(endpoint, e, n_failed))
+                continue
+            self.pool.release(endpoint)
+            self._record_usage(n_tokens, chat_completion, rate_limiter=endpoint.rate_limiter)
+            return chat_completion
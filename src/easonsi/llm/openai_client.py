@@ -2,9 +2,14 @@
 https://github.com/openai/openai-python
 """
 
-import sys, os, json, re, time, yaml, openai, traceback
+import sys, os, json, re, time, yaml, openai, traceback, asyncio
 from openai.types.chat import ChatCompletion
-from typing import Dict, Union, Tuple
+from typing import Dict, List, Union, Tuple, Iterator, AsyncIterator
+from .cache import LLMCache
+from .rate_limiter import RateLimiter, estimate_tokens, jittered_backoff, parse_retry_after
+from .call_stats import track_call, note_retry, note_upstream, fill_usage
+from .hedging import Hedger
+from .client_registry import LLMClientRegistry
 
 class Formater:
     """ 用于从字符串中提取信息, 比如规范GPT输出的结果 """
@@ -65,8 +70,12 @@ class Formater:
 
 def stream_generator(response, is_openai=True):
     if is_openai:
-        for chunk in response:
-            yield chunk.choices[0].delta.content or ""
+        try:
+            for chunk in response:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+        finally:    # NOTE: closing the generator (e.g. early stop) also closes the HTTP response
+            response.close()
     else:
         ret = ""
         for chunk in response.iter_lines():
@@ -75,31 +84,52 @@ def stream_generator(response, is_openai=True):
             yield chunk_ret[len(ret):]
             ret = chunk_ret
 
+async def astream_generator(response):
+    """ async version of `stream_generator` (openai) """
+    try:
+        async for chunk in response:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
+    finally:
+        await response.close()
+
 class OpenAIClient:
     base_url: str = "https://api.openai.com/v1"
     model_name: str = "gpt-4o"
     client: openai.OpenAI = None
     temperature: float = 0.5
     max_tokens: int = 4096
+    extra_body: Dict = {"enable_thinking": False}
 
     use_cache: bool = False
+    cache: LLMCache = None
+    rate_limiter: RateLimiter = None
+    hedger: Hedger = None           # hedge slow (non-streamed) calls with a duplicate request
     retries: int = 3
+    rate_limit_retries: int = 20    # separate budget for 429s, which are expected under load
     backoff_factor: float = 0.5
     n_thread:int = 5
     
     def __init__(
         self, model_name:str=None, temperature:float=None, max_tokens:int=None,
         base_url=f"https://api.openai.com/v1", api_key=None, print_url=False, 
+        cache: LLMCache=None, client: openai.OpenAI=None, rate_limiter: RateLimiter=None, hedger: Hedger=None,
     ):
         if not api_key:
             print(f"[WARNING] api_key is None, please set it in the environment variable (OPENAI_API_KEY) or pass it as a parameter.")
         if print_url:
             print(f"[INFO] base_url: {base_url}")
         self.base_url = base_url
-        self.client = openai.OpenAI(api_key=api_key, base_url=base_url)
+        # NOTE: the (thread-safe) `client` can be shared to reuse its connection pool
+        self.client = client if client is not None else openai.OpenAI(api_key=api_key, base_url=base_url)
         if model_name: self.model_name = model_name
-        if temperature: self.temperature = temperature
+        if temperature is not None: self.temperature = temperature
         if max_tokens: self.max_tokens = max_tokens
+        if cache is not None:
+            self.cache = cache
+            self.use_cache = True
+        if rate_limiter is not None: self.rate_limiter = rate_limiter
+        if hedger is not None: self.hedger = hedger
 
     def query_one_raw(self, text, **args) -> ChatCompletion:
         model = self.model_name
@@ -108,32 +138,82 @@ class OpenAIClient:
         chat_completion = self.client.chat.completions.create(
             messages=[{"role": "user", "content": text}],
             model=model,
-            extra_body={"enable_thinking": False},
+            extra_body=self.extra_body,
             **args
         )
         return chat_completion
 
-    def query_one(self, query, return_model=False, return_usage=False, **args) -> Union[str, Tuple[str, ...]]:
-        # _key = f"{self.model_name}-{text}"
-        # if self.use_cache and _key in cache:
-        #     return cache.get(_key)
+    def _retry_delay(self, error: Exception, n_failed: Dict[str, int], rate_limiter: RateLimiter=None) -> float:
+        """ seconds to wait before retrying after `error`, raise if the retry budget is used up
+        NOTE: 429s have their own budget `rate_limit_retries`, honour `Retry-After` and block the shared `rate_limiter`
+        """
+        note_retry()
+        rate_limiter = rate_limiter or self.rate_limiter
+        if isinstance(error, openai.RateLimitError):
+            n_failed["rate_limit"] += 1
+            if n_failed["rate_limit"] > self.rate_limit_retries:
+                raise Exception(f"Still rate limited after {self.rate_limit_retries} retries.") from error
+            delay = parse_retry_after(error.response.headers)
+            if delay is None: delay = jittered_backoff(self.backoff_factor, min(n_failed["rate_limit"] - 1, 6))
+            if rate_limiter is not None:
+                rate_limiter.penalize(delay)
+                return 0.0      # the wait is applied in the next `rate_limiter.reserve()`
+            return delay
+        n_failed["other"] += 1
+        print(f"Attempt {n_failed['other']} failed with error: {error}")
+        if n_failed["other"] >= self.retries:
+            raise Exception(f"Failed to get response after {self.retries} attempts.") from error
+        return jittered_backoff(self.backoff_factor, n_failed["other"] - 1)
+
+    def _record_usage(self, n_tokens: int, chat_completion: ChatCompletion, rate_limiter: RateLimiter=None) -> None:
+        # NOTE: no usage for streamed responses
+        rate_limiter = rate_limiter or self.rate_limiter
+        if rate_limiter is not None and getattr(chat_completion, "usage", None) is not None:
+            rate_limiter.record_usage(n_tokens, chat_completion.usage.total_tokens)
+
+    def _chat_completion(self, messages: List[Dict], **args) -> ChatCompletion:
+        """ the single upstream call, with rate limiting & retry """
+        note_upstream()
+        n_tokens = estimate_tokens(messages)
+        n_failed = {"rate_limit": 0, "other": 0}
+        while True:
+            if self.rate_limiter is not None:
+                time.sleep(self.rate_limiter.reserve(n_tokens))
+            try:
+                chat_completion = self._create(self.client, messages, **args)
+                self._record_usage(n_tokens, chat_completion)
+                return chat_completion
+            except Exception as e:
+                time.sleep(self._retry_delay(e, n_failed))
+
+    def _create(self, client: openai.OpenAI, messages: List[Dict], **args) -> ChatCompletion:
+        """ the HTTP request, hedged with a duplicate if it is slow (not for streams) """
+        def create():
+            return client.chat.completions.create(messages=messages, extra_body=self.extra_body, **args)
+        if self.hedger is None or args.get("stream"):
+            return create()
+        return self.hedger.run(create)
+
+    def _chat_completion_cached(self, messages: List[Dict], **args) -> ChatCompletion:
+        if not (self.use_cache and self.cache is not None):
+            return self._chat_completion(messages, **args)
+        key = LLMCache.make_key(messages=messages, extra_body=self.extra_body, **args)
+        value = self.cache.get_or_create(key, lambda: self._chat_completion(messages, **args).model_dump_json())
+        return ChatCompletion.model_validate_json(value)
+
+    @staticmethod
+    def _to_messages(query: Union[str, List[Dict]]) -> List[Dict]:
+        """ a prompt string is sent as one user message, a list of chat messages as is """
+        return [{"role": "user", "content": query}] if isinstance(query, str) else query
+
+    def _default_args(self, args: Dict) -> Dict:
         if "model" not in args: args["model"] = self.model_name
         if "max_tokens" not in args: args["max_tokens"] = self.max_tokens
         if "temperature" not in args: args["temperature"] = self.temperature
-        for attempt in range(self.retries):
-            try:
-                chat_completion: ChatCompletion = self.client.chat.completions.create(
-                    messages=[{"role": "user", "content": query}],
-                    extra_body={"enable_thinking": False},
-                    **args
-                )
-                # cache.set(_key, res)
-                break
-            except Exception as e:
-                print(f"Attempt {attempt + 1} failed with error: {e}")
-                time.sleep(self.backoff_factor * (2 ** attempt))
-        else:
-            raise Exception(f"Failed to get response after {self.retries} attempts.")
+        return args
+
+    @staticmethod
+    def _format_output(chat_completion: ChatCompletion, return_model=False, return_usage=False) -> Union[str, Tuple[str, ...]]:
         if not return_model and not return_usage:
             return chat_completion.choices[0].message.content
         res = (chat_completion.choices[0].message.content, )
@@ -142,18 +222,39 @@ class OpenAIClient:
             res = res + (chat_completion.model, )
             if return_usage: res = res + (chat_completion.usage.to_dict(), )
         return res
+
+    def query_one(self, query, return_model=False, return_usage=False, **args) -> Union[str, Tuple[str, ...]]:
+        """ query: a prompt string, or a list of chat messages
+        NOTE: the tokens/latency/retries of the call are recorded, see `call_stats.collect_call_stats` """
+        args = self._default_args(args)
+        with track_call(args["model"]) as stat:
+            chat_completion: ChatCompletion = self._chat_completion_cached(
+                self._to_messages(query), **args
+            )
+            fill_usage(stat, chat_completion)
+        return self._format_output(chat_completion, return_model=return_model, return_usage=return_usage)
     
-    def query_one_stream_generator(self, text, stop=None) -> None:
-        response = self.client.chat.completions.create(
-            messages=[{ "role": "user", "content": text,}],
-            model=self.model_name,
-            temperature=self.temperature,
-            extra_body={"enable_thinking": False},
-            stream=True,
-            stop=stop
-        )
+    def query_one_stream_generator(self, text, stop=None, **args) -> Iterator[str]:
+        """ stream the output tokens (with rate limiting & retry on connection). NOTE: not cached """
+        args = self._default_args(args)
+        messages = self._to_messages(text)
+        with track_call(args["model"]) as stat:
+            response = self._chat_completion(messages, stream=True, stop=stop, **args)
         stream = stream_generator(response, is_openai=True)
-        return stream
+        return self._track_stream(stream, stat, messages)
+
+    @staticmethod
+    def _track_stream(stream: Iterator[str], stat: Dict, messages: List[Dict]) -> Iterator[str]:
+        """ complete the stat of a streamed call when the stream is exhausted/closed. NOTE: tokens are estimated """
+        start, text = time.perf_counter(), ""
+        try:
+            for delta in stream:
+                text += delta
+                yield delta
+        finally:
+            stream.close()
+            stat.update(prompt_tokens=estimate_tokens(messages), completion_tokens=len(text) // 4, estimated=True)
+            stat["wall_time"] += time.perf_counter() - start
     
     def query_one_stream(self, text, stop=None, print_stream=True) -> None:
         res = ""
@@ -165,3 +266,85 @@ class OpenAIClient:
         if print_stream: print("\n")
         return res
 
+
+
+class AsyncOpenAIClient(OpenAIClient):
+    """ OpenAIClient with an asyncio interface, for driving many conversations on one event loop
+    USAGE:
+        client = AsyncOpenAIClient(model_name="gpt-4o", base_url=..., api_key=...)
+        res = await client.query_one_async("hello")
+    """
+    def __init__(self, *args, async_client: openai.AsyncOpenAI=None, pool_kwargs: Dict=None, **kwargs):
+        """ async_client: a fixed client. Default: the shared client of the running loop (`LLMClientRegistry`, with `pool_kwargs`)
+        NOTE: a fixed client only works on one event loop, its connections are bound to it
+        """
+        super().__init__(*args, **kwargs)
+        self._async_client = async_client
+        self._pool_kwargs = pool_kwargs or {}
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        if self._async_client is not None: return self._async_client
+        return LLMClientRegistry.get_openai(self.base_url, self.client.api_key, self.model_name, is_async=True, **self._pool_kwargs)
+
+    async def _achat_completion(self, messages: List[Dict], **args) -> ChatCompletion:
+        """ the single (async) upstream call, with rate limiting & retry """
+        note_upstream()
+        n_tokens = estimate_tokens(messages)
+        n_failed = {"rate_limit": 0, "other": 0}
+        while True:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve(n_tokens))
+            try:
+                chat_completion = await self._acreate(self.async_client, messages, **args)
+                self._record_usage(n_tokens, chat_completion)
+                return chat_completion
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, n_failed))
+
+    async def _acreate(self, client: openai.AsyncOpenAI, messages: List[Dict], **args) -> ChatCompletion:
+        """ async version of `_create` """
+        def create():
+            return client.chat.completions.create(messages=messages, extra_body=self.extra_body, **args)
+        if self.hedger is None or args.get("stream"):
+            return await create()
+        return await self.hedger.arun(create)
+
+    async def _achat_completion_cached(self, messages: List[Dict], **args) -> ChatCompletion:
+        if not (self.use_cache and self.cache is not None):
+            return await self._achat_completion(messages, **args)
+        async def f_create():
+            chat_completion = await self._achat_completion(messages, **args)
+            return chat_completion.model_dump_json()
+        key = LLMCache.make_key(messages=messages, extra_body=self.extra_body, **args)
+        value = await self.cache.aget_or_create(key, f_create)
+        return ChatCompletion.model_validate_json(value)
+
+    async def query_one_async(self, query, return_model=False, return_usage=False, **args) -> Union[str, Tuple[str, ...]]:
+        args = self._default_args(args)
+        with track_call(args["model"]) as stat:
+            chat_completion: ChatCompletion = await self._achat_completion_cached(
+                self._to_messages(query), **args
+            )
+            fill_usage(stat, chat_completion)
+        return self._format_output(chat_completion, return_model=return_model, return_usage=return_usage)
+
+    async def query_one_stream_generator_async(self, text, stop=None, **args) -> AsyncIterator[str]:
+        """ async version of `query_one_stream_generator` """
+        args = self._default_args(args)
+        messages = self._to_messages(text)
+        with track_call(args["model"]) as stat:
+            response = await self._achat_completion(messages, stream=True, stop=stop, **args)
+        return self._atrack_stream(astream_generator(response), stat, messages)
+
+    @staticmethod
+    async def _atrack_stream(stream: AsyncIterator[str], stat: Dict, messages: List[Dict]) -> AsyncIterator[str]:
+        start, text = time.perf_counter(), ""
+        try:
+            async for delta in stream:
+                text += delta
+                yield delta
+        finally:
+            await stream.aclose()
+            stat.update(prompt_tokens=estimate_tokens(messages), completion_tokens=len(text) // 4, estimated=True)
+            stat["wall_time"] += time.perf_counter() - start
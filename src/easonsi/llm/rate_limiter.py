@@ -0,0 +1,140 @@
+"""
+Process-wide rate limiters (requests / tokens per minute) for LLM endpoints
+
+USAGE:
+    limiter = get_rate_limiter("gpt-4o", base_url, rpm=500, tpm=200_000)
+    n_tokens = estimate_tokens(messages)
+    time.sleep(limiter.reserve(n_tokens))       # or `await asyncio.sleep(...)`
+    ...  # call the endpoint
+    limiter.record_usage(n_tokens, usage.total_tokens)
+"""
+
+import time, random, threading, email.utils
+from typing import Dict, List, Tuple, Optional, Any
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """ rough prompt token count (~4 chars per token), without a tokenizer """
+    return sum(len(str(m.get("content") or "")) // 4 + 4 for m in messages)
+
+
+def jittered_backoff(backoff_factor: float, attempt: int) -> float:
+    """ exponential backoff with "full jitter", so that failed callers do not retry in lockstep """
+    return random.uniform(0, backoff_factor * (2 ** attempt))
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """ seconds to wait from the `retry-after-ms` / `retry-after` headers of a response, None if absent """
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:      # HTTP-date
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Bucket:
+    """ token bucket that can go into debt: callers reserve first and wait for the debt to be refilled """
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0       # refill per second
+        self.level = self.capacity
+        self.t_last = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.t_last) * self.rate)
+        self.t_last = now
+
+    def take(self, n: float) -> float:
+        """ reserve `n` units, return the time to wait (seconds). NOTE: call after `refill` """
+        self.level -= min(n, self.capacity)
+        return -self.level / self.rate if self.level < 0 else 0.0
+
+
+class RateLimiter:
+    """ shared limiter of one model endpoint
+    - requests & tokens per minute (token buckets), None for unlimited
+    - reservations are made in arrival order, so callers queue fairly (FIFO) instead of racing
+    - `penalize` blocks all callers after a 429, honouring `Retry-After`
+    """
+    def __init__(self, rpm: int = None, tpm: int = None) -> None:
+        self.rpm, self.tpm = rpm, tpm
+        self._requests = _Bucket(rpm) if rpm else None
+        self._tokens = _Bucket(tpm) if tpm else None
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.num_rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def reserve(self, n_tokens: int = 0) -> float:
+        """ reserve one request of `n_tokens`, return the seconds the caller should wait before sending it """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until - now)
+            if self._requests is not None:
+                self._requests.refill(now)
+                wait = max(wait, self._requests.take(1))
+            if self._tokens is not None:
+                self._tokens.refill(now)
+                wait = max(wait, self._tokens.take(n_tokens))
+            self.num_requests += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def record_usage(self, n_estimated: int, n_actual: int) -> None:
+        """ correct the token reservation with the actual usage of the response """
+        if self._tokens is None or n_actual is None:
+            return
+        with self._lock:
+            self._tokens.level = min(self._tokens.capacity, self._tokens.level + n_estimated - n_actual)
+
+    def penalize(self, delay: float) -> None:
+        """ the endpoint returned 429: block everyone for `delay` seconds and drop the accumulated burst """
+        with self._lock:
+            self.num_rate_limited += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            for bucket in (self._requests, self._tokens):
+                if bucket is not None:
+                    bucket.level = min(bucket.level, 0.0)
+
+    def blocked_for(self) -> float:
+        """ seconds until the block of the last 429 is lifted """
+        with self._lock:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+    def get_stat(self) -> Dict[str, Any]:
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "num_requests": self.num_requests,
+            "num_rate_limited": self.num_rate_limited,
+            "avg_wait": self.total_wait / self.num_requests if self.num_requests else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+_LIMITERS: Dict[Tuple[str, str], RateLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+def get_rate_limiter(model_name: str, base_url: str = None, rpm: int = None, tpm: int = None) -> RateLimiter:
+    """ process-wide limiter per (model_name, base_url). NOTE: the limits of the first call take effect """
+    key = (model_name, base_url)
+    with _LIMITERS_LOCK:
+        if key not in _LIMITERS:
+            _LIMITERS[key] = RateLimiter(rpm=rpm, tpm=tpm)
+        return _LIMITERS[key]
+
+def get_all_rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    with _LIMITERS_LOCK:
+        return { f"{model_name}@{base_url}": limiter.get_stat() for (model_name, base_url), limiter in _LIMITERS.items() }
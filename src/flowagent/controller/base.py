@@ -3,7 +3,7 @@
 
 from abc import abstractmethod
 from typing import List
-import datetime
+import datetime, asyncio
 import pandas as pd
 from ..data import (
     Config, DBManager, DataManager, Workflow, LogUtils,
@@ -37,7 +37,7 @@ class BaseController:
         self.conv = Conversation(conversation_id=self.conversation_id)
     
         if self.cfg.log_to_db:
-            self.db = DBManager(self.cfg.db_uri, self.cfg.db_name, self.cfg.db_message_collection_name)
+            self.db = DBManager.from_config(self.cfg)
     
     @abstractmethod
     def conversation(self, verbose:bool=True) -> Conversation:
@@ -46,6 +46,13 @@ class BaseController:
     @abstractmethod
     def conversation_teacher_forcing(self, verbose:bool=True) -> Conversation:
         raise NotImplementedError()
+
+    async def conversation_async(self, verbose:bool=True) -> Conversation:
+        """ async version of `conversation`. By default, run the sync version in a worker thread """
+        return await asyncio.to_thread(self.conversation, verbose=verbose)
+
+    async def conversation_teacher_forcing_async(self, verbose:bool=True) -> Conversation:
+        return await asyncio.to_thread(self.conversation_teacher_forcing, verbose=verbose)
     
     def start_conversation(self, verbose=True):
         infos = {
@@ -90,6 +97,33 @@ class BaseController:
         return infos, conversation
     
 
+    async def start_conversation_async(self, verbose=True, teacher_forcing=False):
+        """ async version of `start_conversation` (and `start_conversation_teacher_forcing`)
+        NOTE: the blocking DB operations are run in worker threads
+        """
+        infos = {
+            "conversation_id": self.conversation_id,
+            "exp_version": self.cfg.exp_version,
+            "config": self.cfg.to_dict(),
+        }
+        self.logger.log(LogUtils.format_infos_with_tabulate(infos), with_print=verbose)
+
+        # 1. check if has been run!
+        if await asyncio.to_thread(self._check_if_already_run):
+            self.logger.log(f"NOTE: the experiment has already been run!", with_print=verbose)
+            return infos, None
+        # 2. run the conversation
+        if teacher_forcing:
+            conversation = await self.conversation_teacher_forcing_async(verbose=verbose)
+        else:
+            conversation = await self.conversation_async(verbose=verbose)
+        # 3. record the conversation
+        await asyncio.to_thread(self._record_to_db, conversation, verbose=verbose)
+
+        conversation_df = pd.DataFrame(conversation.to_list())[['role', 'content']].set_index('role')
+        self.logger.log(LogUtils.format_infos_with_tabulate(conversation_df), with_print=verbose)
+        return infos, conversation
+
     def _check_if_already_run(self) -> bool:
         # 如果不日志到数据库，直接返回False（无需检查）
         if not self.cfg.log_to_db:
@@ -112,8 +146,8 @@ class BaseController:
         if not self.cfg.log_to_db: return 
         
         # 1. insert conversation
-        res = self.db.insert_conversation(conversation)
-        self.logger.log(f"  <db> Inserted conversation with {len(res.inserted_ids)} messages", with_print=verbose)
+        self.db.insert_conversation(conversation)
+        self.logger.log(f"  <db> Inserted conversation with {len(conversation)} messages", with_print=verbose)
         
         # 2. insert configuration
         infos_dict = {
@@ -121,6 +155,7 @@ class BaseController:
             **self.cfg.to_dict()
         }
         res = self.db.insert_config(infos_dict)
+        self.db.flush()     # write-behind: write the conversation without waiting for the batch to fill
         self.logger.log(f"  <db> Inserted config", with_print=verbose)
     
     
@@ -130,5 +165,10 @@ class BaseController:
         self.logger.log(_content, with_print=False)
         if verbose and not (    # for InputUser, no need to print
             isinstance(self.user, InputUser) and (msg.role == Role.USER)
-        ): 
+        ) and not self._is_streamed(msg): 
             self.logger.log_to_stdout(_content, color=msg.role.color)
+
+    def _is_streamed(self, msg:Message) -> bool:
+        """ the bot responses already printed by `bot.stream_callback` (stream mode, see `ReactBot._on_stream`) """
+        return (msg.role == Role.BOT) and (not msg.apis) and self.cfg.bot_llm_stream \
+            and getattr(self.bot, "stream_callback", None) is not None
@@ -1,18 +1,24 @@
 """ updated @240919
 """
+from typing import Any, Generator, Tuple
 
 from ..data import (
-    Config, Workflow, 
+    Config, Workflow, WorkflowRegistry, 
     BotOutput, UserOutput, BotOutputType, APIOutput,
     Role, Message, Conversation
 )
 from ..roles import (
     USER_NAME2CLASS, BOT_NAME2CLASS, API_NAME2CLASS, PDLBot
 )
+from ..roles.base import BaseRole
 from .base import BaseController
 from utils.wrappers import Timer
 from .pdl_checker import PDLDependencyChecker, APIDuplicatedChecker
 
+# the main loops are generators of the role steps `(role, args)`, receiving the outputs of `role.process(*args)`, so that
+# the sync & async versions share them and only differ in the dispatch (`_run_steps` / `_run_steps_async`)
+Steps = Generator[Tuple[BaseRole, tuple], Any, Conversation]
+
 class FlowagentController(BaseController):
     """ main loop of a simulated conversation
     USAGE:
@@ -23,7 +29,7 @@ class FlowagentController(BaseController):
     
     def __init__(self, cfg:Config) -> None:
         super().__init__(cfg)
-        self.workflow = Workflow(cfg)
+        self.workflow = WorkflowRegistry.get(cfg)
         self.bot = BOT_NAME2CLASS[cfg.bot_mode](cfg=cfg, conv=self.conv, workflow=self.workflow)
         if self.cfg.exp_mode == "session":
             self.user = USER_NAME2CLASS[cfg.user_mode](cfg=cfg, conv=self.conv, workflow=self.workflow)
@@ -33,6 +39,34 @@ class FlowagentController(BaseController):
                 if cfg.pdl_check_dependency: self.pdl_dependency_checker = PDLDependencyChecker(self.cfg, self.conv, self.workflow.pdl)
                 if cfg.pdl_check_api_dup_calls: self.pdl_api_dup_checker = APIDuplicatedChecker(self.cfg, self.conv)
         
+    @staticmethod
+    def _run_steps(steps: Steps) -> Conversation:
+        """ run the steps with the (blocking) `process` of the roles """
+        output, error = None, None
+        while True:
+            try:
+                role, args = steps.send(output) if error is None else steps.throw(error)
+            except StopIteration as e:
+                return e.value
+            try:
+                output, error = role.process(*args), None
+            except Exception as e:
+                output, error = None, e
+
+    @staticmethod
+    async def _run_steps_async(steps: Steps) -> Conversation:
+        """ async version of `_run_steps`, with `process_async` """
+        output, error = None, None
+        while True:
+            try:
+                role, args = steps.send(output) if error is None else steps.throw(error)
+            except StopIteration as e:
+                return e.value
+            try:
+                output, error = await role.process_async(*args), None
+            except Exception as e:
+                output, error = None, e
+
     def conversation(self, verbose:bool=True) -> Conversation:
         """ given three roles (system/user/bot), start a conversation
         1. initiation: initialize the variables, logger, etc.
@@ -41,6 +75,14 @@ class FlowagentController(BaseController):
             controller: 
                 > bot can take several actions in one turn? 
         """
+        return self._run_steps(self._conversation_steps(verbose=verbose))
+
+    async def conversation_async(self, verbose:bool=True) -> Conversation:
+        """ async version of `conversation`, the same main loop with awaited role processing """
+        return await self._run_steps_async(self._conversation_steps(verbose=verbose))
+
+    def _conversation_steps(self, verbose:bool=True) -> Steps:
+        """ the main loop of `conversation` """
         role: Role = Role.USER      # current role!
         
         num_UB_turns:int = 0           # cnt of user & bot conversation
@@ -48,7 +90,7 @@ class FlowagentController(BaseController):
         while True:
             if role == Role.USER:
                 with Timer("user process", print=self.cfg.log_utterence_time):
-                    user_output: UserOutput = self.user.process()
+                    user_output: UserOutput = yield self.user, ()
                 self.log_msg(self.conv.get_last_message(), verbose=verbose)
                 role = Role.BOT
                 if user_output.is_end:
@@ -59,7 +101,7 @@ class FlowagentController(BaseController):
                 while True:         # limit the bot prediction steps
                     # 1. bot predict an action
                     with Timer("bot process", print=self.cfg.log_utterence_time):
-                        bot_output: BotOutput = self.bot.process()
+                        bot_output: BotOutput = yield self.bot, ()
                     self.log_msg(self.conv.get_last_message(), verbose=verbose)
                     # 2. STOP: break until bot RESPONSE
                     if bot_output.action_type == BotOutputType.RESPONSE:
@@ -72,7 +114,7 @@ class FlowagentController(BaseController):
                             continue
                         # 3.2 call the API (system)
                         with Timer("api process", print=self.cfg.log_utterence_time):
-                            api_output: APIOutput = self.api.process(bot_output)
+                            api_output: APIOutput = yield self.api, (bot_output, )
                         self.log_msg(self.conv.get_last_message(), verbose=verbose)
                     else: raise TypeError(f"Unexpected BotOutputType: {bot_output.action_type}")
                     
@@ -106,6 +148,14 @@ class FlowagentController(BaseController):
     def conversation_teacher_forcing(self, verbose:bool=True) -> Conversation:
         """ given a reference conversation, test the bot in a teacher-forcing manner
         """
+        return self._run_steps(self._teacher_forcing_steps(verbose=verbose))
+
+    async def conversation_teacher_forcing_async(self, verbose:bool=True) -> Conversation:
+        """ async version of `conversation_teacher_forcing` """
+        return await self._run_steps_async(self._teacher_forcing_steps(verbose=verbose))
+
+    def _teacher_forcing_steps(self, verbose:bool=True) -> Steps:
+        """ the loop of `conversation_teacher_forcing` """
         ref_conv = self.workflow.reference_conversations[self.cfg.user_profile_id].conversation
         for msg in ref_conv.msgs:
             if msg.role != Role.BOT:
@@ -113,8 +163,8 @@ class FlowagentController(BaseController):
             else:
                 # 1. bot predict an action (NOTE: will add a msg in self.conv)
                 with Timer("bot process", print=self.cfg.log_utterence_time):
-                    bot_output: BotOutput = self.bot.process()
+                    bot_output: BotOutput = yield self.bot, ()
                 # 2. convert the msg! 
                 self.conv.substitue_message(msg.copy(), old_to_prediction=True, idx=-1)
                 self.logger.log(f"<teacher_forcing> gt: {self.conv.get_last_message().content}\n  predicted: {self.conv.get_last_message().content_predict}", with_print=verbose)
-        return self.conv
\ No newline at end of file
+        return self.conv
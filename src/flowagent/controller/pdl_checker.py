@@ -45,9 +45,7 @@ class PDLDependencyChecker(BaseChecker):
         self.graph = self._build_graph(pdl)
     
     def _build_graph(self, pdl:PDL):
-        if (pdl.apis is None) or (not pdl.apis):  # if pdl.apis is None
-            pdl.apis = []
-        apis = pdl.apis
+        apis = pdl.apis or []   # NOTE: the pdl is shared (`WorkflowRegistry`), do not modify it
         g = PDLGraph()
         for api in apis:
             node = PDLNode(name=api["name"], preconditions=api.get("precondition", None), version=pdl.version)
@@ -77,12 +75,12 @@ class APIDuplicatedChecker(BaseChecker):
     """ to avoid duplicated API calls! """
 
     def _check_with_message(self, bot_output: BotOutput) -> Tuple[bool, str]:
-        app_calling_info = self.conv.get_last_message().content
+        api_call = self.conv.get_last_message().get_api_call()
         duplicate_cnt = 0
         for check_idx in range(len(self.conv)-1, -1, -1):
             previous_msg = self.conv.get_message_by_idx(check_idx)
             if previous_msg.role != Role.BOT: continue
-            if previous_msg.content != app_calling_info: break
+            if previous_msg.get_api_call() != api_call: break
             duplicate_cnt += 1
             if duplicate_cnt >= self.cfg.pdl_check_api_dup_calls_threshold:
                 msg = "Too many duplicated API call! try another action instead."
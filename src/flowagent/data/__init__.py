@@ -1,10 +1,12 @@
-from .workflow import Workflow, DataManager, WorkflowType, WorkflowTypeStr
+from .workflow import Workflow, WorkflowRegistry, DataManager, WorkflowType, WorkflowTypeStr
 from .pdl import PDL
 from .config import Config
 from .role_outputs import BotOutput, UserOutput, APIOutput, BotOutputType
 from .user_profile import UserProfile, OOWIntention
-from .db import DBManager
+from .db import DBManager, MongoDBManager
+from .db_sqlite import SQLiteDBManager
+from .db_client import MongoClientRegistry
 # dependecies
-from .base_data import Role, Message, Conversation, ConversationWithIntention
-from .base_llm import init_client, LLM_CFG
+from .base_data import Role, Message, Conversation, ConversationWithIntention, APICall, encode_message, decode_message, encode_conversation, decode_conversation
+from .base_llm import init_client, init_role_client, LLM_CFG
 from .log import BaseLogger, LogUtils
@@ -1,5 +1,5 @@
 # from engine import Role, Message, Conversation
-import datetime, os, re, yaml, copy, pathlib, time
+import datetime, os, re, yaml, copy, pathlib, time, sys, ast, bisect
 from enum import Enum, auto
 from dataclasses import dataclass, asdict, field
 from typing import List, Dict, Optional, Tuple, Iterator, Union
@@ -22,13 +22,15 @@ class Role(Enum):
 
     @classmethod
     def get_by_rolename(cls, rolename: str):
-        for member in cls:
-            if member.rolename == rolename.lower():
-                return member
-        raise KeyError(f"{rolename} is not a valid key for {cls.__name__}")
+        role = _ROLENAME2ROLE.get(rolename) or _ROLENAME2ROLE.get(rolename.lower())
+        if role is None:
+            raise KeyError(f"{rolename} is not a valid key for {cls.__name__}")
+        return role
 
+_ROLENAME2ROLE: Dict[str, Role] = {role.rolename: role for role in Role}
 
-@dataclass
+
+@dataclass(slots=True)
 class APICall:
     name: str
     params: Dict
@@ -44,53 +46,64 @@ class APICall:
         return cls(**data)
 
 
-@dataclass
+def _to_api_calls(apis: Optional[List[Union[APICall, Dict]]]) -> Optional[List[APICall]]:
+    if apis and not isinstance(apis[0], APICall):
+        apis = [APICall.from_dict(i) for i in apis]
+    return apis or None
+
+
+@dataclass(slots=True)
 class Message:
+    """ NOTE: slotted, only the fields below can be set. (de)serialize with `to_dict / from_dict` (see `encode_message`) """
     role: Role = None
     content: str = None
-    prompt: str = None
+    prompt: Union[str, List[Dict]] = None     # a prompt string, or chat messages (`cfg.llm_chat_messages`)
     llm_response: str = None
     conversation_id: str = None
     utterance_id: int = None
     
     type: str = None
-    apis: List[APICall] = None      # whether contain api calls
+    apis: List[APICall] = None      # the API called in `content`, parsed (BOT messages, and the GT in the reference data)
     
     content_predict: str = None
+    apis_predict: List[APICall] = None      # the API called in `content_predict`
+    llm_stat: Dict = None           # tokens, latency & retries of the LLM calls producing this message
 
     def __init__(
         self, role: Role, content: str, 
         conversation_id: str=None, utterance_id: int=None, 
-        prompt: str=None, llm_response: str=None, 
+        prompt: Union[str, List[Dict]]=None, llm_response: str=None, 
         type: str=None, apis: List[APICall]=None, content_predict: str=None,
+        llm_stat: Dict=None, apis_predict: List[APICall]=None,
         **kwargs
     ):
         self.role = role
         self.content = content
-        if prompt is not None: self.prompt = prompt
-        if llm_response is not None: self.llm_response = llm_response
-        if conversation_id is not None: self.conversation_id = conversation_id
-        if utterance_id is not None: self.utterance_id = utterance_id
-        if type is not None: self.type = type
-        if apis: 
-            if not isinstance(apis[0], APICall):
-                apis = [APICall.from_dict(i) for i in apis]
-            self.apis = apis
-        if content_predict is not None: self.content_predict = content_predict
+        self.prompt = prompt
+        self.llm_response = llm_response
+        self.conversation_id = conversation_id
+        self.utterance_id = utterance_id
+        self.type = sys.intern(type) if type is not None else None
+        self.apis = _to_api_calls(apis)
+        self.content_predict = content_predict
+        self.apis_predict = _to_api_calls(apis_predict)
+        self.llm_stat = llm_stat
     
     def to_str(self):
         return f"{self.role.prefix}{self.content}"
     def to_dict(self):
-        res = asdict(self)
-        res["role"] = self.role.rolename
-        return res
+        return encode_message(self)
+    @classmethod
+    def from_dict(cls, d: Dict) -> 'Message':
+        return decode_message(d)
     def __str__(self):
         return self.to_str()
     def __repr__(self):
         return self.to_str()
     
     def copy(self):
-        return copy.deepcopy(self)
+        """ shallow copy. NOTE: the field values (`apis`, `llm_stat`, `prompt`...) are shared, replace them instead of modifying in place """
+        return copy.copy(self)
     
     # auto determined api v.s. GT api calls (.apis, .type)
     def is_api_calling(self, content: str = None) -> bool:
@@ -100,23 +113,40 @@ class Message:
     def get_api_infos(self, content: str = None) -> Tuple[str, str]:
         """ 
         return: action_name, action_parameters
+        NOTE: prefer `get_api_call`, which uses the parsed `apis` of the message
         """
         # content = f"<Call API> {action_name}({action_parameters})"
         if content is None:
+            if self.apis: return self.apis[0].name, self.apis[0].params
             content = self.content
         assert self.is_api_calling(content), f"Must be API calling message! But got {content}"
         content = content[len("<Call API> "):].strip()
         re_pattern = r"(.*?)\((.*)\)"
         re_match = re.match(re_pattern, content)
         name, paras = re_match.group(1), re_match.group(2)
-        return name, eval(paras)
+        return name, ast.literal_eval(paras)
+    def get_api_call(self, predict: bool = False) -> Optional[APICall]:
+        """ the API called by the BOT message (or by its prediction `content_predict`), None if not an API call
+        NOTE: the content is only parsed when the message has no `apis / apis_predict` (e.g. data recorded before they were added)
+        """
+        content, apis = (self.content_predict, self.apis_predict) if predict else (self.content, self.apis)
+        if self.role != Role.BOT or not content or not self.is_api_calling(content): return None
+        if apis: return apis[0]
+        return APICall(*self.get_api_infos(content))
     
     # def substitue_with_GT_content(self, GT_content: str):
     #     self.content, self.content_predict = GT_content, self.content
 
 
 class Conversation():
-    msgs: List[Message] = []
+    """ a list of messages
+    NOTE: `copy()` and the slices share the messages (and `copy()` the message list, copy-on-write), modify a message by
+        `substitue_message` with a new one (e.g. `msg.copy()`) instead of in place
+    NOTE: the rendering of `to_str` is kept in an append-only buffer (`_text`, with the end offset of each message in `_offsets`),
+        so `to_str()` of the conversation or of a prefix `conv[:i]` does not re-format the messages. Similarly, the API calls
+        are indexed once, on demand, in `api_calls`.
+        Modify the messages through `add_message / substitue_message / +`, or call `_truncate_views` after editing one in place
+    """
     conversation_id: str = None
     
     def __init__(self, conversation_id: str = None):
@@ -125,6 +155,49 @@ class Conversation():
             conversation_id = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
         self.conversation_id = conversation_id
 
+    @property
+    def msgs(self) -> List[Message]:
+        self._own()     # the caller may modify the list
+        return self._msgs
+    @msgs.setter
+    def msgs(self, msgs: List[Message]):
+        self._msgs, self._shared = msgs, False
+        # views of `_rendered` (== msgs[:len(_rendered)]): the rendering, & the API calls [(idx, APICall)] of the first `_num_indexed`
+        self._text, self._offsets, self._rendered, self._api_calls, self._num_indexed = "", [], [], [], 0
+
+    def _own(self) -> None:
+        """ copy-on-write: take a private copy of the lists shared with `copy()`, before modifying them """
+        if not self._shared: return
+        self._msgs, self._offsets, self._rendered, self._api_calls = list(self._msgs), list(self._offsets), list(self._rendered), list(self._api_calls)
+        self._shared = False
+
+    def _truncate_views(self, n: int) -> None:
+        """ drop the views of msgs[n:], they are built again by the next `to_str` / `api_calls` """
+        self._own()
+        n = max(0, min(n, len(self._offsets)))
+        self._text = self._text[:self._offsets[n-1]] if n else ""
+        del self._offsets[n:], self._rendered[n:]
+        while self._api_calls and self._api_calls[-1][0] >= n: self._api_calls.pop()
+        self._num_indexed = min(self._num_indexed, n)
+
+    def _sync_views(self) -> None:
+        """ render the messages appended since the last call """
+        n = len(self._rendered)
+        if n > len(self._msgs) or (n and self._msgs[n-1] is not self._rendered[n-1]):
+            # the list was modified in place (e.g. `msgs.pop()`), render it again
+            self._truncate_views(0)
+            n = 0
+        if n == len(self._msgs): return
+        self._own()
+        new_msgs = self._msgs[n:]
+        pieces = [msg.to_str() for msg in new_msgs]
+        end = self._offsets[-1] if n else -1
+        for piece in pieces:
+            end += len(piece) + 1
+            self._offsets.append(end)
+        self._text += ("\n" if n else "") + "\n".join(pieces)
+        self._rendered += new_msgs
+
     def add_message(self, msg: Message):
         # assert isinstance(msg, Message), f"Must be Message! But got {type(msg)}"
         msg.conversation_id = self.conversation_id
@@ -136,31 +209,44 @@ class Conversation():
         new_msg.utterance_id = self.msgs[idx].utterance_id
         if old_to_prediction:
             new_msg.content_predict = self.msgs[idx].content
+            new_msg.apis_predict = self.msgs[idx].apis
+            new_msg.llm_stat = self.msgs[idx].llm_stat    # the cost of the prediction
         self.msgs[idx] = new_msg
+        self._truncate_views(idx % len(self.msgs))
         
     def get_message_by_idx(self, idx: int) -> Message:
-        return self.msgs[idx]
+        return self._msgs[idx]
     
     def get_messages_num(self) -> int:
-        return len(self.msgs)
+        return len(self._msgs)
     @property
     def current_utterance_id(self) -> int:
-        return len(self.msgs)
+        return len(self._msgs)
     
     @property
     def messages(self) -> List[Message]:
         return self.msgs
     
     def get_last_message(self) -> Message:
-        return self.msgs[-1]
+        return self._msgs[-1]
     
     def get_called_apis(self) -> List[str]:
         """ collect all API calls in the conversation by BOT """
-        apis = []
-        for msg in self.msgs:
-            if msg.is_api_calling():
-                apis.append(msg.get_api_infos()[0])
-        return apis
+        return [api_call.name for _, api_call in self.api_calls]
+
+    @property
+    def api_calls(self) -> List[Tuple[int, APICall]]:
+        """ the API calls by BOT: [(message idx, APICall)], indexed incrementally. NOTE: do not modify the list
+        NOTE: raise if the content of an API calling message cannot be parsed (as `Message.get_api_infos`)
+        """
+        self._sync_views()
+        if self._num_indexed < len(self._rendered):
+            self._own()
+            for idx in range(self._num_indexed, len(self._rendered)):
+                api_call = self._rendered[idx].get_api_call()
+                if api_call is not None: self._api_calls.append((idx, api_call))
+                self._num_indexed = idx + 1
+        return self._api_calls
 
     @classmethod
     def from_messages(cls, msgs: List[Message]):
@@ -171,17 +257,13 @@ class Conversation():
         return instance
     
     def to_dataframe(self) -> pd.DataFrame:
-        return pd.DataFrame([m.to_dict() for m in self.msgs])
+        return pd.DataFrame([m.to_dict() for m in self._msgs])
 
     @classmethod
     def load_from_json(cls, o:List[Dict]):
         instance = cls()
         for msg in o:
-            _role = Role.get_by_rolename(msg["role"])
-            instance.add_message(Message(
-                _role, msg["content"], 
-                type=msg.get("type", None), apis=msg.get("apis", None)
-            ))
+            instance.add_message(decode_message(msg))
         return instance
     
     @classmethod
@@ -198,22 +280,50 @@ class Conversation():
             else:
                 # append the last message
                 ins.msgs[-1].content += f"\n{line}"
+                ins._truncate_views(len(ins.msgs) - 1)
         return ins
 
     def to_str(self):
-        return "\n".join([msg.to_str() for msg in self.msgs])
+        self._sync_views()
+        return self._text
+    def to_chat_messages(self, role: Role) -> List[Dict]:
+        """ the conversation seen by `role`: its own messages as "assistant" (the raw LLM output if any), the others as "user"
+        NOTE: consecutive messages of the others are merged, as some chat templates require alternating roles
+        """
+        messages = []
+        for msg in self._msgs:
+            if msg.role == role:
+                messages.append({"role": "assistant", "content": msg.llm_response or msg.content})
+            elif messages and messages[-1]["role"] == "user":
+                messages[-1]["content"] += "\n" + msg.to_str()
+            else:
+                messages.append({"role": "user", "content": msg.to_str()})
+        return messages
     def to_list(self):
-        return [msg.to_dict() for msg in self.msgs]
+        return [msg.to_dict() for msg in self._msgs]
+    def to_dict(self) -> Dict:
+        return encode_conversation(self)
+    @classmethod
+    def from_dict(cls, d: Dict) -> 'Conversation':
+        return decode_conversation(d)
     
     def copy(self):
-        return copy.deepcopy(self)
+        """ copy-on-write: the copy shares the message list (& rendering) until either side modifies it
+        NOTE: the messages are shared, use `copy.deepcopy` for independent ones
+        """
+        self._sync_views()
+        new_conversation = copy.copy(self)
+        new_conversation._shared = self._shared = True
+        return new_conversation
     
     def __add__(self, other):
         if type(other) == list:
             assert isinstance(other[0], Message), f"Must be list of Message!"
-            self.msgs += other
+            self._own()
+            self._msgs += other
         elif isinstance(other, Conversation):
-            self.msgs += other.msgs
+            self._own()
+            self._msgs += other._msgs
         else:
             raise NotImplementedError
         return self
@@ -223,19 +333,27 @@ class Conversation():
     def __repr__(self):
         return self.to_str()
     def __len__(self):
-        return len(self.msgs)
+        return len(self._msgs)
     
     def __getitem__(self, index: Union[int, slice]) -> Union[Message, 'Conversation']:
         # different behaviors for conv[0] and conv[:2]
         if isinstance(index, int):
-            return self.msgs[index]
+            return self._msgs[index]
         elif isinstance(index, slice):
             new_conversation = Conversation(self.conversation_id)
-            new_conversation.msgs = self.msgs[index]
+            new_conversation.msgs = self._msgs[index]
+            start, stop, step = index.indices(len(self._msgs))
+            if start == 0 and step == 1 and stop > 0:
+                # a prefix shares the rendering of the conversation
+                self._sync_views()
+                new_conversation._text = self._text[:self._offsets[stop-1]]
+                new_conversation._offsets, new_conversation._rendered = self._offsets[:stop], self._rendered[:stop]
+                new_conversation._api_calls = self._api_calls[:bisect.bisect_left(self._api_calls, stop, key=lambda x: x[0])]
+                new_conversation._num_indexed = min(self._num_indexed, stop)
             return new_conversation
 
     def __iter__(self) -> Iterator[Message]:
-        return iter(self.msgs)
+        return iter(self._msgs)
 
 class ConversationWithIntention():
     def __init__(self, user_intention: str, conversation: Conversation) -> None:
@@ -245,3 +363,60 @@ class ConversationWithIntention():
     def __str__(self):
         return f"simulated conversation with {len(self.conversation)} messages.\nUser intention: {self.user_intention}"
 
+
+
+# (de)serialization of the messages, used by the DB, the data files & the UI
+# schema versions: 0 - `dataclasses.asdict` of `Message` (no "schema_version" key); 1 - the same fields, with "schema_version"
+#   2 - adds "apis_predict"
+# NOTE: bump `SCHEMA_VERSION` when the layout changes, and convert the older versions in `decode_message`
+SCHEMA_VERSION = 2
+
+def encode_api_call(api: APICall) -> Dict:
+    return {"name": api.name, "params": api.params}
+
+def decode_api_call(d: Dict) -> APICall:
+    return APICall.from_dict(d)
+
+def encode_message(msg: Message) -> Dict:
+    """ NOTE: the nested values (`prompt`, `llm_stat`, the API params) are shared with the message, not copied """
+    return {
+        "role": msg.role.rolename,
+        "content": msg.content,
+        "prompt": msg.prompt,
+        "llm_response": msg.llm_response,
+        "conversation_id": msg.conversation_id,
+        "utterance_id": msg.utterance_id,
+        "type": msg.type,
+        "apis": [encode_api_call(api) for api in msg.apis] if msg.apis else None,
+        "content_predict": msg.content_predict,
+        "apis_predict": [encode_api_call(api) for api in msg.apis_predict] if msg.apis_predict else None,
+        "llm_stat": msg.llm_stat,
+        "schema_version": SCHEMA_VERSION,
+    }
+
+def decode_message(d: Dict) -> Message:
+    """ the inverse of `encode_message`, missing fields are None & unknown ones (e.g. the DB "_id") are ignored """
+    version = d.get("schema_version", 0)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Unsupported message schema version {version} (> {SCHEMA_VERSION})")
+    role, apis, apis_predict = d["role"], d.get("apis"), d.get("apis_predict")
+    return Message(
+        role if isinstance(role, Role) else Role.get_by_rolename(role), d.get("content"),
+        conversation_id=d.get("conversation_id"), utterance_id=d.get("utterance_id"),
+        prompt=d.get("prompt"), llm_response=d.get("llm_response"), type=d.get("type"),
+        apis=[decode_api_call(api) for api in apis] if apis else None,
+        content_predict=d.get("content_predict"), llm_stat=d.get("llm_stat"),
+        apis_predict=[decode_api_call(api) for api in apis_predict] if apis_predict else None,
+    )
+
+def encode_conversation(conv: Conversation) -> Dict:
+    return {
+        "conversation_id": conv.conversation_id,
+        "messages": [encode_message(msg) for msg in conv],
+        "schema_version": SCHEMA_VERSION,
+    }
+
+def decode_conversation(d: Dict) -> Conversation:
+    conv = Conversation(d.get("conversation_id"))
+    conv.msgs = [decode_message(msg) for msg in d["messages"]]
+    return conv
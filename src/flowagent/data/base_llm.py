@@ -1,11 +1,24 @@
 # init_client, LLM_CFG
 import os
+from pathlib import Path
 from typing import Dict
-from easonsi.llm.openai_client import OpenAIClient
+from easonsi.llm.openai_client import OpenAIClient, AsyncOpenAIClient
+from easonsi.llm.cache import get_cache
+from easonsi.llm.client_registry import LLMClientRegistry
+from easonsi.llm.rate_limiter import get_rate_limiter
+from easonsi.llm.cassette import CassetteOpenAIClient, get_cassette
+from easonsi.llm.load_balancer import BalancedOpenAIClient, get_endpoint_pool
+from easonsi.llm.hedging import get_hedger
+from .config import Config
+from utils.yaml_loader import yaml_load_file
 
 from dotenv import load_dotenv
 load_dotenv()
 
+DIR_cache = Path(__file__).resolve().parent.parent.parent.parent / ".cache"
+
+# model entries: model_name, base_url, api_key, [rpm, tpm] (optional rate limits, per minute), [cassette] (record/replay),
+#   [endpoints] (several replicas / keys of the model, load balanced: [{base_url, api_key, [weight], [rpm], [tpm]}])
 LLM_CFG = {}
 def add_openai_models():
     global LLM_CFG
@@ -21,10 +34,102 @@ def add_openai_models():
         }
 add_openai_models()
 
+def add_endpoint_models(fn:str=None):
+    """ load the multi-endpoint models from the yaml file `fn` (default: env `LLM_ENDPOINTS_FN`), e.g.
+        Qwen/Qwen3-8B:
+          - {base_url: "http://vllm-0:8000/v1", api_key: "EMPTY", weight: 1}
+          - {base_url: "http://vllm-1:8000/v1", api_key: "${VLLM_API_KEY}", weight: 2}
+    NOTE: `${VAR}` in the values are expanded from the environment
+    """
+    global LLM_CFG
+    fn = fn or os.getenv("LLM_ENDPOINTS_FN")
+    if not fn: return
+    model2endpoints = yaml_load_file(fn) or {}
+    for model, endpoints in model2endpoints.items():
+        endpoints = [{k: os.path.expandvars(v) if isinstance(v, str) else v for k, v in e.items()} for e in endpoints]
+        LLM_CFG[model] = {
+            **LLM_CFG.get(model, {}), "model_name": model, "endpoints": endpoints,
+            "base_url": endpoints[0]["base_url"], "api_key": endpoints[0].get("api_key"),
+        }
+add_endpoint_models()
 
-def init_client(llm_cfg:Dict):
-    client = OpenAIClient(
-        model_name=llm_cfg["model_name"], base_url=llm_cfg["base_url"], api_key=llm_cfg["api_key"]
+def add_cassette_models():
+    """ `record/{model}` records all calls of the model to the cassette file, `replay/{model}` replays them without network """
+    global LLM_CFG
+    for model, llm_cfg in list(LLM_CFG.items()):
+        if "cassette" in llm_cfg: continue
+        LLM_CFG[f"record/{model}"] = { **llm_cfg, "cassette": "record" }
+        LLM_CFG[f"replay/{model}"] = { **llm_cfg, "api_key": llm_cfg["api_key"] or "replay", "cassette": "replay" }
+add_cassette_models()
+
+
+def init_client(
+    llm_cfg:Dict, use_cache:bool=False, cache_fn:str=None, cache_max_size_mb:int=1024, is_async:bool=False,
+    pool_kwargs:Dict=None, rpm:int=None, tpm:int=None, cassette_fn:str=None, replay_latency:float=None, lb_kwargs:Dict=None,
+    hedge_kwargs:Dict=None,
+):
+    """ init a client of `llm_cfg`. NOTE: the underlying openai clients (& connection pools) are shared by `LLMClientRegistry`,
+    and all clients of the same model endpoint share one rate limiter (`rpm`/`tpm` default to the ones in `llm_cfg`)
+    NOTE: the cassette clients (`llm_cfg["cassette"]`) record/replay every call, so they bypass the cache (and the rate limiter when replaying)
+    NOTE: models with several `endpoints` are load balanced (`lb_kwargs`: circuit breaker & health check options of the `EndpointPool`),
+        except when recording to a cassette, which uses the first endpoint
+    NOTE: with `hedge_kwargs` (options of the per-model `Hedger`), slow calls are hedged. Not for cassette clients
+    """
+    cassette_mode = llm_cfg.get("cassette")
+    cache = None
+    if use_cache and not cassette_mode:
+        cache = get_cache(cache_fn or DIR_cache / "llm_cache.sqlite", max_size_mb=cache_max_size_mb)
+    pool_kwargs = pool_kwargs or {}
+    hedger = get_hedger(llm_cfg["model_name"], **hedge_kwargs) if hedge_kwargs is not None and not cassette_mode else None
+    if llm_cfg.get("endpoints") and not cassette_mode:
+        pool = get_endpoint_pool(
+            llm_cfg["model_name"], llm_cfg["endpoints"], pool_kwargs=pool_kwargs,
+            rpm=rpm or llm_cfg.get("rpm"), tpm=tpm or llm_cfg.get("tpm"), **(lb_kwargs or {}),
+        )
+        return BalancedOpenAIClient(model_name=llm_cfg["model_name"], cache=cache, pool=pool, hedger=hedger)
+    _key = dict(base_url=llm_cfg["base_url"], api_key=llm_cfg["api_key"], model_name=llm_cfg["model_name"])
+    kwargs = dict(client=LLMClientRegistry.get_openai(**_key, **pool_kwargs))
+    if is_async:
+        client_cls = AsyncOpenAIClient
+        kwargs["pool_kwargs"] = pool_kwargs       # the async clients are per event loop, see `AsyncOpenAIClient.async_client`
+    else:
+        client_cls = OpenAIClient
+    rate_limiter = get_rate_limiter(
+        llm_cfg["model_name"], llm_cfg["base_url"], rpm=rpm or llm_cfg.get("rpm"), tpm=tpm or llm_cfg.get("tpm")
+    ) if cassette_mode != "replay" else None
+    if cassette_mode:
+        client_cls = CassetteOpenAIClient
+        kwargs |= dict(cassette=get_cassette(cassette_fn or DIR_cache / "llm_cassette.jsonl"), mode=cassette_mode, latency=replay_latency)
+    client = client_cls(
+        model_name=llm_cfg["model_name"], base_url=llm_cfg["base_url"], api_key=llm_cfg["api_key"],
+        cache=cache, rate_limiter=rate_limiter, hedger=hedger, **kwargs
     )
     return client
 
+# the config key of the llm name of each role
+ROLE2LLM_NAME_KEY = {
+    "user": "user_llm_name",
+    "bot": "bot_llm_name",
+    "api": "api_llm_name",
+    "judge": "judge_model_name",
+}
+
+def init_role_client(cfg:Config, role:str):
+    """ init the client of a role (user/bot/api/judge) with the role-level options in `cfg` """
+    assert role in ROLE2LLM_NAME_KEY, f"Unknown role {role}"
+    return init_client(
+        llm_cfg=LLM_CFG[cfg[ROLE2LLM_NAME_KEY[role]]],
+        use_cache=cfg[f"{role}_llm_cache"], cache_fn=cfg.llm_cache_fn, cache_max_size_mb=cfg.llm_cache_max_size_mb,
+        is_async=(cfg.exp_engine == "async"),
+        pool_kwargs=dict(
+            max_connections=cfg.llm_pool_max_connections, max_keepalive_connections=cfg.llm_pool_max_keepalive,
+            keepalive_expiry=cfg.llm_pool_keepalive_expiry, http2=cfg.llm_pool_http2,
+        ),
+        rpm=cfg.llm_rpm, tpm=cfg.llm_tpm,
+        cassette_fn=cfg.llm_cassette_fn, replay_latency=cfg.llm_replay_latency,
+        lb_kwargs=dict(
+            failure_threshold=cfg.llm_lb_failure_threshold, recovery_time=cfg.llm_lb_recovery_time,
+            health_check_interval=cfg.llm_lb_health_check_interval,
+        ),
+        hedge_kwargs=dict(quantile=cfg.llm_hedge_quantile, max_ratio=cfg.llm_hedge_max_ratio) if cfg.llm_hedge else None,
+    )
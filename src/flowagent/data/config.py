@@ -1,7 +1,7 @@
 """ updated @240906 
 """
-import jinja2
 import yaml, copy, os
+from utils.yaml_loader import yaml_load, render_env_template
 from dataclasses import dataclass, asdict, field
 
 @dataclass
@@ -12,9 +12,11 @@ class Config:
     exp_version: str = "default"
     exp_mode: str = "session"       # turn, session
     exp_save_config: bool = False
+    exp_engine: str = "thread"      # thread, async
     
     user_mode: str = "llm_profile"  # llm_oow, manual, llm_profile
     user_llm_name: str = "gpt-4o"
+    user_llm_cache: bool = False
     user_template_fn: str = None    # "flowagent/user_llm.jinja"
     # user_profile: bool = True # controlled by exp_mode
     user_profile_id: int = 0
@@ -24,6 +26,8 @@ class Config:
     bot_mode: str = "react_bot"
     bot_template_fn: str = None     # "flowagent/bot_pdl.jinja"
     bot_llm_name: str = "gpt-4o"
+    bot_llm_cache: bool = False
+    bot_llm_stream: bool = False    # stream & stop once the ReAct block is complete. NOTE: not cached
     bot_action_limit: int = 5
     bot_retry_limit: int = 3
     pdl_check_dependency: bool = True
@@ -33,27 +37,61 @@ class Config:
     api_mode: str = "llm"
     api_template_fn: str = None     # "flowagent/api_llm.jinja"
     api_llm_name: str = "gpt-4o"
+    api_llm_cache: bool = True      # deterministic roles are cached across re-runs (see `llm_cache_fn`)
+
+    llm_cache_fn: str = None           # default: `.cache/llm_cache.sqlite` under the project root
+    llm_cache_max_size_mb: int = 1024
+    llm_pool_max_connections: int = 100     # shared by all roles using the same model & endpoint
+    llm_pool_max_keepalive: int = 20
+    llm_pool_keepalive_expiry: float = 30.0
+    llm_pool_http2: bool = False
+    llm_rpm: int = None                     # rate limits per model endpoint, override the `rpm`/`tpm` in LLM_CFG
+    llm_tpm: int = None
+    llm_cassette_fn: str = None             # for the `record/{model}` & `replay/{model}` LLMs. default: `.cache/llm_cassette.jsonl`
+    llm_replay_latency: float = None        # seconds per replayed call, None for the recorded latency
+    llm_lb_failure_threshold: int = 3       # multi-endpoint models: consecutive 5xx/timeouts to take an endpoint out
+    llm_lb_recovery_time: float = 30.0      # seconds before probing it again
+    llm_lb_health_check_interval: float = None  # seconds between active health checks, None to disable
+    llm_chat_messages: bool = False         # roles send [system (static), conversation..., per-turn fields] messages, for prefix caching
+    llm_hedge: bool = False                 # send a duplicate of calls slower than the per-model p95 latency
+    llm_hedge_quantile: float = 0.95
+    llm_hedge_max_ratio: float = 0.1        # at most this fraction of the calls are hedged
 
     conversation_turn_limit: int = 20
     log_utterence_time: bool = True
     log_to_db: bool = True
 
-    db_uri: str = 'mongodb://localhost:27017/'
+    db_uri: str = 'mongodb://localhost:27017/'   # or `sqlite:///runs.db`: an embedded single-file DB, no server
     db_name: str = "pdl"
     db_message_collection_name: str = "messages"
     db_meta_collection_name: str = "config"
+    db_pool_max_size: int = 100             # shared by all DBManagers of the same uri in the process
+    db_pool_min_size: int = 0
+    db_pool_max_idle_time_ms: int = None
+    db_write_behind: bool = False           # queue the inserts of the simulations & judges, written in batches by a background thread
+    db_write_batch_size: int = 500
+    db_write_flush_interval: float = 0.5    # seconds, max delay of a queued insert
+    db_write_queue_size: int = 10000        # the workers block while the queue is full
     
     simulate_num_persona: int = -1
     simulate_max_workers: int = 10
     simulate_force_rerun: bool = False
+    simulate_max_concurrency: int = 1000    # for exp_engine=async
     
     judge_max_workers: int = 10
+    judge_max_concurrency: int = 1000       # for exp_engine=async
     judge_model_name: str = "gpt-4o"
+    judge_llm_cache: bool = True
     judge_conversation_id: str = None   # the conversation to be judged
     # judge_passrate_threshold: int = 3
     judge_log_to: str = "wandb"
     judge_force_rejudge: bool = False
+    judge_planned: bool = False             # set by `EvalUtils.get_evaluation_configs`: the judged conversations are filtered out, skip the check
     judge_retry_limit: int = 3
+    judge_batch: bool = False               # judge with the (offline) batch API, see `Evaluator.run_evaluations_batch`
+    judge_batch_backend: str = "openai"     # openai, local (in-process stand-in, via the interactive endpoint)
+    judge_batch_poll_interval: float = 30.0
+    judge_batch_timeout: float = 86400.0
 
     def to_dict(self):
         return asdict(self)
@@ -61,10 +99,9 @@ class Config:
     @classmethod
     def from_yaml(cls, yaml_file: str):
         with open(yaml_file, 'r') as file:
-            # replace ${} with os.environ, with jinja2
-            context = file.read()
-            content = jinja2.Template(context).render(os.environ)
-            data = yaml.safe_load(content)
+            # replace {{VAR}} with os.environ, with jinja2 (skipped when there is no template marker)
+            content = render_env_template(file.read())
+            data = yaml_load(content)
         obj = cls(**data)
         return obj
     
@@ -1,45 +1,254 @@
 """ updated @240906
-
+DBManager: the storage interface, the backend is selected by the scheme of the uri
+    - MongoDBManager: `mongodb://...`
+    - SQLiteDBManager (db_sqlite.py): `sqlite:///runs.db`, an embedded single-file DB
 """
-from typing import List
-import pymongo, pymongo.results
-from .base_data import Message, Conversation, Role
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import pymongo, pymongo.errors
+from .base_data import Message, Conversation, Role, decode_message
+from .config import Config
+from .db_client import MongoClientRegistry
+from .db_writer import DBWriter, get_db_writer
+
+# the fields identifying a single run experiment, see `BaseController._check_if_already_run`
+RUN_EXPERIMENT_KEYS = ["exp_version", "exp_mode", "workflow_dataset", "workflow_type", "workflow_id", "user_profile_id"]
+# {collection: [index keys]} of the hot queries, see `DBManager.ensure_indexes` & `DBManager.explain_hot_queries`
+INDEXES = {
+    "collection": [
+        [("conversation_id", 1), ("utterance_id", 1)],         # query_messages_by_conversation_id, llm stats
+    ],
+    "collection_meta": [
+        [("conversation_id", 1)],                               # query_config_by_conversation_id
+        [("exp_version", 1), ("conversation_id", -1)],          # query_run_experiments({exp_version}), get_exp_llm_stats
+        [(k, 1) for k in RUN_EXPERIMENT_KEYS] + [("conversation_id", -1)],     # BaseController._check_if_already_run
+    ],
+    "collection_eval": [
+        [("conversation_id", 1)],                               # Judger._check_if_judged
+        [("exp_version", 1), ("conversation_id", 1)],          # Analyzer._collect_exp_results, query_evaluated_conversation_ids (covered)
+    ],
+}
+# the collections whose indexes are ensured in this process: {(uri, db_name, collection_name)}
+_INDEXED = set()
+_INDEXED_LOCK = threading.Lock()
+
+
+class DBManager(ABC):
+    """ storage of the simulated conversations (messages), the run experiments (configs) & the judge results (evaluations)
+    the backend is the subclass whose `schemes` contain the scheme of `uri`, e.g.
+        DBManager("mongodb://localhost:27017/", "pdl")     # -> MongoDBManager
+        DBManager("sqlite:///runs.db", "pdl")              # -> SQLiteDBManager
+    NOTE: the inserts return None, the deletes the number of deleted docs (written after the queued inserts)
+    NOTE: with `write_behind` (`writer_kwargs`: options of the `DBWriter`), the inserts are queued & written in batches by a
+        background thread. Call `flush(wait=True)` before querying the inserted docs
+    NOTE: the `INDEXES` are created at the first init in the process (`ensure_indexes=False` to skip)
+    NOTE: the queries are mongo-style filters: {field: value}, or {field: {"$in": [...]}} etc.
+    """
+    schemes: List[str] = []
+    writer: Optional[DBWriter] = None
+
+    def __new__(cls, uri: str = None, *args, **kwargs) -> "DBManager":
+        if cls is DBManager:
+            cls = cls.get_backend(uri)
+        return super().__new__(cls)
+
+    @staticmethod
+    def get_backend(uri: str) -> type:
+        """ the subclass serving `uri`. NOTE: no uri (e.g. unset `DB_URI`) -> mongodb on localhost """
+        if not uri or "://" not in str(uri): return MongoDBManager
+        scheme = str(uri).split("://", 1)[0].lower()
+        def _subclasses(cls: type) -> Iterator[type]:
+            for sub in cls.__subclasses__():
+                yield sub
+                yield from _subclasses(sub)
+        for sub in _subclasses(DBManager):
+            if scheme in sub.__dict__.get("schemes", []): return sub
+        raise ValueError(f"Unknown DB scheme `{scheme}` of {uri}")
+
+    @classmethod
+    def from_config(cls, cfg: Config, **kwargs) -> "DBManager":
+        """ the DB, collections, pool & write-behind options of `cfg` """
+        return cls(
+            cfg.db_uri, cfg.db_name, cfg.db_message_collection_name, cfg.db_meta_collection_name,
+            write_behind=cfg.db_write_behind, writer_kwargs=dict(
+                batch_size=cfg.db_write_batch_size, flush_interval=cfg.db_write_flush_interval, max_queue_size=cfg.db_write_queue_size,
+            ),
+            pool_kwargs=dict(
+                max_pool_size=cfg.db_pool_max_size, min_pool_size=cfg.db_pool_min_size, max_idle_time_ms=cfg.db_pool_max_idle_time_ms,
+            ),
+            **kwargs
+        )
+
+    def flush(self, wait: bool = False, timeout: float = None) -> bool:
+        """ write the queued inserts now (no-op without `write_behind`). With `wait`, block until they are written """
+        if self.writer is None: return True
+        return self.writer.flush(wait=wait, timeout=timeout)
+
+    @abstractmethod
+    def ensure_indexes(self, force: bool = False) -> None:
+        """ create the `INDEXES` (no-op if they exist), once per collection in the process unless `force` """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def insert_message(self, message: Message) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def insert_conversation(self, conversation: Conversation) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def query_messages_by_conversation_id(self, conversation_id: str) -> Conversation:
+        """ the messages of a conversation, sorted by `utterance_id` """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_conversation_llm_stats(self, conversation_id: str) -> List[dict]:
+        """ tokens/latency rollup of a conversation, per role """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_exp_llm_stats(self, exp_version: str) -> List[dict]:
+        """ tokens/latency rollup of an experiment, per (conversation_id, role) """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def insert_config(self, infos: dict) -> None:
+        """ record one experiment """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def query_config_by_conversation_id(self, conversation_id: str) -> Optional[dict]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_most_recent_unique_conversation_ids(self, query: dict = {}, limit: int = 0) -> List[str]:
+        """ query collection_meta, sort by conversation_id """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def query_run_experiments(self, query: dict = {}, limit: int = 0) -> List[dict]:
+        """ the run experiments (configs) matching `query`, the most recent first. `limit=0`: no limit """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def delete_run_experiments(self, query: dict = {}) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_all_run_exp_versions(self) -> List[str]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def query_evaluations(self, query: dict = {}, limit: int = 0) -> List[dict]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def query_evaluated_conversation_ids(self, query: dict = {}) -> List[str]:
+        """ the `conversation_id` of the evaluations matching `query`, in one projected query (e.g. to plan the judges) """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def insert_evaluation(self, eval_result: dict) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def delete_evaluations(self, query: dict = {}) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def explain_hot_queries(self, sample: dict = None) -> List[Dict[str, Any]]:
+        """ the query plans of the hot queries, `collscan` flags the ones scanning the whole collection
+        sample: the values of the queries (default: the most recent run experiment)
+        """
+        raise NotImplementedError()
+
+
+class MongoDBManager(DBManager):
+    """ NOTE: the instances of the same `uri` share one `MongoClient` (`pool_kwargs`: see `MongoClientRegistry.get`) """
+    schemes = ["mongodb", "mongodb+srv"]
 
-class DBManager:
     def __init__(
         self, uri='mongodb://localhost:27017/', db_name='message_database', 
         collection_name='messages', meta_collection_name='config', eval_collection_name='evaluations',
+        write_behind: bool = False, writer_kwargs: dict = None, ensure_indexes: bool = True, pool_kwargs: dict = None,
         **kwargs
     ) -> None:
-        self.client = pymongo.MongoClient(uri)
+        self.uri = uri
+        self.client = MongoClientRegistry.get(uri, **(pool_kwargs or {}))
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
         self.collection_meta = self.db[meta_collection_name]
         self.collection_eval = self.db[eval_collection_name]
+        if write_behind:
+            self.writer = get_db_writer(uri, db_name, self.db, **(writer_kwargs or {}))
+        if ensure_indexes:
+            self.ensure_indexes()
 
-    def insert_message(self, message: Message) -> pymongo.results.InsertOneResult:
+    def ensure_indexes(self, force: bool = False) -> None:
+        for attr, indexes in INDEXES.items():
+            collection = getattr(self, attr)
+            key = (self.uri, self.db.name, collection.name)
+            with _INDEXED_LOCK:
+                if key in _INDEXED and not force: continue
+                _INDEXED.add(key)
+            try:
+                collection.create_indexes([pymongo.IndexModel(keys) for keys in indexes])
+            except pymongo.errors.PyMongoError as e:
+                with _INDEXED_LOCK: _INDEXED.discard(key)
+                print(f"  <db> WARNING: failed to create the indexes of {collection.name}: {e}")
+
+    def insert_message(self, message: Message) -> None:
         message_dict = message.to_dict()
-        res = self.collection.insert_one(message_dict)
+        if self.writer is not None:
+            return self.writer.insert(self.collection.name, [message_dict])
+        self.collection.insert_one(message_dict)
         # print(f"  <db> Inserted message: {message.content}")
 
-    def insert_conversation(self, conversation: Conversation) -> pymongo.results.InsertManyResult:
+    def insert_conversation(self, conversation: Conversation) -> None:
         msg_list = conversation.to_list()
-        res = self.collection.insert_many(msg_list)
-        return res
+        if self.writer is not None:
+            return self.writer.insert(self.collection.name, msg_list)
+        self.collection.insert_many(msg_list)
 
     def query_messages_by_conversation_id(self, conversation_id: str) -> Conversation:
         query = {"conversation_id": conversation_id}
-        results = self.collection.find(query)
+        results = self.collection.find(query).sort("utterance_id", 1)
         results = [res for res in results]
         if len(results)==0:
             return Conversation()
-        messages = [Message(**{**res, "role": Role.get_by_rolename(res["role"])}) for res in results]
+        messages = [decode_message(res) for res in results]
         return Conversation.from_messages(messages)
     
-    def insert_config(self, infos: dict) -> pymongo.results.InsertOneResult:
-        """ record one experiment """
-        res = self.collection_meta.insert_one(infos)
-        return res
+    @staticmethod
+    def _llm_stats_pipeline(match: dict, group_keys: List[str]) -> List[dict]:
+        sum_keys = ["num_calls", "prompt_tokens", "completion_tokens", "cached_tokens", "wall_time", "retries", "num_cache_hits", "num_hedges"]
+        return [
+            {"$match": {**match, "llm_stat": {"$ne": None}}},
+            {"$group": {
+                "_id": {k: f"${k}" for k in group_keys},
+                "num_messages": {"$sum": 1},
+                **{k: {"$sum": f"$llm_stat.{k}"} for k in sum_keys},
+            }},
+        ]
+
+    def _aggregate_llm_stats(self, match: dict, group_keys: List[str]) -> List[dict]:
+        """ sum the `llm_stat` of messages, grouped by `group_keys` (e.g. conversation_id, role) """
+        pipeline = self._llm_stats_pipeline(match, group_keys)
+        return [{**res.pop("_id"), **res} for res in self.collection.aggregate(pipeline)]
+
+    def get_conversation_llm_stats(self, conversation_id: str) -> List[dict]:
+        return self._aggregate_llm_stats({"conversation_id": conversation_id}, ["role"])
+
+    def get_exp_llm_stats(self, exp_version: str) -> List[dict]:
+        conversation_ids = self.collection_meta.distinct("conversation_id", {"exp_version": exp_version})
+        return self._aggregate_llm_stats({"conversation_id": {"$in": conversation_ids}}, ["conversation_id", "role"])
+    
+    def insert_config(self, infos: dict) -> None:
+        if self.writer is not None:
+            return self.writer.insert(self.collection_meta.name, [infos])
+        self.collection_meta.insert_one(infos)
     
     def query_config_by_conversation_id(self, conversation_id: str) -> dict:
         query = {"conversation_id": conversation_id}
@@ -49,7 +258,6 @@ class DBManager:
     def get_most_recent_unique_conversation_ids(
         self, query: dict = {}, limit: int = 0
     ) -> List[str]:
-        """ query collection_meta, sort by conversation_id """
         sort_order = [('conversation_id', -1)]
         results = self.collection_meta.find(query).sort(sort_order).limit(limit)
         return [res["conversation_id"] for res in results]
@@ -59,9 +267,10 @@ class DBManager:
         results = self.collection_meta.find(query).sort(sort_order).limit(limit)
         return [res for res in results]
     
-    def delete_run_experiments(self, query: dict = {}) -> pymongo.results.DeleteResult:
+    def delete_run_experiments(self, query: dict = {}) -> int:
+        self.flush(wait=True)       # the queued inserts would be written after the deletion
         res = self.collection_meta.delete_many(query)
-        return res
+        return res.deleted_count
     
     def get_all_run_exp_versions(self) -> List[str]:
         results = self.collection_meta.distinct("exp_version")
@@ -71,17 +280,92 @@ class DBManager:
         results = self.collection_eval.find(query).limit(limit)
         return [res for res in results]
     
-    def insert_evaluation(self, eval_result: dict) -> pymongo.results.InsertOneResult:
-        res = self.collection_eval.insert_one(eval_result)
-        return res
+    def query_evaluated_conversation_ids(self, query: dict = {}) -> List[str]:
+        results = self.collection_eval.find(query, {"conversation_id": 1, "_id": 0})
+        return [res["conversation_id"] for res in results]
+
+    def insert_evaluation(self, eval_result: dict) -> None:
+        if self.writer is not None:
+            return self.writer.insert(self.collection_eval.name, [eval_result])
+        self.collection_eval.insert_one(eval_result)
     
-    def delete_evaluations(self, query: dict = {}) -> pymongo.results.DeleteResult:
+    def delete_evaluations(self, query: dict = {}) -> int:
+        self.flush(wait=True)
         res = self.collection_eval.delete_many(query)
-        return res
+        return res.deleted_count
+
+    def _hot_queries(self, sample: dict) -> List[Tuple[str, dict]]:
+        """ (name, command) of the hot queries, filled with the values of a run experiment `sample` """
+        cid, exp_version = sample.get("conversation_id"), sample.get("exp_version")
+        msgs, meta, evals = self.collection.name, self.collection_meta.name, self.collection_eval.name
+        return [
+            ("query_messages_by_conversation_id", {"find": msgs, "filter": {"conversation_id": cid}, "sort": {"utterance_id": 1}}),
+            ("get_conversation_llm_stats", {"aggregate": msgs, "pipeline": self._llm_stats_pipeline({"conversation_id": cid}, ["role"]), "cursor": {}}),
+            ("query_config_by_conversation_id", {"find": meta, "filter": {"conversation_id": cid}, "limit": 1}),
+            ("query_run_experiments(exp_version)", {"find": meta, "filter": {"exp_version": exp_version}, "sort": {"conversation_id": -1}}),
+            ("get_exp_llm_stats(conversation_ids)", {"distinct": meta, "key": "conversation_id", "query": {"exp_version": exp_version}}),
+            ("_check_if_already_run", {"find": meta, "filter": {k: sample.get(k) for k in RUN_EXPERIMENT_KEYS}, "sort": {"conversation_id": -1}}),
+            ("query_evaluations(conversation_id)", {"find": evals, "filter": {"conversation_id": cid}}),
+            ("query_evaluations(exp_version)", {"find": evals, "filter": {"exp_version": exp_version}}),
+            ("query_evaluated_conversation_ids", {"find": evals, "filter": {"exp_version": exp_version}, "projection": {"conversation_id": 1, "_id": 0}}),
+        ]
+
+    def explain_hot_queries(self, sample: dict = None) -> List[Dict[str, Any]]:
+        """ with `explain` (executionStats) """
+        if sample is None:
+            sample = self.collection_meta.find_one(sort=[("conversation_id", -1)]) or {}
+        rows = []
+        for name, command in self._hot_queries(sample):
+            explain = self.db.command("explain", command, verbosity="executionStats")
+            stages = plan_stages(explain)
+            winning_plan = _find_key(explain, "winningPlan")
+            stats = _find_key(explain, "executionStats") or {}
+            rows.append({
+                "query": name,
+                "collection": next(iter(command.values())),
+                "plan": " <- ".join(stages),
+                "index": _find_key(winning_plan, "indexName"),
+                "collscan": "COLLSCAN" in stages,
+                "n_returned": stats.get("nReturned"),
+                "keys_examined": stats.get("totalKeysExamined"),
+                "docs_examined": stats.get("totalDocsExamined"),
+                "time_ms": stats.get("executionTimeMillis"),
+            })
+        return rows
+
+
+def _find_key(ob: Any, key: str, skip: Tuple[str, ...] = ("rejectedPlans", "allPlansExecution")) -> Any:
+    """ the first value of `key` in the nested dicts/lists `ob` (depth-first), ignoring the `skip` subtrees """
+    if isinstance(ob, dict):
+        if key in ob: return ob[key]
+        children = [v for k, v in ob.items() if k not in skip]
+    elif isinstance(ob, list):
+        children = ob
+    else: return None
+    for child in children:
+        res = _find_key(child, key, skip)
+        if res is not None: return res
+    return None
+
+def plan_stages(explain: dict) -> List[str]:
+    """ the stages of the winning plan of an `explain` output, from the root, e.g. ["FETCH", "IXSCAN"]
+    NOTE: the aggregations & the slot-based engine nest the plan differently, the first `winningPlan` found is used
+    """
+    stages = []
+    def _walk(plan: Any) -> None:
+        if isinstance(plan, dict):
+            if "stage" in plan: stages.append(plan["stage"])
+            for k, v in plan.items():
+                if k not in ("rejectedPlans",): _walk(v)
+        elif isinstance(plan, list):
+            for v in plan: _walk(v)
+    winning_plan = _find_key(explain, "winningPlan")
+    _walk(winning_plan.get("queryPlan", winning_plan) if isinstance(winning_plan, dict) else winning_plan)
+    return stages
 
 
 if __name__ == "__main__":
-    db_manager = DBManager(db_name="test_db", collection_name="messages")
+    db_manager = DBManager("mongodb://localhost:27017/", db_name="test_db", collection_name="messages")
 
     message = Message(role=Role.USER, content="Hello", prompt="prompt", llm_response="response", conversation_id="conv1", utterance_id=1)
     db_manager.insert_message(message)
@@ -0,0 +1,106 @@
+""" Process-wide MongoClients: one client (monitor threads & connection pool) per uri, shared by all `DBManager`s & `DBWriter`s
+
+USAGE:
+    client = MongoClientRegistry.get(uri, max_pool_size=200)
+    print(MongoClientRegistry.get_stats())
+"""
+
+import threading
+from typing import Any, Dict
+import pymongo, pymongo.monitoring
+
+
+class PoolListener(pymongo.monitoring.ConnectionPoolListener):
+    """ connection counters of a client's pools (all servers) """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.open_connections = 0
+        self.max_open_connections = 0
+        self.num_created = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.num_checkouts = 0
+        self.num_checkout_failures = 0
+
+    def connection_created(self, event) -> None:
+        with self._lock:
+            self.num_created += 1
+            self.open_connections += 1
+            self.max_open_connections = max(self.max_open_connections, self.open_connections)
+
+    def connection_closed(self, event) -> None:
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_checked_out(self, event) -> None:
+        with self._lock:
+            self.num_checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def connection_checked_in(self, event) -> None:
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_check_out_failed(self, event) -> None:
+        with self._lock:
+            self.num_checkout_failures += 1
+
+    def pool_created(self, event) -> None: pass
+    def pool_ready(self, event) -> None: pass
+    def pool_cleared(self, event) -> None: pass
+    def pool_closed(self, event) -> None: pass
+    def connection_ready(self, event) -> None: pass
+    def connection_check_out_started(self, event) -> None: pass
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "max_open_connections": self.max_open_connections,
+                "num_created": self.num_created,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "num_checkouts": self.num_checkouts,
+                "num_checkout_failures": self.num_checkout_failures,
+            }
+
+
+class MongoClientRegistry:
+    """ shared, thread-safe MongoClients keyed by uri: one set of monitor threads & one connection pool per server
+    NOTE: the pool options of the first request of a uri take effect, e.g. `max_pool_size`, `min_pool_size`, `max_idle_time_ms`
+    """
+    _clients: Dict[str, pymongo.MongoClient] = {}
+    _listeners: Dict[str, PoolListener] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(
+        cls, uri: str, max_pool_size: int = 100, min_pool_size: int = 0, max_idle_time_ms: int = None, **kwargs
+    ) -> pymongo.MongoClient:
+        with cls._lock:
+            if uri not in cls._clients:
+                listener = PoolListener()
+                cls._clients[uri] = pymongo.MongoClient(
+                    uri, maxPoolSize=max_pool_size, minPoolSize=min_pool_size, maxIdleTimeMS=max_idle_time_ms,
+                    event_listeners=[listener], **kwargs
+                )
+                cls._listeners[uri] = listener
+            return cls._clients[uri]
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, Any]]:
+        """ connection counters of each client """
+        with cls._lock:
+            items = list(cls._listeners.items())
+        return {uri: listener.to_dict() for uri, listener in items}
+
+    @classmethod
+    def clear(cls) -> None:
+        """ close all clients. NOTE: the `DBManager`s & `DBWriter`s holding them can no longer be used """
+        with cls._lock:
+            clients = list(cls._clients.values())
+            cls._clients.clear()
+            cls._listeners.clear()
+        for client in clients:
+            client.close()
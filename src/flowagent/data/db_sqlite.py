@@ -0,0 +1,297 @@
+""" Embedded single-file storage: the `DBManager` on SQLite, e.g. for `log_to_db` on a laptop or in CI (no MongoDB server)
+
+layout: one table per collection: `_id INTEGER PRIMARY KEY`, the indexed fields of `INDEXES` as columns, and the whole doc as JSON
+    - the queries on the columns use the indexes, the other fields are read with `json_extract`
+    - the inserts of a call (e.g. a conversation, or a batch of the `DBWriter`) are written in one transaction
+NOTE: the file is the database, `db_name` is not used. The relative paths are relative to the working dir, `sqlite:///:memory:` is in memory
+
+USAGE:
+    db = DBManager("sqlite:///runs.db", "pdl")        # -> SQLiteDBManager
+    db.query_run_experiments({"exp_version": "default", "workflow_id": {"$in": ["000", "001"]}})
+"""
+
+import re, json, time, sqlite3, threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .base_data import Message, Conversation, decode_message
+from .db import DBManager, INDEXES, RUN_EXPERIMENT_KEYS
+from .db_writer import get_db_writer
+
+_FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+_LLM_STAT_KEYS = ["num_calls", "prompt_tokens", "completion_tokens", "cached_tokens", "wall_time", "retries", "num_cache_hits", "num_hedges"]
+
+
+class SQLiteStore:
+    """ one connection per database file in the process, shared by the `SQLiteDBManager`s & the `DBWriter`
+    NOTE: the statements are serialized by a lock. WAL mode: readers of other processes are not blocked by the writes
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        self.table2columns: Dict[str, List[str]] = {}
+        self.indexed_tables = set()
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def create_table(self, table: str, columns: List[str]) -> None:
+        with self.lock:
+            if table in self.table2columns: return
+            cols = "".join(f", {c}" for c in columns)     # no type: the values keep their types (e.g. `user_profile_id` is an int)
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (_id INTEGER PRIMARY KEY{cols}, doc TEXT NOT NULL)")
+            self.table2columns[table] = columns
+
+    def insert_many(self, table: str, docs: List[dict]) -> int:
+        """ insert the docs in one transaction """
+        columns = self.table2columns[table]
+        sql = f"INSERT INTO {table} ({''.join(c + ', ' for c in columns)}doc) VALUES ({'?, ' * len(columns)}?)"
+        rows = [
+            [doc.get(c) for c in columns] + [json.dumps({k: v for k, v in doc.items() if k != "_id"}, ensure_ascii=False, default=str)]
+            for doc in docs
+        ]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def execute(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, list(params)).fetchall()
+
+    def __getitem__(self, table: str) -> "_Table":
+        return _Table(self, table)
+
+
+class _Table:
+    """ the `insert_many` of a pymongo collection, for the `DBWriter` """
+    def __init__(self, store: SQLiteStore, table: str) -> None:
+        self.store, self.table = store, table
+
+    def insert_many(self, docs: List[dict], ordered: bool = True) -> None:
+        self.store.insert_many(self.table, docs)
+
+
+# path -> store
+_STORES: Dict[str, SQLiteStore] = {}
+_STORES_LOCK = threading.Lock()
+
+def get_sqlite_store(uri: str) -> SQLiteStore:
+    """ process-wide store of `sqlite:///{path}` """
+    path = uri.split("://", 1)[1]
+    path = path[1:] if path.startswith("/") else path       # sqlite:///runs.db -> runs.db, sqlite:////abs/runs.db -> /abs/runs.db
+    path = path.split("?", 1)[0]
+    if path != ":memory:":
+        path = str(Path(path).resolve())
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with _STORES_LOCK:
+        if path not in _STORES:
+            _STORES[path] = SQLiteStore(path)
+        return _STORES[path]
+
+
+def _field(key: str, columns: List[str]) -> str:
+    if key in columns: return key
+    if not _FIELD_PATTERN.match(key): raise ValueError(f"Invalid field name: {key}")
+    return f"json_extract(doc, '$.{key}')"
+
+def where_clause(query: dict, columns: List[str]) -> Tuple[str, list]:
+    """ translate a mongo-style filter: equality & the operators $eq $ne $in $nin $gt $gte $lt $lte $exists (ANDed)
+    NOTE: like mongo, `{field: None}` also matches the missing fields
+    """
+    conds, params = [], []
+    for key, value in query.items():
+        f = _field(key, columns)
+        ops = value if isinstance(value, dict) and value and all(k.startswith("$") for k in value) else {"$eq": value}
+        for op, v in ops.items():
+            if isinstance(v, dict) or (isinstance(v, list) and op not in ("$in", "$nin")):
+                raise ValueError(f"Unsupported query value for {key}: {v}")
+            if op == "$eq":
+                if v is None: conds.append(f"{f} IS NULL")
+                else: conds.append(f"{f} = ?"); params.append(v)
+            elif op == "$ne":
+                if v is None: conds.append(f"{f} IS NOT NULL")
+                else: conds.append(f"({f} IS NULL OR {f} != ?)"); params.append(v)
+            elif op in ("$in", "$nin"):
+                v = list(v)
+                in_sql = f"{f} IN ({', '.join('?' * len(v))})" if v else "0"
+                conds.append(in_sql if op == "$in" else f"NOT ({in_sql})"); params.extend(v)
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                conds.append(f"{f} {dict(gt='>', gte='>=', lt='<', lte='<=')[op[1:]]} ?"); params.append(v)
+            elif op == "$exists":
+                conds.append(f"{f} IS {'NOT ' if v else ''}NULL")
+            else:
+                raise ValueError(f"Unsupported query operator: {op}")
+    return (" WHERE " + " AND ".join(conds)) if conds else "", params
+
+
+class SQLiteDBManager(DBManager):
+    schemes = ["sqlite"]
+
+    def __init__(
+        self, uri='sqlite:///runs.db', db_name='message_database',
+        collection_name='messages', meta_collection_name='config', eval_collection_name='evaluations',
+        write_behind: bool = False, writer_kwargs: dict = None, ensure_indexes: bool = True,
+        **kwargs
+    ) -> None:
+        self.uri = uri
+        self.store = get_sqlite_store(uri)
+        self.table, self.table_meta, self.table_eval = collection_name, meta_collection_name, eval_collection_name
+        # the attrs of `INDEXES` -> table
+        self._attr2table = {"collection": self.table, "collection_meta": self.table_meta, "collection_eval": self.table_eval}
+        for attr, table in self._attr2table.items():
+            columns = list(dict.fromkeys(k for keys in INDEXES[attr] for k, _ in keys))
+            self.store.create_table(table, columns)
+        if write_behind:
+            self.writer = get_db_writer(uri, db_name, self.store, **(writer_kwargs or {}))
+        if ensure_indexes:
+            self.ensure_indexes()
+
+    def ensure_indexes(self, force: bool = False) -> None:
+        for attr, indexes in INDEXES.items():
+            table = self._attr2table[attr]
+            with self.store.lock:
+                if table in self.store.indexed_tables and not force: continue
+                for keys in indexes:
+                    name = f"{table}__" + "__".join(k for k, _ in keys)
+                    cols = ", ".join(f"{k} {'ASC' if d == 1 else 'DESC'}" for k, d in keys)
+                    self.store.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})")
+                self.store.indexed_tables.add(table)
+
+    def _columns(self, table: str) -> List[str]:
+        return self.store.table2columns[table]
+
+    def _insert(self, table: str, docs: List[dict]) -> None:
+        if self.writer is not None:
+            return self.writer.insert(table, docs)
+        self.store.insert_many(table, docs)
+
+    def _select_sql(self, table: str, query: dict, fields: str = "_id, doc", sort: List[Tuple[str, int]] = None, limit: int = 0) -> Tuple[str, list]:
+        where, params = where_clause(query, self._columns(table))
+        sql = f"SELECT {fields} FROM {table}{where}"
+        if sort:
+            sql += " ORDER BY " + ", ".join(f"{_field(k, self._columns(table))} {'ASC' if d == 1 else 'DESC'}" for k, d in sort)
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return sql, params
+
+    def _find(self, table: str, query: dict, sort: List[Tuple[str, int]] = None, limit: int = 0) -> List[dict]:
+        rows = self.store.execute(*self._select_sql(table, query, sort=sort, limit=limit))
+        return [{"_id": _id, **json.loads(doc)} for _id, doc in rows]
+
+    def _delete(self, table: str, query: dict) -> int:
+        where, params = where_clause(query, self._columns(table))
+        with self.store.lock:
+            return self.store.conn.execute(f"DELETE FROM {table}{where}", params).rowcount
+
+    def insert_message(self, message: Message) -> None:
+        self._insert(self.table, [message.to_dict()])
+
+    def insert_conversation(self, conversation: Conversation) -> None:
+        self._insert(self.table, conversation.to_list())
+
+    def query_messages_by_conversation_id(self, conversation_id: str) -> Conversation:
+        results = self._find(self.table, {"conversation_id": conversation_id}, sort=[("utterance_id", 1)])
+        if len(results) == 0:
+            return Conversation()
+        return Conversation.from_messages([decode_message(res) for res in results])
+
+    def _llm_stats_sql(self, where: str, group_keys: List[str]) -> str:
+        group = ", ".join(_field(k, self._columns(self.table)) for k in group_keys)
+        sums = "".join(f", COALESCE(SUM(json_extract(doc, '$.llm_stat.{k}')), 0)" for k in _LLM_STAT_KEYS)
+        return (
+            f"SELECT {group}, COUNT(*){sums} FROM {self.table}"
+            f"{where} AND json_extract(doc, '$.llm_stat') IS NOT NULL GROUP BY {group}"
+        )
+
+    def _aggregate_llm_stats(self, where: str, params: list, group_keys: List[str]) -> List[dict]:
+        """ sum the `llm_stat` of messages, grouped by `group_keys` (e.g. conversation_id, role) """
+        keys = group_keys + ["num_messages"] + _LLM_STAT_KEYS
+        return [dict(zip(keys, row)) for row in self.store.execute(self._llm_stats_sql(where, group_keys), params)]
+
+    def get_conversation_llm_stats(self, conversation_id: str) -> List[dict]:
+        return self._aggregate_llm_stats(" WHERE conversation_id = ?", [conversation_id], ["role"])
+
+    def get_exp_llm_stats(self, exp_version: str) -> List[dict]:
+        where = f" WHERE conversation_id IN (SELECT conversation_id FROM {self.table_meta} WHERE exp_version = ?)"
+        return self._aggregate_llm_stats(where, [exp_version], ["conversation_id", "role"])
+
+    def insert_config(self, infos: dict) -> None:
+        self._insert(self.table_meta, [infos])
+
+    def query_config_by_conversation_id(self, conversation_id: str) -> Optional[dict]:
+        results = self._find(self.table_meta, {"conversation_id": conversation_id}, limit=1)
+        return results[0] if results else None
+
+    def get_most_recent_unique_conversation_ids(self, query: dict = {}, limit: int = 0) -> List[str]:
+        sql, params = self._select_sql(self.table_meta, query, fields="conversation_id", sort=[("conversation_id", -1)], limit=limit)
+        return [row[0] for row in self.store.execute(sql, params)]
+
+    def query_run_experiments(self, query: dict = {}, limit: int = 0) -> List[dict]:
+        return self._find(self.table_meta, query, sort=[("conversation_id", -1)], limit=limit)
+
+    def delete_run_experiments(self, query: dict = {}) -> int:
+        self.flush(wait=True)       # the queued inserts would be written after the deletion
+        return self._delete(self.table_meta, query)
+
+    def get_all_run_exp_versions(self) -> List[str]:
+        return [row[0] for row in self.store.execute(f"SELECT DISTINCT exp_version FROM {self.table_meta} WHERE exp_version IS NOT NULL")]
+
+    def query_evaluations(self, query: dict = {}, limit: int = 0) -> List[dict]:
+        return self._find(self.table_eval, query, limit=limit)
+
+    def query_evaluated_conversation_ids(self, query: dict = {}) -> List[str]:
+        sql, params = self._select_sql(self.table_eval, query, fields="conversation_id")
+        return [row[0] for row in self.store.execute(sql, params)]
+
+    def insert_evaluation(self, eval_result: dict) -> None:
+        self._insert(self.table_eval, [eval_result])
+
+    def delete_evaluations(self, query: dict = {}) -> int:
+        self.flush(wait=True)
+        return self._delete(self.table_eval, query)
+
+    def _hot_queries(self, sample: dict) -> List[Tuple[str, str, str, list]]:
+        """ (name, table, sql, params) of the hot queries, filled with the values of a run experiment `sample` """
+        cid, exp_version = sample.get("conversation_id"), sample.get("exp_version")
+        return [
+            ("query_messages_by_conversation_id", self.table, *self._select_sql(self.table, {"conversation_id": cid}, sort=[("utterance_id", 1)])),
+            ("get_conversation_llm_stats", self.table, self._llm_stats_sql(" WHERE conversation_id = ?", ["role"]), [cid]),
+            ("query_config_by_conversation_id", self.table_meta, *self._select_sql(self.table_meta, {"conversation_id": cid}, limit=1)),
+            ("query_run_experiments(exp_version)", self.table_meta, *self._select_sql(self.table_meta, {"exp_version": exp_version}, sort=[("conversation_id", -1)])),
+            ("get_exp_llm_stats", self.table, self._llm_stats_sql(
+                f" WHERE conversation_id IN (SELECT conversation_id FROM {self.table_meta} WHERE exp_version = ?)", ["conversation_id", "role"]
+            ), [exp_version]),
+            ("_check_if_already_run", self.table_meta, *self._select_sql(
+                self.table_meta, {k: sample.get(k) for k in RUN_EXPERIMENT_KEYS}, sort=[("conversation_id", -1)]
+            )),
+            ("query_evaluations(conversation_id)", self.table_eval, *self._select_sql(self.table_eval, {"conversation_id": cid})),
+            ("query_evaluations(exp_version)", self.table_eval, *self._select_sql(self.table_eval, {"exp_version": exp_version})),
+            ("query_evaluated_conversation_ids", self.table_eval, *self._select_sql(self.table_eval, {"exp_version": exp_version}, fields="conversation_id")),
+        ]
+
+    def explain_hot_queries(self, sample: dict = None) -> List[Dict[str, Any]]:
+        """ with `EXPLAIN QUERY PLAN`: a `SCAN {table}` without index is a full scan """
+        if sample is None:
+            sample = (self.query_run_experiments(limit=1) or [{}])[0]
+        rows = []
+        for name, table, sql, params in self._hot_queries(sample):
+            details = [row[-1] for row in self.store.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            indexes = [m.group(1) for d in details for m in [re.search(r"USING (?:COVERING )?INDEX (\w+)", d)] if m]
+            start = time.perf_counter()
+            n_returned = len(self.store.execute(sql, params))
+            rows.append({
+                "query": name,
+                "collection": table,
+                "plan": " <- ".join(details),
+                "index": indexes[0] if indexes else None,
+                "collscan": any(re.match(r"SCAN \w+$", d) for d in details),
+                "n_returned": n_returned,
+                "time_ms": round((time.perf_counter() - start) * 1000, 2),
+            })
+        return rows
@@ -0,0 +1,220 @@
+""" Write-behind DB writer: the inserts are queued & written by a background thread, in unordered `insert_many` batches
+    - a batch is written when it has `batch_size` documents, after `flush_interval` seconds, or when a flush is requested
+    - the queue is bounded (`max_queue_size`): the inserting threads block while it is full (backpressure)
+    - all writers are flushed & stopped at exit
+
+USAGE:
+    writer = get_db_writer(uri, db_name, batch_size=500, flush_interval=0.5)
+    writer.insert("messages", [msg.to_dict() for msg in conversation])
+    writer.flush()              # e.g. at the end of a conversation. `flush(wait=True)` blocks until the queued docs are written
+    print(get_all_db_writer_stats())
+NOTE: the written docs are not visible to the queries until flushed
+"""
+
+import time, math, atexit, threading, collections
+from typing import Any, Dict, List, Optional, Tuple
+import pymongo, pymongo.errors
+from .db_client import MongoClientRegistry
+
+
+class _Flush:
+    """ queue marker: write the current batch, then set `done` """
+    def __init__(self, done: threading.Event = None) -> None:
+        self.done = done
+
+_STOP = object()
+_DUPLICATE_KEY = 11000
+
+
+class DBWriter:
+    def __init__(
+        self, db: Any, batch_size: int = 500, flush_interval: float = 0.5, max_queue_size: int = 10000,
+        max_retries: int = 3,
+    ) -> None:
+        self.db = db
+        self.batch_size, self.flush_interval, self.max_queue_size, self.max_retries = batch_size, flush_interval, max_queue_size, max_retries
+        # items: (collection_name, docs) | _Flush | _STOP. NOTE: the queue size counts the docs
+        self._queue: "collections.deque" = collections.deque()
+        self._queue_depth = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._flush_latencies = collections.deque(maxlen=500)
+        self.num_enqueued = 0
+        self.num_written = 0
+        self.num_dropped = 0        # failed after `max_retries`
+        self.num_batches = 0
+        self.num_blocked = 0        # inserts which waited for space in the queue
+        self.max_batch_size = 0
+        self.max_queue_depth = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any, num_docs: int = 0) -> None:
+        with self._lock:
+            if num_docs and self._queue_depth + num_docs > self.max_queue_size and self._queue_depth > 0:    # one chunk always fits
+                self.num_blocked += 1
+                while self._queue_depth + num_docs > self.max_queue_size and self._queue_depth > 0:
+                    self._not_full.wait()
+            self._queue.append(item)
+            self._queue_depth += num_docs
+            self.num_enqueued += num_docs
+            self.max_queue_depth = max(self.max_queue_depth, self._queue_depth)
+            self._not_empty.notify()
+
+    def insert(self, collection_name: str, docs: List[dict]) -> None:
+        """ queue the docs to be inserted into `collection_name`. Blocks while the queue is full
+        NOTE: shallow copies are queued (`insert_many` sets their `_id` in the writer thread), the caller keeps its docs
+        """
+        if self._closed: raise RuntimeError("DBWriter is closed")
+        for i in range(0, len(docs), self.batch_size):
+            chunk = [dict(doc) for doc in docs[i:i + self.batch_size]]
+            self._put((collection_name, chunk), len(chunk))
+
+    def flush(self, wait: bool = False, timeout: float = None) -> bool:
+        """ write the queued docs now. With `wait`, block until they are written (False on timeout) """
+        if self._closed: return True
+        done = threading.Event() if wait else None
+        self._put(_Flush(done))
+        return done.wait(timeout) if wait else True
+
+    def close(self, timeout: float = None) -> None:
+        """ write the queued docs & stop the thread """
+        if self._closed: return
+        self._closed = True
+        self._put(_STOP)
+        self._thread.join(timeout)
+
+    def _get_batch(self) -> Tuple[List[Tuple[str, List[dict]]], List[_Flush], bool]:
+        """ wait for the next batch: (items, flushes, stop). Cut at `batch_size` docs, after `flush_interval`, or at a flush marker
+        NOTE: at a flush marker, the items already queued behind it are taken as well (e.g. other conversations ended meanwhile)
+        """
+        items, flushes, num_docs, stop = [], [], 0, False
+        with self._lock:
+            while not self._queue:
+                self._not_empty.wait()
+            deadline = time.monotonic() + self.flush_interval
+            while num_docs < self.batch_size and not stop:
+                if not self._queue:
+                    remaining = deadline - time.monotonic()
+                    if flushes or remaining <= 0: break
+                    self._not_empty.wait(remaining)
+                    continue
+                item = self._queue.popleft()
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, _Flush):
+                    flushes.append(item)
+                else:
+                    items.append(item)
+                    num_docs += len(item[1])
+            self._queue_depth -= num_docs
+            self._not_full.notify_all()
+        return items, flushes, stop
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            items, flushes, stop = self._get_batch()
+            if items:
+                self._write(items)
+            for f in flushes:
+                if f.done is not None: f.done.set()
+        # after `close`: nothing should be queued, but release the pending flushes if any
+        with self._lock:
+            for item in self._queue:
+                if isinstance(item, _Flush) and item.done is not None: item.done.set()
+
+    def _write(self, items: List[Tuple[str, List[dict]]]) -> None:
+        collection2docs: Dict[str, List[dict]] = collections.defaultdict(list)
+        for collection_name, docs in items:
+            collection2docs[collection_name].extend(docs)
+        batch_size = sum(len(docs) for docs in collection2docs.values())
+        start = time.perf_counter()
+        num_written = 0
+        for collection_name, docs in collection2docs.items():
+            num_written += self._insert_many(collection_name, docs)
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.num_batches += 1
+            self.num_written += num_written
+            self.num_dropped += batch_size - num_written
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self._flush_latencies.append(latency)
+
+    def _insert_many(self, collection_name: str, docs: List[dict]) -> int:
+        """ number of inserted docs
+        NOTE: `insert_many` sets the `_id` of the docs, so the docs already written before a failure are duplicated keys when
+            retried (counted as written). On a `BulkWriteError` (unordered: the other docs are written) only the failed docs are
+            retried, except the duplicated keys of the first attempt
+        """
+        num_written = 0
+        for retry_ in range(self.max_retries):
+            try:
+                self.db[collection_name].insert_many(docs, ordered=False)
+                return num_written + len(docs)
+            except pymongo.errors.BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                failed = [err for err in errors if err.get("code") != _DUPLICATE_KEY]
+                num_written += len(docs) - (len(errors) if retry_ == 0 else len(failed))
+                if not failed: return num_written
+                docs = [docs[err["index"]] for err in failed]
+                error = failed[0].get("errmsg")
+            except Exception as e:
+                error = e
+            print(f"  <db> insert_many into {collection_name} failed ({retry_+1}/{self.max_retries}): {error}")
+            if retry_ < self.max_retries - 1: time.sleep(min(2 ** retry_, 10))
+        return num_written
+
+    def get_stat(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._flush_latencies)
+            return {
+                "queue_depth": self._queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "num_enqueued": self.num_enqueued,
+                "num_written": self.num_written,
+                "num_dropped": self.num_dropped,
+                "num_blocked": self.num_blocked,
+                "num_batches": self.num_batches,
+                "avg_batch_size": (self.num_written + self.num_dropped) / self.num_batches if self.num_batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "avg_flush_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p95_flush_latency": latencies[math.ceil(0.95 * len(latencies)) - 1] if latencies else 0.0,
+            }
+
+
+# (uri, db_name) -> writer
+_WRITERS: Dict[Tuple[str, str], DBWriter] = {}
+_WRITERS_LOCK = threading.Lock()
+
+def get_db_writer(uri: str, db_name: str, db: Any = None, **kwargs) -> DBWriter:
+    """ process-wide writer per database. NOTE: the options of the first call take effect
+    db: where `db[collection_name].insert_many(docs, ordered=False)` writes, default: the mongo database `db_name` of `uri`
+    """
+    key = (uri, db_name)
+    with _WRITERS_LOCK:
+        if key not in _WRITERS:
+            _WRITERS[key] = DBWriter(db if db is not None else MongoClientRegistry.get(uri)[db_name], **kwargs)
+        return _WRITERS[key]
+
+def get_all_db_writer_stats() -> Dict[str, Dict[str, Any]]:
+    with _WRITERS_LOCK:
+        items = list(_WRITERS.items())
+    return {f"{db_name}@{uri}": writer.get_stat() for (uri, db_name), writer in items}
+
+def flush_all_db_writers(timeout: Optional[float] = None) -> None:
+    """ block until all queued docs are written, e.g. before querying the results of the simulations """
+    with _WRITERS_LOCK:
+        writers = list(_WRITERS.values())
+    for writer in writers:
+        writer.flush(wait=True, timeout=timeout)
+
+@atexit.register
+def close_all_db_writers() -> None:
+    with _WRITERS_LOCK:
+        writers = list(_WRITERS.values())
+        _WRITERS.clear()
+    for writer in writers:
+        writer.close()
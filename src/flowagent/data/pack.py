@@ -0,0 +1,136 @@
+""" Compiled dataset pack: all files of `dataset/<name>/` in one indexed, memory-mapped file with pre-parsed payloads
+
+layout: MAGIC | version (u32) | index offset (u64) | payloads... | index
+    - payloads are pickled: the parsed .yaml/.json files, the text of the others; PDL files keep both (text, parsed)
+    - the lists of profiles (`_LAZY_DIRS`) are stored item by item, so that they can be decoded lazily (`LazyList`)
+    - index: {relative path: (offset, length)}, or {relative path: [(offset, length), ...]} for the lists
+NOTE: the payloads are pickled, only open packs you built yourself
+
+USAGE:
+    DatasetPack.build(DataManager.DIR_data_root / "PDL")        # -> dataset/PDL.pack
+    pack = get_pack(DataManager.DIR_data_root / "PDL.pack")
+    toolbox = pack.get("tools/000.yaml")
+"""
+
+import os, mmap, json, pickle, struct, threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+from utils.yaml_loader import yaml_load
+
+MAGIC = b"FAPK"
+VERSION = 1
+_HEADER = struct.Struct("<4sIQ")
+PACK_SUFFIX = ".pack"
+_LAZY_DIRS = ("user_profile/", "user_profile_w_conversation/")
+
+
+class LazyList(Sequence):
+    """ a read-only list whose items are decoded (& converted by `fn`) on first access """
+    def __init__(self, n: int, get_item: Callable[[int], Any], fn: Callable[[Any], Any] = None) -> None:
+        self._n, self._get_item, self._fn = n, get_item, fn
+        self._items: Dict[int, Any] = {}
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, idx: Union[int, slice]) -> Any:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._n))]
+        if idx < 0: idx += self._n
+        if not 0 <= idx < self._n: raise IndexError(f"LazyList index out of range: {idx}")
+        if idx not in self._items:
+            item = self._get_item(idx)
+            self._items[idx] = self._fn(item) if self._fn else item
+        return self._items[idx]
+
+    def map(self, fn: Callable[[Any], Any]) -> "LazyList":
+        """ a lazy list of `fn(item)` """
+        if self._fn is None:
+            return LazyList(self._n, self._get_item, fn)
+        return LazyList(self._n, self.__getitem__, fn)
+
+
+def _parse_file(fn: Path, rel: str) -> Any:
+    with open(fn, "r") as f:
+        s = f.read()
+    if rel.startswith("pdl/") and fn.suffix == ".yaml":
+        s = s.strip()
+        return (s, yaml_load(s, full=True))     # see `PDL.load_from_parsed`
+    if fn.suffix == ".yaml":
+        return yaml_load(s)
+    if fn.suffix == ".json":
+        return json.loads(s)
+    return s
+
+
+class DatasetPack:
+    def __init__(self, fn: Union[str, Path]) -> None:
+        self.fn = Path(fn)
+        with open(self.fn, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.fn} is not a dataset pack of version {VERSION} (got {magic!r}, {version})")
+        self._index: Dict[str, Union[Tuple[int, int], List[Tuple[int, int]]]] = pickle.loads(self._mm[index_offset:])
+
+    def _load(self, offset: int, length: int) -> Any:
+        return pickle.loads(self._mm[offset:offset + length])
+
+    def __contains__(self, rel: str) -> bool:
+        return rel in self._index
+
+    def get(self, rel: str) -> Any:
+        """ the parsed payload of the file `rel` (relative to the dataset dir). NOTE: lists are `LazyList`s """
+        entry = self._index[rel]
+        if isinstance(entry, list):
+            return LazyList(len(entry), lambda i: self._load(*entry[i]))
+        return self._load(*entry)
+
+    def close(self) -> None:
+        self._mm.close()
+
+    @staticmethod
+    def build(dataset_dir: Union[str, Path], out_fn: Union[str, Path] = None) -> Path:
+        """ compile all files of `dataset_dir` into `out_fn` (default: `{dataset_dir}.pack`), written atomically """
+        dataset_dir = Path(dataset_dir)
+        out_fn = Path(out_fn) if out_fn else dataset_dir.with_suffix(PACK_SUFFIX)
+        tmp_fn = out_fn.with_suffix(out_fn.suffix + f".tmp{os.getpid()}")
+        index = {}
+        with open(tmp_fn, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, 0))
+            def _write(obj) -> Tuple[int, int]:
+                data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+                offset = f.tell()
+                f.write(data)
+                return (offset, len(data))
+            for root, dirs, files in os.walk(dataset_dir):
+                dirs.sort()
+                for name in sorted(files):
+                    fn = Path(root) / name
+                    if name.startswith(".") or fn.suffix not in (".yaml", ".json", ".txt", ".py", ".md"): continue
+                    rel = fn.relative_to(dataset_dir).as_posix()
+                    obj = _parse_file(fn, rel)
+                    if isinstance(obj, list) and rel.startswith(_LAZY_DIRS):
+                        index[rel] = [_write(item) for item in obj]
+                    else:
+                        index[rel] = _write(obj)
+            index_offset = f.tell()
+            f.write(pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL))
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, index_offset))
+        os.replace(tmp_fn, out_fn)
+        return out_fn
+
+
+# the opened packs: {fn: (mtime, pack)}
+_PACKS: Dict[Path, Tuple[float, DatasetPack]] = {}
+_PACKS_LOCK = threading.Lock()
+
+def get_pack(fn: Union[str, Path]) -> DatasetPack:
+    """ process-wide opened pack, reopened when the file is rebuilt """
+    fn = Path(fn)
+    mtime = os.path.getmtime(fn)
+    with _PACKS_LOCK:
+        if fn not in _PACKS or _PACKS[fn][0] != mtime:
+            _PACKS[fn] = (mtime, DatasetPack(fn))     # NOTE: the replaced pack is closed when no longer referenced
+        return _PACKS[fn][1]
@@ -1,4 +1,5 @@
 import re, yaml
+from utils.yaml_loader import yaml_load
 from dataclasses import dataclass, asdict, field
 
 
@@ -36,13 +37,21 @@ class PDL:
         instance.parse_PDL_str()
         return instance
     @classmethod
+    def load_from_parsed(cls, PDL_str, ob):
+        """ from the PDL string & its parsed yaml (e.g. pre-parsed in a `DatasetPack`) """
+        instance = cls(PDL_str)
+        instance._parse(ob)
+        return instance
+    @classmethod
     def load_from_file(cls, file_path):
         with open(file_path, 'r') as f:
             PDL_str = f.read().strip()
         return cls.load_from_str(PDL_str)
     
     def parse_PDL_str(self):
-        ob = yaml.load(self.PDL_str, Loader=yaml.FullLoader)
+        self._parse(yaml_load(self.PDL_str, full=True))
+
+    def _parse(self, ob):
         self.name = ob["Name"]
         self.desc = ob["Desc"]
         self.desc_detail = ob.get("Detailed_desc", "")
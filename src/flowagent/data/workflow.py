@@ -2,15 +2,34 @@
 WorkflowType: text, code, flowchart, pdl
     with different subdirs and suffixes!
 """
-import yaml, json, os
+import json, os, time, threading, itertools
 from dataclasses import dataclass, asdict, field
 from enum import Enum, auto
 from pathlib import Path
-from typing import List, Dict, Optional, Union
+from typing import List, Dict, Optional, Union, Tuple, Any, Callable, Sequence
 from .user_profile import UserProfile, OOWIntention
 from .config import Config
 from .pdl import PDL
+from utils.yaml_loader import yaml_load_file
 from .base_data import ConversationWithIntention, Conversation
+from .pack import DatasetPack, LazyList, get_pack, _parse_file, PACK_SUFFIX
+
+
+# the parsed `task_infos.json` of each dataset: {fn: (mtime, infos)}, shared by the `DataManager`s
+_TASK_INFOS: Dict[Path, Tuple[float, dict]] = {}
+_TASK_INFOS_LOCK = threading.Lock()
+
+def _load_task_infos(fn: Path) -> dict:
+    """ NOTE: the returned dict is shared, do not modify it """
+    mtime = os.path.getmtime(fn)
+    with _TASK_INFOS_LOCK:
+        if fn in _TASK_INFOS and _TASK_INFOS[fn][0] == mtime:
+            return _TASK_INFOS[fn][1]
+    with open(fn, 'r') as f:
+        infos = json.load(f)
+    with _TASK_INFOS_LOCK:
+        _TASK_INFOS[fn] = (mtime, infos)
+    return infos
 
 
 @dataclass
@@ -26,6 +45,8 @@ class DataManager:
     
     DIR_data_workflow = None               # subdir for specific dataset
     FN_data_workflow_infos = None
+    FN_data_pack = None                    # the compiled dataset (see `build_pack`), used instead of the subdir if exists
+    pack: DatasetPack = None
     
     data_version: str = None
     workflow_infos: dict = field(default_factory=dict)
@@ -37,10 +58,25 @@ class DataManager:
     def _build_workflow_infos(self, workflow_dataset: str):
         self.DIR_data_workflow = self.DIR_data_root / workflow_dataset
         self.FN_data_workflow_infos = self.DIR_data_workflow / "task_infos.json"
-        infos: dict = json.load(open(self.FN_data_workflow_infos, 'r'))
+        self.FN_data_pack = self.DIR_data_root / f"{workflow_dataset}{PACK_SUFFIX}"
+        self.pack = get_pack(self.FN_data_pack) if self.FN_data_pack.exists() else None
+        infos: dict = self.pack.get("task_infos.json") if self.pack else _load_task_infos(self.FN_data_workflow_infos)
         self.data_version = infos['version']
         self.workflow_infos = infos['task_infos']
     
+    def load_data(self, rel: str) -> Any:
+        """ the file `rel` of the dataset (.yaml/.json parsed, the text of the others), from the pack if built
+        NOTE: the lists in the pack are `LazyList`s
+        """
+        if self.pack is not None and rel in self.pack:
+            return self.pack.get(rel)
+        return _parse_file(self.DIR_data_workflow / rel, rel)
+
+    @classmethod
+    def build_pack(cls, workflow_dataset: str) -> Path:
+        """ compile `dataset/{workflow_dataset}/` into `dataset/{workflow_dataset}.pack`. NOTE: rebuild it after modifying the dataset """
+        return DatasetPack.build(cls.DIR_data_root / workflow_dataset, cls.DIR_data_root / f"{workflow_dataset}{PACK_SUFFIX}")
+
     def refresh_config(self, cfg: Config) -> None:
         self.cfg = cfg
         self._build_workflow_infos(cfg.workflow_dataset)
@@ -61,6 +97,26 @@ class DataManager:
         return names
 
 
+def _lazy_map(items: Union[List, LazyList], fn: Callable) -> LazyList:
+    """ `fn(item)` on first access of each item """
+    if isinstance(items, LazyList): return items.map(fn)
+    return LazyList(len(items), items.__getitem__, fn)
+
+
+class _lazy:
+    """ a field of `Workflow` loaded by the decorated method on first access, then cached in the instance
+    NOTE: not a data descriptor, so the cached value is a plain attribute (and can be set before the first access)
+    """
+    def __init__(self, load: Callable[["Workflow"], Any]) -> None:
+        self.load, self.name = load, load.__name__
+        self.__doc__ = load.__doc__
+
+    def __get__(self, instance, owner=None) -> Any:
+        if instance is None: return self
+        # NOTE: bypass `Workflow.__setattr__`, the shared workflows cache their fields too. Concurrent loads keep the first one
+        return instance.__dict__.setdefault(self.name, self.load(instance))
+
+
 class WorkflowType(Enum):
     TEXT = ("TEXT", "format for natural language", ".txt", 'text')
     CODE = ("CODE", "format of code", ".py", 'code')
@@ -90,22 +146,22 @@ class WorkflowTypeStr(str, Enum):
     PDL = "pdl"
 
 
+_GENERATIONS = itertools.count()     # one per loaded `Workflow`, see `Workflow.key`
+
+
 @dataclass
 class Workflow:  # rename -> Data
+    """ a workflow of the dataset
+    NOTE: the basic infos are loaded in `__init__`; the others (workflow, toolbox, pdl, user_profiles, reference_conversations,
+        user_oow_intentions) on first access, and cached. The items of `user_profiles / reference_conversations` are converted
+        on first access (and only the accessed ones are decoded from the dataset pack)
+    """
     type: WorkflowType = None
     id: str = None              # 000
     name: str = None
     task_description: str = None
     task_detailed_description: str = None
     
-    workflow: str = None
-    toolbox: List[Dict] = field(default_factory=list)   # apis
-    pdl: PDL = None         # only for PDL
-    
-    user_profiles: List[UserProfile] = None
-    reference_conversations: List[ConversationWithIntention] = None
-    user_oow_intentions: List[OOWIntention] = None
-    
     cfg: Config = None
     data_manager: DataManager = None
     
@@ -114,43 +170,80 @@ class Workflow:  # rename -> Data
         self.cfg = cfg
         if data_manager is None: data_manager = DataManager(cfg)
         self.data_manager = data_manager
+        self._generation = next(_GENERATIONS)
         
         self.type = WorkflowType[self.cfg.workflow_type.upper()]
-        # 1. load basic info
+        # load basic info
         self.id = self.cfg.workflow_id
         assert self.id in data_manager.workflow_infos, f"[ERROR] {self.id} not found in {data_manager.workflow_infos.keys()}"
         infos = data_manager.workflow_infos[self.id]
         self.name = infos['name']
         self.task_description = infos['task_description']
         self.task_detailed_description = infos['task_detailed_description']
-        # 2. load the workflow & toolbox
-        with open(data_manager.DIR_data_workflow / f"tools/{self.id}.yaml", 'r') as f:
-            self.toolbox = yaml.safe_load(f)
-        with open(data_manager.DIR_data_workflow / f"{self.type.subdir}/{self.id}{self.type.suffix}", 'r') as f:
-            self.workflow = f.read().strip()
+
+    # the lazy fields, from the dataset pack if built (see `DataManager.load_data`)
+    @_lazy
+    def workflow(self) -> str:
         if self.type == WorkflowType.PDL:   # sepcial for PDL
-            self.pdl = PDL.load_from_file(data_manager.DIR_data_workflow / f"pdl/{self.id}.yaml")
-            self.workflow = self.pdl.to_str_wo_api() # self.pdl.procedure
-        # 3. load the user infos
-        if (self.cfg.exp_mode=="session"): # load_user_profiles:
-            with open(data_manager.DIR_data_workflow / f"user_profile/{self.id}.json", 'r') as f:
-                user_profiles = json.load(f)
-            self.user_profiles = [UserProfile.load_from_dict(profile) for profile in user_profiles]
-            # if user in OOW mode! 
-            if "oow" in self.cfg.user_mode.lower():
-                with open(data_manager.DIR_data_root / f"meta/oow.yaml", 'r') as f:
-                    data = yaml.safe_load(f)
-                self.user_oow_intentions = [OOWIntention.from_dict(d) for d in data]
-        if (self.cfg.exp_mode=="turn"): # load_reference_conversation: 
-            with open(data_manager.DIR_data_workflow / f"user_profile_w_conversation/{self.id}.json", 'r') as f:
-                data = json.load(f)
-            self.reference_conversations = []
-            for d in data:
-                self.reference_conversations.append(
-                    ConversationWithIntention(
-                        d["user_intention"], Conversation.load_from_json(d["conversation"])
-                    )
-                )
+            return self.pdl.to_str_wo_api() # self.pdl.procedure
+        return self.data_manager.load_data(f"{self.type.subdir}/{self.id}{self.type.suffix}").strip()
+
+    @_lazy
+    def toolbox(self) -> List[Dict]:    # apis
+        return self.data_manager.load_data(f"tools/{self.id}.yaml")
+
+    @_lazy
+    def pdl(self) -> Optional[PDL]:     # only for PDL
+        if self.type != WorkflowType.PDL: return None
+        return PDL.load_from_parsed(*self.data_manager.load_data(f"pdl/{self.id}.yaml"))
+
+    @_lazy
+    def user_profiles(self) -> Optional[Sequence[UserProfile]]:
+        if self.cfg.exp_mode != "session": return None
+        return _lazy_map(self.data_manager.load_data(f"user_profile/{self.id}.json"), UserProfile.load_from_dict)
+
+    @_lazy
+    def user_oow_intentions(self) -> Optional[List[OOWIntention]]:
+        if self.cfg.exp_mode != "session" or "oow" not in self.cfg.user_mode.lower(): return None    # only for the OOW user
+        data = yaml_load_file(self.data_manager.DIR_data_root / f"meta/oow.yaml")
+        return [OOWIntention.from_dict(d) for d in data]
+
+    @_lazy
+    def reference_conversations(self) -> Optional[Sequence[ConversationWithIntention]]:
+        if self.cfg.exp_mode != "turn": return None
+        return _lazy_map(
+            self.data_manager.load_data(f"user_profile_w_conversation/{self.id}.json"),
+            lambda d: ConversationWithIntention(d["user_intention"], Conversation.load_from_json(d["conversation"]))
+        )
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"Workflow {self.key} is shared by `WorkflowRegistry`, it is read-only")
+        super().__setattr__(name, value)
+
+    @staticmethod
+    def source_files(cfg: Config, data_manager: DataManager) -> List[Path]:
+        """ the files loaded by `Workflow(cfg)` """
+        _type = WorkflowType[cfg.workflow_type.upper()]
+        DIR_data = data_manager.DIR_data_workflow
+        fns = [data_manager.FN_data_workflow_infos, DIR_data / f"tools/{cfg.workflow_id}.yaml"]
+        fns.append(DIR_data / (f"pdl/{cfg.workflow_id}.yaml" if _type == WorkflowType.PDL else f"{_type.subdir}/{cfg.workflow_id}{_type.suffix}"))
+        if cfg.exp_mode == "session":
+            fns.append(DIR_data / f"user_profile/{cfg.workflow_id}.json")
+        if cfg.exp_mode == "turn":
+            fns.append(DIR_data / f"user_profile_w_conversation/{cfg.workflow_id}.json")
+        if data_manager.pack is not None:
+            fns = [data_manager.FN_data_pack]
+        if cfg.exp_mode == "session" and "oow" in cfg.user_mode.lower():
+            fns.append(data_manager.DIR_data_root / "meta/oow.yaml")
+        return fns
+
+    @property
+    def key(self) -> tuple:
+        """ identifies the (static) contents of the workflow, e.g. to memoise the rendered prompts
+        NOTE: with the load generation, so that a workflow reloaded by `WorkflowRegistry` (modified files) has a new key
+        """
+        return (self.cfg.workflow_dataset, self.type.subdir, self.id, self._generation)
 
     @property
     def num_user_profile(self):
@@ -168,3 +261,60 @@ class Workflow:  # rename -> Data
         }
         return "".join([f"{k}: {v}\n" for k, v in info_dict.items()])
 
+
+
+class WorkflowRegistry:
+    """ process-wide, thread-safe registry of the loaded workflows, shared by the controllers & judgers
+    NOTE: a workflow is loaded once per (dataset, workflow_type, workflow_id) & the loading options (`exp_mode`, OOW user),
+        and reloaded when one of its files (`Workflow.source_files`) is modified
+    NOTE: the workflows are shared, they are read-only
+    USAGE:
+        workflow = WorkflowRegistry.get(cfg)
+        print(WorkflowRegistry.get_stats())
+    """
+    _workflows: Dict[Tuple, Tuple[Tuple, Workflow]] = {}   # key -> (mtimes of the source files, workflow)
+    _key_locks: Dict[Tuple, threading.Lock] = {}
+    _stats: Dict[Tuple, Dict[str, Any]] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _key(cfg: Config) -> Tuple:
+        return (cfg.workflow_dataset, cfg.workflow_type.lower(), cfg.workflow_id, cfg.exp_mode, "oow" in cfg.user_mode.lower())
+
+    @classmethod
+    def get(cls, cfg: Config, data_manager: DataManager = None) -> Workflow:
+        key = cls._key(cfg)
+        with cls._lock:
+            key_lock = cls._key_locks.setdefault(key, threading.Lock())
+            stat = cls._stats.setdefault(key, {"num_loads": 0, "num_hits": 0, "load_time": 0.0})
+        with key_lock:      # loads of the same workflow wait for each other, the others go on
+            if data_manager is None: data_manager = DataManager(cfg)
+            mtimes = tuple(os.path.getmtime(fn) for fn in Workflow.source_files(cfg, data_manager))
+            cached = cls._workflows.get(key)
+            if cached is not None and cached[0] == mtimes:
+                stat["num_hits"] += 1
+                return cached[1]
+            start = time.perf_counter()
+            workflow = Workflow(cfg.copy(), data_manager)
+            object.__setattr__(workflow, "_frozen", True)
+            stat["num_loads"] += 1
+            stat["load_time"] += time.perf_counter() - start
+            cls._workflows[key] = (mtimes, workflow)
+            return workflow
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, Any]]:
+        """ load counts & time of each workflow """
+        with cls._lock:
+            items = list(cls._stats.items())
+        return {
+            f"{dataset}/{workflow_type}/{workflow_id} ({exp_mode}{', oow' if oow else ''})": dict(stat)
+            for (dataset, workflow_type, workflow_id, exp_mode, oow), stat in items
+        }
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._workflows.clear()
+            cls._key_locks.clear()
+            cls._stats.clear()
@@ -26,7 +26,7 @@ class Analyzer:
     
     def __init__(self, cfg: Config) -> None:
         self.cfg = cfg
-        self.db = DBManager(cfg.db_uri, cfg.db_name, cfg.db_message_collection_name)
+        self.db = DBManager.from_config(cfg)
     
         self._collect_exp_results()
         self.stat_dict = dict()
@@ -54,6 +54,7 @@ class Analyzer:
             self.stat_judge_turn()
             self.stat_judge_turn_stat()
             self.stat_num_turns()
+        self.stat_llm_usage()
         
         print(LogUtils.format_infos_with_tabulate(self.stat_dict, color="blue"))
         # log to W&B
@@ -170,6 +171,55 @@ class Analyzer:
             wandb.log({"dist_num_turns": wandb.Image(plt)})
         return vc_num_turns
     
+    def _judge_usage_rows(self) -> list:
+        """ the judge tokens, from the `usage` of the judge details """
+        rows = []
+        for _, r in self.df.iterrows():
+            details = r.get("judge_session_details", r.get("judge_turn_details"))
+            if not isinstance(details, (dict, list)): continue
+            for d in (details if isinstance(details, list) else [details]):
+                usage = d.get("usage") or {}
+                rows.append({
+                    "conversation_id": r["conversation_id"], "role": "judge", "num_messages": 0, "num_calls": 1,
+                    "prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": usage.get("completion_tokens", 0),
+                })
+        return rows
+
+    def stat_llm_usage(self):
+        """ tokens & latency of the LLM calls: per role, per workflow and per successful task
+        input: `llm_stat` of the messages (see `DBManager.get_exp_llm_stats`), `usage` of the judge details
+        metric: tokens/LLM time per conversation, tokens per successful task (session mode)
+        """
+        rows = self.db.get_exp_llm_stats(self.cfg.exp_version) + self._judge_usage_rows()
+        if not rows: return {}
+        df_stat = pd.DataFrame(rows).fillna(0)
+        df_stat["total_tokens"] = df_stat["prompt_tokens"] + df_stat["completion_tokens"]
+        df_stat = df_stat.merge(self.df[["conversation_id", "workflow_id"]], on="conversation_id", how="inner")
+        num_convs = df_stat["conversation_id"].nunique()
+        if num_convs == 0: return {}
+        cols = ["total_tokens", "prompt_tokens", "completion_tokens", "cached_tokens", "wall_time", "num_calls", "retries", "num_cache_hits", "num_hedges"]
+        cols = [c for c in cols if c in df_stat]
+
+        df_role = df_stat.groupby("role")[cols].sum() / num_convs      # per conversation
+        if "cached_tokens" in df_role:      # share of the prompt served from the prefix cache of the provider
+            df_role["cached_ratio"] = (df_role["cached_tokens"] / df_role["prompt_tokens"]).fillna(0)
+        df_conv = df_stat.groupby(["conversation_id", "workflow_id"])[cols].sum().reset_index()
+        df_workflow = df_conv.groupby("workflow_id")[cols].mean()
+        print(LogUtils.format_infos_with_tabulate(df_role.reset_index(), color="blue"))
+        print(LogUtils.format_infos_with_tabulate(df_workflow.reset_index(), color="blue"))
+
+        metrics = dict(
+            tokens_per_conversation=df_conv["total_tokens"].mean(),
+            llm_time_per_conversation=df_conv["wall_time"].mean() if "wall_time" in df_conv else np.nan,
+        )
+        if "if_pass" in self.df:    # session mode
+            num_success = int(self.df["if_pass"].sum())
+            metrics["tokens_per_success"] = df_conv["total_tokens"].sum() / num_success if num_success else np.nan
+        self.stat_dict |= metrics
+        if self.cfg.judge_log_to == "wandb":
+            wandb.log({"llm_usage_per_role": wandb.Table(dataframe=df_role.reset_index())})
+        return metrics
+
     def stat_scores_overall(self):
         self.stat_dict["mean_score"] = self.df["overall_score"].mean()
         # stat_dict["passrate"] = sum(self.df["overall_score"] >= th) / len(self.df)
@@ -1,4 +1,4 @@
-from ..data import Config, Workflow, DataManager, DBManager
+from ..data import Config, WorkflowRegistry, DataManager, DBManager
 from typing import List, Dict, Optional, Tuple, Union, Callable
 
 
@@ -8,7 +8,7 @@ class EvalUtils:
         """ collect simulation for a specific workflow
         """
         # 1. get all user ids
-        num_user_profile = Workflow(cfg).num_user_profile
+        num_user_profile = WorkflowRegistry.get(cfg).num_user_profile
         if simulate_num_persona is not None and simulate_num_persona > 0:
             num_user_profile = min(num_user_profile, simulate_num_persona)
         # 2. get all the configs
@@ -36,26 +36,30 @@ class EvalUtils:
         return tasks
     
     @staticmethod
-    def get_evaluation_configs(cfg:Config, db:DBManager=None):
+    def get_evaluation_configs(cfg:Config, db:DBManager=None, skip_judged:bool=True):
         """filter the experiments by `exp_version`
+        skip_judged: drop the judged conversations (unless `judge_force_rejudge`), the judgers do not check them again
+        NOTE: 2 queries in total: the run experiments (configs) & the judged conversation ids, instead of 2 per experiment
         """
-        if db is None: db = DBManager(cfg.db_uri, cfg.db_name, cfg.db_message_collection_name)
+        if db is None: db = DBManager.from_config(cfg)
         
-        # 1. find all run experiments
+        # 1. find all run experiments & the judged ones
         run_exps = db.query_run_experiments({ "exp_version": cfg.exp_version }, limit=0)
+        plan = skip_judged and not cfg.judge_force_rejudge
+        judged = set(db.query_evaluated_conversation_ids({ "exp_version": cfg.exp_version })) if plan else set()
         
         # 2. get all evaluation configs
         tasks = []
         for exp in run_exps:
-            # 2.1 restore the exp config
-            cfg_exp = Config.from_dict(
-                db.query_config_by_conversation_id(exp["conversation_id"])
-            )
+            if exp["conversation_id"] in judged: continue
+            # 2.1 restore the exp config (the run experiment is the recorded config)
+            cfg_exp = Config.from_dict(exp)
             # 2.2 check if the configs of run exps match the input config. partly done by the "reloading" mechanism?
             keys_to_check = ["exp_version", "workflow_dataset", "workflow_type"]
             assert all([cfg_exp[k] == cfg[k] for k in keys_to_check]), f"Config mismatch: {cfg_exp} vs {cfg}"
             # 2.3 ensure the judge config slots: `judge_conversation_id, judge_model_name`
             cfg_exp.judge_model_name = cfg.judge_model_name
             cfg_exp.judge_conversation_id = exp["conversation_id"]
+            cfg_exp.judge_planned = plan
             tasks.append(cfg_exp)
-        return tasks
\ No newline at end of file
+        return tasks
@@ -9,13 +9,21 @@ updated @240926
 import os, json, tqdm, itertools, pickle, collections, traceback, datetime, argparse
 from typing import List, Dict, Optional, Tuple, Union, Callable
 import pandas as pd
-import concurrent.futures
+import concurrent.futures, asyncio
 
-from ..data import Config, DataManager, DBManager, LogUtils, Workflow
+from ..data import Config, DataManager, DBManager, LogUtils, Workflow, WorkflowRegistry, MongoClientRegistry
+from ..data.base_llm import DIR_cache
 from .analyzer import Analyzer
 from ..controller import FlowagentController
 from .judger import Judger
 from .eval_utils import EvalUtils
+from easonsi.llm.cache import get_all_cache_stats
+from easonsi.llm.client_registry import LLMClientRegistry
+from easonsi.llm.rate_limiter import get_all_rate_limiter_stats
+from easonsi.llm.load_balancer import get_all_endpoint_pool_stats
+from easonsi.llm.hedging import get_all_hedger_stats
+from ..data.db_writer import get_all_db_writer_stats, flush_all_db_writers
+from easonsi.llm.batch import BatchRunner, LocalBatchServer, make_batch_line
 
 
 def task_simulate(cfg: Config) -> None:
@@ -46,6 +54,38 @@ def task_judge_turn_level(cfg: Config) -> None:
     judger.start_judge(verbose=False, mode="turn")
 
 
+async def task_simulate_async(cfg: Config) -> None:
+    """ One simulation task | async engine
+    NOTE: the controller (DB connection, workflow files...) is built in a worker thread, not to block the event loop
+    """
+    controller = await asyncio.to_thread(FlowagentController, cfg)
+    await controller.start_conversation_async(verbose=False)
+
+async def task_simulate_teacher_forcing_async(cfg: Config) -> None:
+    controller = await asyncio.to_thread(FlowagentController, cfg)
+    await controller.start_conversation_async(verbose=False, teacher_forcing=True)
+
+async def task_judge_async(cfg: Config) -> None:
+    judger = await asyncio.to_thread(Judger, cfg)
+    await judger.start_judge_async(verbose=False, mode="session")
+
+async def task_judge_turn_level_async(cfg: Config) -> None:
+    judger = await asyncio.to_thread(Judger, cfg)
+    await judger.start_judge_async(verbose=False, mode="turn")
+
+# exp_engine -> exp_mode -> (f_simulate, f_judge)
+ENGINE2TASKS = {
+    "thread": {
+        "session": (task_simulate, task_judge),
+        "turn": (task_simulate_teacher_forcing, task_judge_turn_level),
+    },
+    "async": {
+        "session": (task_simulate_async, task_judge_async),
+        "turn": (task_simulate_teacher_forcing_async, task_judge_turn_level_async),
+    },
+}
+
+
 class Evaluator: # rename -> Exp?
     """ abstraction of whole evaluation process
     USAGE:
@@ -59,7 +99,7 @@ class Evaluator: # rename -> Exp?
     def __init__(self, cfg: Config):
         self.cfg = cfg
         self.data_namager = DataManager(cfg)
-        self.db = DBManager(cfg.db_uri, cfg.db_name, cfg.db_message_collection_name)
+        self.db = DBManager.from_config(cfg)
         
     def main(self):
         """ 
@@ -71,22 +111,24 @@ class Evaluator: # rename -> Exp?
         """
         self.process_configs()
         
-        if self.cfg.exp_mode == "session":
-            self.print_header_info(step_name="STEP 1: Simulating", infos={k:v for k,v in self.cfg.to_dict().items() if k.startswith("simulate") or k.startswith("exp")})
-            self.run_simulations(f_task=task_simulate)
-            self.print_header_info(step_name="STEP 2: Evaluating", infos={k:v for k,v in self.cfg.to_dict().items() if k.startswith("judge")})
-            self.run_evaluations(f_task=task_judge)
-            self.print_header_info(step_name="STEP 3: Analyzing")
-            self.analyze()
-        elif self.cfg.exp_mode == "turn":
-            self.print_header_info(step_name="STEP 1: Simulating", infos={k:v for k,v in self.cfg.to_dict().items() if k.startswith("simulate") or k.startswith("exp")})
-            self.run_simulations(f_task=task_simulate_teacher_forcing)
-            self.print_header_info(step_name="STEP 2: Evaluating", infos={k:v for k,v in self.cfg.to_dict().items() if k.startswith("judge")})
-            self.run_evaluations(f_task=task_judge_turn_level)
-            self.print_header_info(step_name="STEP 3: Analyzing")
-            self.analyze()
-        else:
+        if self.cfg.exp_mode not in ("session", "turn"):
             raise NotImplementedError(f"Unknown exp_mode: {self.cfg.exp_mode}")
+        assert self.cfg.exp_engine in ENGINE2TASKS, f"Unknown exp_engine: {self.cfg.exp_engine}"
+        f_simulate, f_judge = ENGINE2TASKS[self.cfg.exp_engine][self.cfg.exp_mode]
+        self.print_header_info(step_name="STEP 1: Simulating", infos={k:v for k,v in self.cfg.to_dict().items() if k.startswith("simulate") or k.startswith("exp")})
+        self.run_simulations(f_task=f_simulate)
+        flush_all_db_writers()      # write-behind: the judges query the simulated conversations
+        self.print_llm_stats()
+        self.print_header_info(step_name="STEP 2: Evaluating", infos={k:v for k,v in self.cfg.to_dict().items() if k.startswith("judge")})
+        if self.cfg.judge_batch:
+            self.run_evaluations_batch()
+        else:
+            self.run_evaluations(f_task=f_judge)
+        flush_all_db_writers()
+        self.print_header_info(step_name="STEP 3: Analyzing")
+        self.analyze()
+        self.print_llm_stats()
+        self.print_data_stats()
     
     def process_configs(self):
         """ Log the config. If existed, reload it! """
@@ -109,6 +151,36 @@ class Evaluator: # rename -> Exp?
             s_print += LogUtils.format_infos_with_tabulate(infos)
         print(s_print)
 
+    def print_llm_stats(self):
+        """ hit/miss counters of the LLM response caches, connection pool, rate limiter, endpoint & hedging statistics in this process """
+        stats = get_all_cache_stats()
+        if stats:
+            self.print_header_info(step_name="LLM Cache", infos=pd.DataFrame(stats).T)
+        stats = LLMClientRegistry.get_stats()
+        if stats:
+            self.print_header_info(step_name="LLM Connection Pools", infos=pd.DataFrame(stats).T)
+        stats = get_all_rate_limiter_stats()
+        if stats:
+            self.print_header_info(step_name="LLM Rate Limiters", infos=pd.DataFrame(stats).T)
+        stats = get_all_endpoint_pool_stats()
+        if stats:
+            self.print_header_info(step_name="LLM Endpoints", infos=pd.DataFrame(stats).T)
+        stats = get_all_hedger_stats()
+        if stats:
+            self.print_header_info(step_name="LLM Hedging", infos=pd.DataFrame(stats).T)
+
+    def print_data_stats(self):
+        """ load counts & time of the workflows, DB writers & connections in this process """
+        stats = WorkflowRegistry.get_stats()
+        if stats:
+            self.print_header_info(step_name="Workflow Registry", infos=pd.DataFrame(stats).T)
+        stats = get_all_db_writer_stats()
+        if stats:
+            self.print_header_info(step_name="DB Writer", infos=pd.DataFrame(stats).T)
+        stats = MongoClientRegistry.get_stats()
+        if stats:
+            self.print_header_info(step_name="DB Connections", infos=pd.DataFrame(stats).T)
+
     def run_simulations(self, f_task: Callable):
         """ 
         1. get all the simulation configs
@@ -128,6 +200,8 @@ class Evaluator: # rename -> Exp?
                 return None
 
         tasks = EvalUtils.get_configs_all_workflows(self.cfg, simulate_num_persona=self.cfg.simulate_num_persona)
+        if self.cfg.exp_engine == "async":
+            return self.run_tasks_async(tasks, f_task, max_concurrency=self.cfg.simulate_max_concurrency)
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.cfg.simulate_max_workers) as executor:
             futures = []
             for cfg in tasks:
@@ -155,6 +229,8 @@ class Evaluator: # rename -> Exp?
                 return None
         
         tasks = EvalUtils.get_evaluation_configs(self.cfg, db=self.db)
+        if self.cfg.exp_engine == "async":
+            return self.run_tasks_async(tasks, f_task, max_concurrency=self.cfg.judge_max_concurrency)
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.cfg.judge_max_workers) as executor:
             futures = []
             for cfg in tasks:
@@ -169,6 +245,73 @@ class Evaluator: # rename -> Exp?
         # if num_errors > 0:
         #     raise Exception(f"# of errors when evaluation: {num_errors}")
 
+    def run_evaluations_batch(self):
+        """ batch mode of `run_evaluations`:
+        1. render all the judge prompts up front
+        2. write them to one batch (jsonl) file, submit & poll (`judge_batch_backend`: openai, local)
+        3. parse the results & record them to db, failed requests are re-judged interactively
+        """
+        mode = self.cfg.exp_mode
+        tasks = EvalUtils.get_evaluation_configs(self.cfg, db=self.db)
+        if not tasks: return
+        judgers = [Judger(cfg) for cfg in tasks]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.cfg.judge_max_workers) as executor:
+            judger_prompts = list(tqdm.tqdm(
+                executor.map(lambda judger: judger.gen_batch_prompts(mode=mode, verbose=False), judgers),
+                total=len(judgers), desc="Rendering judge prompts"
+            ))
+        llm = judgers[0].llm
+        body = llm._default_args({})     # NOTE: no `llm.extra_body` (e.g. `enable_thinking`) in a batch, the local backend applies it itself
+        lines = [
+            make_batch_line(custom_id, [{"role": "user", "content": prompt}], **body)
+            for prompts in judger_prompts for custom_id, prompt in prompts
+        ]
+        if not lines: return
+
+        if self.cfg.judge_batch_backend == "local":
+            client = LocalBatchServer(llm, max_workers=self.cfg.judge_max_workers).make_client()
+        elif self.cfg.judge_batch_backend == "openai":
+            client = llm.client
+        else: raise ValueError(f"Unknown judge_batch_backend: {self.cfg.judge_batch_backend}")
+        fn = DIR_cache / "judge_batch" / f"{self.cfg.exp_version}_{mode}_{datetime.datetime.now():%Y%m%d%H%M%S}.jsonl"
+        os.makedirs(fn.parent, exist_ok=True)
+        runner = BatchRunner(client, poll_interval=self.cfg.judge_batch_poll_interval, timeout=self.cfg.judge_batch_timeout)
+        results = runner.run(lines, fn=fn)
+
+        def f_exec(judger: Judger):
+            try:
+                return judger.judge_from_batch(results, mode=mode, verbose=False)
+            except Exception as e:
+                print(f"Task failed for {judger.cfg}: {e}")
+                traceback.print_exc()
+        to_finish = [judger for judger, prompts in zip(judgers, judger_prompts) if prompts]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.cfg.judge_max_workers) as executor:
+            list(tqdm.tqdm(executor.map(f_exec, to_finish), total=len(to_finish), desc="Parsing judge results"))
+
+    @staticmethod
+    def run_tasks_async(tasks: List[Config], f_task: Callable, max_concurrency: int=1000):
+        """ run async tasks on one event loop, at most `max_concurrency` tasks in flight
+        """
+        async def f_exec(cfg, semaphore):
+            async with semaphore:
+                for retry_ in range(3):
+                    try:
+                        return await f_task(cfg)
+                    except Exception as e:
+                        print(f"Task failed for {cfg}: {e}")
+                        traceback.print_exc()
+                else:
+                    print(f"ERROR!!! Task failed after 3 retrys for {cfg}")
+                    return None
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(max_concurrency)
+            futures = [asyncio.ensure_future(f_exec(cfg, semaphore)) for cfg in tasks]
+            print(f"Running {len(futures)} tasks with max concurrency {max_concurrency}...")
+            for future in tqdm.tqdm(asyncio.as_completed(futures), total=len(futures), desc="Executing tasks"):
+                await future
+        asyncio.run(run_all())
+
     def analyze(self):
         """ analysis process: -> to `Analyzer`
         """
@@ -4,18 +4,19 @@ updated @240918
 - [x] add "Tool Invocation" metrics in FlowBench
 """
 
-import re, yaml
+import re, yaml, asyncio
 import pandas as pd
-from typing import List, Dict, Optional, Tuple, Any
+from typing import List, Dict, Optional, Tuple, Union, Any, Callable
+from openai.types.chat import ChatCompletion
 from easonsi.llm.openai_client import OpenAIClient, Formater
 
 from ..data import (
     Config, Role, Message, Conversation, 
-    Workflow, DBManager, DataManager, UserProfile,
-    BaseLogger, LogUtils, LLM_CFG, init_client
+    Workflow, WorkflowRegistry, DBManager, DataManager, UserProfile,
+    BaseLogger, LogUtils, init_role_client
 )
-from utils.jinja_templates import jinja_render
-from utils.wrappers import retry_wrapper
+from utils.jinja_templates import jinja_render_static
+from utils.wrappers import retry_wrapper, async_retry_wrapper
 
 
 class Judger:
@@ -23,6 +24,11 @@ class Judger:
     USAGE:
         judger = Judger(cfg)
         judger.start_judge()
+
+        # batch mode, see `Evaluator.run_evaluations_batch`
+        requests = judger.gen_batch_prompts(mode="session")    # [(custom_id, prompt)]
+        ...  # submit & collect the results: {custom_id: ChatCompletion}
+        judger.judge_from_batch(results, mode="session")
     """
     cfg: Config = None
     db: DBManager = None
@@ -30,9 +36,9 @@ class Judger:
     
     def __init__(self, cfg:Config) -> None:
         self.cfg = cfg
-        self.db = DBManager(cfg.db_uri, cfg.db_name, cfg.db_message_collection_name)
+        self.db = DBManager.from_config(cfg)
         self.logger = BaseLogger()
-        self.llm = init_client(llm_cfg=LLM_CFG[self.cfg.judge_model_name])
+        self.llm = init_role_client(self.cfg, "judge")
 
     def judge(self, mode: str="session", verbose=True) -> Dict:
         """ judge process:
@@ -42,33 +48,16 @@ class Judger:
         4. record the result
         """
         # 0. check if judged
-        assert self.cfg.judge_conversation_id is not None, "judge_conversation_id is None"
-        if self.cfg.judge_force_rejudge: # whether forcing rejudge
-            # remove the judge result if it has been judged
-            res = self.db.delete_evaluations({ "conversation_id": self.cfg.judge_conversation_id })
-        else:
-            query_res = self.db.query_evaluations({ "conversation_id": self.cfg.judge_conversation_id }) # donot need {"exp_version"} becased conversaion_id 1:1 map to exp_version
-            if len(query_res) > 0:
-                self.logger.log(f"  <judge> {self.cfg.judge_conversation_id} has already been judged", with_print=verbose)
-                return query_res[0] # out_dict
+        judged = self._check_if_judged(verbose=verbose)
+        if judged is not None: return judged
 
-        # 1.1. get the simultead conversation
-        simulated_conversation = self.db.query_messages_by_conversation_id(self.cfg.judge_conversation_id)
-        assert len(simulated_conversation) > 0, "simulated conversation is empty"
-        
-        # 1.2. get the workflow infos
-        workflow = Workflow(self.cfg)
+        # 1. get the simultead conversation & the workflow infos
+        workflow, simulated_conversation = self._load_judge_inputs()
         
         # 2. judge: call the judge model & parse the output
         self.logger.log(f"  <judge> start to judge {self.cfg.judge_conversation_id}", with_print=verbose)
 
-        out_dict = {
-            "conversation_id": self.cfg.judge_conversation_id,
-            "exp_version": self.cfg.exp_version,  # these infos can also be found in `db.config`
-            **{ k:v for k,v in self.cfg.to_dict().items() if k.startswith("workflow") },
-
-            "num_turns": len(simulated_conversation),       # //2
-        }
+        out_dict = self._init_out_dict(simulated_conversation)
         # NOTE: standardize the judge results
         # output format: `judge_session_result, judge_session_stat`
         if mode == "session":
@@ -83,7 +72,95 @@ class Judger:
         self.db.insert_evaluation(out_dict)
         self.logger.log(f"  <judge> {self.cfg.judge_conversation_id} has been judged", with_print=verbose)
         return out_dict
+
+    async def judge_async(self, mode: str="session", verbose=True) -> Dict:
+        """ async version of `judge`. NOTE: the blocking DB operations are run in worker threads """
+        judged = await asyncio.to_thread(self._check_if_judged, verbose=verbose)
+        if judged is not None: return judged
+
+        workflow, simulated_conversation = await asyncio.to_thread(self._load_judge_inputs)
+        self.logger.log(f"  <judge> start to judge {self.cfg.judge_conversation_id}", with_print=verbose)
+
+        out_dict = self._init_out_dict(simulated_conversation)
+        if mode == "session":
+            out_dict |= await self._judge_session_async(workflow, simulated_conversation)
+            out_dict |= self._judge_stat_session(workflow, simulated_conversation)
+        elif mode == "turn":
+            out_dict |= await self._judge_turn_async(workflow, simulated_conversation)
+            out_dict |= self._judge_stat_turn(workflow, simulated_conversation)
+        else: raise ValueError(f"invalid mode: {mode}")
+
+        await asyncio.to_thread(self.db.insert_evaluation, out_dict)
+        self.logger.log(f"  <judge> {self.cfg.judge_conversation_id} has been judged", with_print=verbose)
+        return out_dict
+
+    def _check_if_judged(self, verbose=True) -> Optional[Dict]:
+        """ return the existing judge result if judged (and not forcing rejudge) """
+        assert self.cfg.judge_conversation_id is not None, "judge_conversation_id is None"
+        if self.cfg.judge_force_rejudge: # whether forcing rejudge
+            # remove the judge result if it has been judged
+            res = self.db.delete_evaluations({ "conversation_id": self.cfg.judge_conversation_id })
+        elif self.cfg.judge_planned:    # checked in bulk by `EvalUtils.get_evaluation_configs`
+            pass
+        else:
+            query_res = self.db.query_evaluations({ "conversation_id": self.cfg.judge_conversation_id }) # donot need {"exp_version"} becased conversaion_id 1:1 map to exp_version
+            if len(query_res) > 0:
+                self.logger.log(f"  <judge> {self.cfg.judge_conversation_id} has already been judged", with_print=verbose)
+                return query_res[0] # out_dict
+        return None
+
+    def _load_judge_inputs(self) -> Tuple[Workflow, Conversation]:
+        simulated_conversation = self.db.query_messages_by_conversation_id(self.cfg.judge_conversation_id)
+        assert len(simulated_conversation) > 0, "simulated conversation is empty"
+        workflow = WorkflowRegistry.get(self.cfg)
+        return workflow, simulated_conversation
+
+    def _init_out_dict(self, simulated_conversation: Conversation) -> Dict[str, Any]:
+        return {
+            "conversation_id": self.cfg.judge_conversation_id,
+            "exp_version": self.cfg.exp_version,  # these infos can also be found in `db.config`
+            **{ k:v for k,v in self.cfg.to_dict().items() if k.startswith("workflow") },
+
+            "num_turns": len(simulated_conversation),       # //2
+        }
     
+    def _gen_session_prompt(self, workflow: Workflow, simulated_conversation: Conversation) -> str:
+        _user_profile = workflow.user_profiles[self.cfg.user_profile_id]
+        prompt = jinja_render_static(
+            "flowagent/eval_session.jinja",
+            key=(*workflow.key, self.cfg.user_profile_id),
+            static=lambda: dict(user_target=_user_profile.to_str(), workflow_info=workflow.to_str()),
+            session=simulated_conversation.to_str(),  # NOTE: format the conversation
+        )
+        return prompt
+
+    def _parse_session_output(self, llm_response: str) -> Dict[str, Any]:
+        _slots=['Result', 'Total number of goals', 'Number of accomplished goals', 'Reason']
+        _slots_to_check = _slots[:-1] # 'Reason' is not necessary
+        jr = self._parse_react_output(llm_response, slots=_slots, slots_to_check=_slots_to_check)
+        # validate
+        for s in ['Total number of goals', 'Number of accomplished goals']: 
+            jr[s] = int(jr[s])
+        assert jr['Result'] in ['yes', 'no']
+        return jr
+
+    def _query_and_parse(self, prompt: str, f_parse: Callable[[str], Dict], step_name: str) -> Tuple:
+        """ query the judge model & parse the output (with retry) -> (jr, llm_response, _model_name, _usage) """
+        @retry_wrapper(retry=self.cfg.judge_retry_limit, step_name=step_name, log_fn=print)
+        def query(prompt):
+            llm_response, _model_name, _usage = self.llm.query_one(prompt, return_usage=True)
+            return f_parse(llm_response), llm_response, _model_name, _usage
+        return query(prompt)
+
+    @staticmethod
+    def _format_details(prompt: str, llm_response: str, _model_name: str, _usage: Dict) -> Dict[str, Any]:
+        return {
+            "model": _model_name,   # judge model & detailed infos
+            "usage": _usage,
+            "prompt": prompt,
+            "llm_response": llm_response,
+        }
+
     def _judge_session(
         self, workflow: Workflow, simulated_conversation: Conversation,
     ) -> Dict[str, Any]:
@@ -93,73 +170,133 @@ class Judger:
             judge_session_details: Dict of detailed infos
         """
         # 1. format the prompt
-        _user_profile = workflow.user_profiles[self.cfg.user_profile_id]
-        prompt = jinja_render(
-            "flowagent/eval_session.jinja",
-            user_target=_user_profile.to_str(),
-            workflow_info=workflow.to_str(),
-            session=simulated_conversation.to_str(),  # NOTE: format the conversation
-        )
+        prompt = self._gen_session_prompt(workflow, simulated_conversation)
         # 2. query & parse the output
-        @retry_wrapper(retry=self.cfg.judge_retry_limit, step_name="judge_session", log_fn=print)
-        def judge_session(prompt):
-            llm_response, _model_name, _usage = self.llm.query_one(prompt, return_usage=True)
-            # 2. parse
-            _slots=['Result', 'Total number of goals', 'Number of accomplished goals', 'Reason']
-            _slots_to_check = _slots[:-1] # 'Reason' is not necessary
-            jr = self._parse_react_output(llm_response, slots=_slots, slots_to_check=_slots_to_check)
-            # 3. validate
-            for s in ['Total number of goals', 'Number of accomplished goals']: 
-                jr[s] = int(jr[s])
-            assert jr['Result'] in ['yes', 'no']
-            return jr, llm_response, _model_name, _usage
-        jr, llm_response, _model_name, _usage = judge_session(prompt)
+        jr, llm_response, _model_name, _usage = self._query_and_parse(prompt, self._parse_session_output, step_name="judge_session")
         # 3. formatted output
         return {
             "judge_session_result": jr,
-            "judge_session_details": {
-                "model": _model_name,   # judge model & detailed infos
-                "usage": _usage,
-                "prompt": prompt,
-                "llm_response": llm_response,
-            }
+            "judge_session_details": self._format_details(prompt, llm_response, _model_name, _usage)
         }
-    
-    def _judge_turn(self, 
-        workflow: Workflow, simulated_conversation: Conversation,
+
+    async def _judge_session_async(
+        self, workflow: Workflow, simulated_conversation: Conversation,
     ) -> Dict[str, Any]:
-        out = {
-            "judge_turn_result": [],
-            "judge_turn_details": []
+        prompt = self._gen_session_prompt(workflow, simulated_conversation)
+        @async_retry_wrapper(retry=self.cfg.judge_retry_limit, step_name="judge_session", log_fn=print)
+        async def judge_session(prompt):
+            llm_response, _model_name, _usage = await self.llm.query_one_async(prompt, return_usage=True)
+            jr = self._parse_session_output(llm_response)
+            return jr, llm_response, _model_name, _usage
+        jr, llm_response, _model_name, _usage = await judge_session(prompt)
+        return {
+            "judge_session_result": jr,
+            "judge_session_details": self._format_details(prompt, llm_response, _model_name, _usage)
         }
+
+    def _gen_turn_prompts(self, workflow: Workflow, simulated_conversation: Conversation) -> List[Tuple[int, str]]:
+        """ the prompts of all BOT turns: [(utterance_idx, prompt)] """
+        prompts = []
         for i, msg in enumerate(simulated_conversation):
             if msg.role != Role.BOT: continue
-            
-            prompt = jinja_render(
+            prompt = jinja_render_static(
                 "flowagent/eval_single_with_reference.jinja",
-                session=simulated_conversation[:i].to_str(),
-                workflow_info=workflow.to_str(),
+                key=workflow.key, static=lambda: dict(workflow_info=workflow.to_str()),
+                session=simulated_conversation[:i].to_str(),     # a prefix of the rendered conversation
                 reference_input=msg.content, predicted_input=msg.content_predict,
             )
-            @retry_wrapper(retry=self.cfg.judge_retry_limit, step_name="judge_turn", log_fn=print)
-            def judge_turn(prompt):
-                llm_response, _model_name, _usage = self.llm.query_one(prompt, return_usage=True)
-                jr = self._parse_react_output(llm_response, slots=['Score'], slots_to_check=['Score'])
-                return jr, llm_response, _model_name, _usage
-            jr, llm_response, _model_name, _usage = judge_turn(prompt)
+            prompts.append((i, prompt))
+        return prompts
+
+    def _parse_turn_output(self, llm_response: str) -> Dict[str, Any]:
+        return self._parse_react_output(llm_response, slots=['Score'], slots_to_check=['Score'])
+
+    def _format_turn_outputs(self, simulated_conversation: Conversation, turn_results: List[Tuple]) -> Dict[str, Any]:
+        """ turn_results: [(utterance_idx, prompt, jr, llm_response, _model_name, _usage)] """
+        out = {
+            "judge_turn_result": [],
+            "judge_turn_details": []
+        }
+        for i, prompt, jr, llm_response, _model_name, _usage in turn_results:
             jr.update({
                 "utterance_id": i,
                 "type": simulated_conversation.get_message_by_idx(i-1).type
             })
             out["judge_turn_result"].append(jr)
-            out["judge_turn_details"].append({
-                "model": _model_name,   # judge model & detailed infos
-                "usage": _usage,
-                "prompt": prompt,
-                "llm_response": llm_response,
-            })
+            out["judge_turn_details"].append(self._format_details(prompt, llm_response, _model_name, _usage))
         return out
     
+    def _judge_turn(self, 
+        workflow: Workflow, simulated_conversation: Conversation,
+    ) -> Dict[str, Any]:
+        turn_results = []
+        for i, prompt in self._gen_turn_prompts(workflow, simulated_conversation):
+            turn_results.append((i, prompt, *self._query_and_parse(prompt, self._parse_turn_output, step_name="judge_turn")))
+        return self._format_turn_outputs(simulated_conversation, turn_results)
+
+    async def _judge_turn_async(self, 
+        workflow: Workflow, simulated_conversation: Conversation,
+    ) -> Dict[str, Any]:
+        """ async version of `_judge_turn`, the turns of a conversation are judged concurrently """
+        @async_retry_wrapper(retry=self.cfg.judge_retry_limit, step_name="judge_turn", log_fn=print)
+        async def judge_turn(i, prompt):
+            llm_response, _model_name, _usage = await self.llm.query_one_async(prompt, return_usage=True)
+            jr = self._parse_turn_output(llm_response)
+            return i, prompt, jr, llm_response, _model_name, _usage
+        turn_results = await asyncio.gather(*[
+            judge_turn(i, prompt) for i, prompt in self._gen_turn_prompts(workflow, simulated_conversation)
+        ])
+        return self._format_turn_outputs(simulated_conversation, list(turn_results))
+    
+    def gen_batch_prompts(self, mode: str="session", verbose=True) -> List[Tuple[str, str]]:
+        """ batch mode 1/2: render the judge prompts of the conversation -> [(custom_id, prompt)], [] if judged """
+        assert mode in ["session", "turn"], f"invalid mode: {mode}"
+        if self._check_if_judged(verbose=verbose) is not None: return []
+        workflow, simulated_conversation = self._batch_inputs = self._load_judge_inputs()
+        cid = self.cfg.judge_conversation_id
+        if mode == "session":
+            return [(f"{cid}/session", self._gen_session_prompt(workflow, simulated_conversation))]
+        return [(f"{cid}/turn/{i}", prompt) for i, prompt in self._gen_turn_prompts(workflow, simulated_conversation)]
+
+    def _parse_batch_result(self, result: Union[ChatCompletion, str, None], prompt: str, f_parse: Callable[[str], Dict], step_name: str) -> Tuple:
+        """ parse one batch result, fall back to an interactive query if the request failed or cannot be parsed """
+        if isinstance(result, ChatCompletion):
+            llm_response, _model_name, _usage = OpenAIClient._format_output(result, return_usage=True)
+            try:
+                return f_parse(llm_response), llm_response, _model_name, _usage
+            except Exception as e:
+                print(f"  <{step_name}> failed to parse the batch output: {e}")
+        else:
+            print(f"  <{step_name}> batch request failed: {result or 'missing in the batch output'}")
+        return self._query_and_parse(prompt, f_parse, step_name=step_name)
+
+    def judge_from_batch(self, results: Dict[str, Union[ChatCompletion, str]], mode: str="session", verbose=True) -> Dict:
+        """ batch mode 2/2: parse the batch results of the prompts from `gen_batch_prompts` & record to db """
+        workflow, simulated_conversation = self._batch_inputs
+        cid = self.cfg.judge_conversation_id
+        out_dict = self._init_out_dict(simulated_conversation)
+        if mode == "session":
+            prompt = self._gen_session_prompt(workflow, simulated_conversation)
+            jr, llm_response, _model_name, _usage = self._parse_batch_result(
+                results.get(f"{cid}/session"), prompt, self._parse_session_output, step_name="judge_session"
+            )
+            out_dict |= {
+                "judge_session_result": jr,
+                "judge_session_details": self._format_details(prompt, llm_response, _model_name, _usage)
+            }
+            out_dict |= self._judge_stat_session(workflow, simulated_conversation)
+        elif mode == "turn":
+            turn_results = [
+                (i, prompt, *self._parse_batch_result(results.get(f"{cid}/turn/{i}"), prompt, self._parse_turn_output, step_name="judge_turn"))
+                for i, prompt in self._gen_turn_prompts(workflow, simulated_conversation)
+            ]
+            out_dict |= self._format_turn_outputs(simulated_conversation, turn_results)
+            out_dict |= self._judge_stat_turn(workflow, simulated_conversation)
+        else: raise ValueError(f"invalid mode: {mode}")
+        self.db.insert_evaluation(out_dict)
+        self.logger.log(f"  <judge> {cid} has been judged (batch)", with_print=verbose)
+        return out_dict
+
     def _judge_stat_session(self, workflow: Workflow, simulated_conversation: Conversation) -> Dict[str, Any]:
         _user_profile = workflow.user_profiles[self.cfg.user_profile_id]
         apis_gt = _user_profile.required_apis
@@ -181,10 +318,8 @@ class Judger:
                 api_call = msg.apis[0]
                 _api_gt = (api_call.name, api_call.params)
             else: _api_gt = None
-            if msg.is_api_calling(msg.content_predict):
-                name, params = msg.get_api_infos(msg.content_predict)
-                _api_pred = (name, params)
-            else: _api_pred = None
+            api_call = msg.get_api_call(predict=True)
+            _api_pred = (api_call.name, api_call.params) if api_call else None
             apis_gt.append(_api_gt)
             apis_pred.append(_api_pred)
         return {
@@ -222,4 +357,11 @@ class Judger:
         
         self.logger.log(LogUtils.format_infos_with_tabulate(res), with_print=verbose)
         return res
+
+    async def start_judge_async(self, mode: str="session", verbose=True):
+        """ async version of `start_judge` """
+        assert mode in ["session", "turn"], f"invalid mode: {mode}"
+        res = await self.judge_async(verbose=verbose, mode=mode)
+        self.logger.log(LogUtils.format_infos_with_tabulate(res), with_print=verbose)
+        return res
     
\ No newline at end of file
@@ -3,11 +3,12 @@
 - [ ] integrate with FastAPI
 """
 import json, re
-from typing import List
+from typing import List, Dict, Union
 from .base import BaseAPIHandler
-from ..data import APIOutput, BotOutput, Role, Message, init_client, LLM_CFG
-from utils.jinja_templates import jinja_render
+from ..data import APIOutput, BotOutput, Role, Message, init_role_client
+from utils.jinja_templates import jinja_render_static, jinja_render_chat
 from easonsi.llm.openai_client import OpenAIClient, Formater
+from easonsi.llm.call_stats import collect_call_stats, merge_call_stats
 
 class DummyAPIHandler(BaseAPIHandler):
     """ 
@@ -43,32 +44,55 @@ class LLMSimulatedAPIHandler(BaseAPIHandler):
     
     def __init__(self, **args) -> None:
         super().__init__(**args)
-        self.llm = init_client(llm_cfg=LLM_CFG[self.cfg.api_llm_name])
+        self.llm = init_role_client(self.cfg, "api")
         
     def process(self, apicalling_info: BotOutput, *args, **kwargs) -> APIOutput:
         flag, m = self.check_validation(apicalling_info)
         if not flag:        # base check error!
-            msg = Message(
-                Role.SYSTEM, m,
-                conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id
-            )
-            prediction = APIOutput(apicalling_info.action, apicalling_info.action_input, m, 400)
-        else:
-            self.cnt_api_callings[apicalling_info.action] += 1  # stat
-            
-            prompt = self._gen_prompt(apicalling_info)
+            return self._add_error_message(apicalling_info, m)
+        self.cnt_api_callings[apicalling_info.action] += 1  # stat
+        
+        prompt = self._gen_prompt(apicalling_info)
+        with collect_call_stats() as llm_stats:
             llm_response = self.llm.query_one(prompt)
-            prediction = self.parse_react_output(llm_response, apicalling_info) # parse_json_output
-            if prediction.response_status_code==200:
-                msg_content = f"<API response> {prediction.response_data}"
-            else:
-                msg_content = f"<API response> {prediction.response_status_code} {prediction.response_data}"
-            msg = Message(
-                Role.SYSTEM, msg_content, prompt=prompt, llm_response=llm_response, 
-                conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id
-            )
-        self.conv.add_message(msg)
+        prediction = self.parse_react_output(llm_response, apicalling_info) # parse_json_output
+        self._add_message(prompt, llm_response, prediction, llm_stat=merge_call_stats(llm_stats))
+        return prediction
+
+    async def process_async(self, apicalling_info: BotOutput, *args, **kwargs) -> APIOutput:
+        """ async version of `process` """
+        flag, m = self.check_validation(apicalling_info)
+        if not flag:
+            return self._add_error_message(apicalling_info, m)
+        self.cnt_api_callings[apicalling_info.action] += 1
+        
+        prompt = self._gen_prompt(apicalling_info)
+        with collect_call_stats() as llm_stats:
+            llm_response = await self.llm.query_one_async(prompt)
+        prediction = self.parse_react_output(llm_response, apicalling_info)
+        self._add_message(prompt, llm_response, prediction, llm_stat=merge_call_stats(llm_stats))
         return prediction
+
+    def _add_error_message(self, apicalling_info: BotOutput, m: str) -> APIOutput:
+        msg = Message(
+            Role.SYSTEM, m,
+            conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id
+        )
+        self.conv.add_message(msg)
+        return APIOutput(apicalling_info.action, apicalling_info.action_input, m, 400)
+
+    def _add_message(self, prompt: Union[str, List[Dict]], llm_response: str, prediction: APIOutput, llm_stat: Dict = None) -> Message:
+        if prediction.response_status_code==200:
+            msg_content = f"<API response> {prediction.response_data}"
+        else:
+            msg_content = f"<API response> {prediction.response_status_code} {prediction.response_data}"
+        msg = Message(
+            Role.SYSTEM, msg_content, prompt=prompt, llm_response=llm_response, 
+            conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id,
+            llm_stat=llm_stat
+        )
+        self.conv.add_message(msg)
+        return msg
     
     def check_validation(self, apicalling_info: BotOutput) -> bool:
         # ... match the api by name? check params? 
@@ -77,10 +101,17 @@ class LLMSimulatedAPIHandler(BaseAPIHandler):
             return False, f"<Calling API Error> : {apicalling_info.action} not in {api_names}"
         return True, None
 
-    def _gen_prompt(self, apicalling_info: BotOutput) -> str:
-        prompt = jinja_render(
+    def _gen_prompt(self, apicalling_info: BotOutput) -> Union[str, List[Dict]]:
+        static = lambda: dict(api_infos=self.api_infos)    # the API infos are static for the workflow
+        if self.cfg.llm_chat_messages:
+            return jinja_render_chat(
+                self.api_template_fn, [],
+                turn_kwargs=dict(api_name=apicalling_info.action, api_input=apicalling_info.action_input),
+                key=self.workflow.key, static=static,
+            )
+        prompt = jinja_render_static(
             self.api_template_fn,     # "flowagent/api_llm.jinja": api_infos, api_name, api_input
-            api_infos=self.api_infos,
+            key=self.workflow.key, static=static,
             api_name=apicalling_info.action,
             api_input=apicalling_info.action_input,
         )
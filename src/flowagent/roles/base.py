@@ -1,4 +1,4 @@
-import collections
+import collections, asyncio
 from abc import abstractmethod
 from typing import List, Dict, Optional, Tuple, Union
 from easonsi.llm.openai_client import OpenAIClient
@@ -28,6 +28,10 @@ class BaseRole:
         """
         raise NotImplementedError
 
+    async def process_async(self, *args, **kwargs) -> Union[UserOutput, BotOutput, APIOutput]:
+        """ async version of `process`. By default, run the sync version in a worker thread """
+        return await asyncio.to_thread(self.process, *args, **kwargs)
+
 
 class BaseAPIHandler(BaseRole):
     """ 
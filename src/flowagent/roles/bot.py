@@ -3,12 +3,13 @@
     - [ ] check performance diff for JSON / React output
 """
 import re, datetime, json
-from typing import List, Tuple
+from typing import List, Dict, Tuple, Callable, Optional, Union
 from .base import BaseBot
-from ..data import BotOutput, BotOutputType, Message, Role, init_client, LLM_CFG, LogUtils
-from utils.jinja_templates import jinja_render
-from utils.wrappers import retry_wrapper
+from ..data import BotOutput, BotOutputType, Message, Role, APICall, init_role_client, LogUtils
+from utils.jinja_templates import jinja_render_static, jinja_render_chat
+from utils.wrappers import retry_wrapper, async_retry_wrapper
 from easonsi.llm.openai_client import OpenAIClient, Formater
+from easonsi.llm.call_stats import collect_call_stats, merge_call_stats
 
 class DummyBot(BaseBot):
     names: List[str] = ["dummy_bot"]
@@ -37,19 +38,96 @@ class DummyBot(BaseBot):
         return bot_output
 
 
+class ReactStreamParser:
+    """ incremental parser of a streamed ReAct output, to stop the generation once a block is complete
+        (Thought, Response): the Response is followed by a new field / role prefix / code fence
+        (Thought, Action, Action Input): the JSON of Action Input is closed
+    USAGE:
+        parser = ReactStreamParser()
+        for delta in stream:
+            if parser.feed(delta): break
+        llm_response = parser.get_output()
+    """
+    _re_last_field = re.compile(r"(?:^|\n)[ \t]*(Response|Action Input):")
+    _re_value_end = re.compile(r"\n[ \t]*(?:(?:Thought|Action|Action Input|Response):|```|\[[A-Z]+\])")
+    _markers = ("Thought:", "Action:", "Action Input:", "Response:", "```")
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.field: str = None          # Response / Action Input, once found
+        self.value_start: int = None
+        self.end: int = None            # end of the complete block
+        self._n_popped = 0
+
+    def feed(self, delta: str) -> bool:
+        """ append the new tokens, return True if the block is complete """
+        if self.end is not None: return True
+        self.text += delta
+        if self.field is None:
+            m = self._re_last_field.search(self.text)
+            if m is None: return False
+            self.field, self.value_start = m.group(1), m.end()
+        self.end = self._find_value_end()
+        return self.end is not None
+
+    def _find_value_end(self) -> Optional[int]:
+        value = self.text[self.value_start:]
+        if self.field == "Action Input" and value.lstrip()[:1] in ("{", "["):
+            offset = len(value) - len(value.lstrip())
+            end = self._find_json_end(value, offset)
+            return None if end is None else self.value_start + end
+        m = self._re_value_end.search(value)
+        return None if m is None else self.value_start + m.start()
+
+    @staticmethod
+    def _find_json_end(s: str, start: int) -> Optional[int]:
+        """ the end of the (balanced) JSON object/array starting at `start`, None if not closed yet """
+        depth, in_str, escaped = 0, False, False
+        for i in range(start, len(s)):
+            c = s[i]
+            if in_str:
+                if escaped: escaped = False
+                elif c == "\\": escaped = True
+                elif c == '"': in_str = False
+            elif c == '"': in_str = True
+            elif c in "{[": depth += 1
+            elif c in "}]":
+                depth -= 1
+                if depth == 0: return i + 1
+        return None
+
+    def get_output(self) -> str:
+        """ the output truncated at the end of the complete block """
+        return self.text if self.end is None else self.text[:self.end]
+
+    def pop_response_delta(self) -> str:
+        """ the new tokens of the Response since the last call (holding back a possible marker at the tail) """
+        if self.field != "Response": return ""
+        value = self.get_output()[self.value_start:].lstrip()
+        if self.end is None:
+            last_line = value.rsplit("\n", 1)[-1].lstrip()
+            if "\n" in value and (any(m.startswith(last_line) for m in self._markers) or re.fullmatch(r"\[[A-Z]*\]?", last_line)):
+                value = value[:value.rfind("\n")]
+        delta, self._n_popped = value[self._n_popped:], max(self._n_popped, len(value))
+        return delta
+
+
 class ReactBot(BaseBot):
     """ ReactBot
     prediction format: 
         (Thought, Response) for response node
         (Thought, Action, Action Input) for call api node
+    NOTE: with `cfg.bot_llm_stream`, the output is streamed and stopped once the ReAct block is complete
+    NOTE: with `cfg.llm_chat_messages`, the prompt is a list of chat messages (see `jinja_render_chat`)
     """
     llm: OpenAIClient = None
     bot_template_fn: str = "flowagent/bot_flowbench.jinja"
     names = ["ReactBot", "react_bot"]
+    stream_callback: Callable[[str], None] = None     # stream mode: called with the new tokens of the Response
     
     def __init__(self, **args) -> None:
         super().__init__(**args)
-        self.llm = init_client(llm_cfg=LLM_CFG[self.cfg.bot_llm_name])
+        self.llm = init_role_client(self.cfg, "bot")
         
     def process(self, *args, **kwargs) -> BotOutput:
         """ mian process logic.
@@ -60,33 +138,104 @@ class ReactBot(BaseBot):
         def process_with_retry(prompt):
             llm_response, prediction = self._process(prompt)
             return llm_response, prediction
-        llm_response, prediction = process_with_retry(prompt)
-        
+        with collect_call_stats() as llm_stats:
+            llm_response, prediction = process_with_retry(prompt)
+        self._add_message(prompt, llm_response, prediction, llm_stat=merge_call_stats(llm_stats))
+        return prediction
+
+    async def process_async(self, *args, **kwargs) -> BotOutput:
+        """ async version of `process` """
+        prompt = self._gen_prompt()
+        @async_retry_wrapper(retry=self.cfg.bot_retry_limit, step_name="bot_process", log_fn=print)
+        async def process_with_retry(prompt):
+            llm_response, prediction = await self._process_async(prompt)
+            return llm_response, prediction
+        with collect_call_stats() as llm_stats:
+            llm_response, prediction = await process_with_retry(prompt)
+        self._add_message(prompt, llm_response, prediction, llm_stat=merge_call_stats(llm_stats))
+        return prediction
+
+    def _add_message(self, prompt:Union[str, List[Dict]], llm_response:str, prediction:BotOutput, llm_stat:Dict=None) -> Message:
         if prediction.action_type==BotOutputType.RESPONSE:
-            msg_content = prediction.response
+            msg_content, apis = prediction.response, None
         else:
             msg_content = f"<Call API> {prediction.action}({prediction.action_input})"
+            apis = [APICall(prediction.action, prediction.action_input)]     # parsed once, see `Conversation.api_calls`
         msg = Message(
             Role.BOT, msg_content, prompt=prompt, llm_response=llm_response,
-            conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id
+            conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id,
+            apis=apis, llm_stat=llm_stat
         )
         self.conv.add_message(msg)
         self.cnt_bot_actions += 1  # stat
-        return prediction
+        return msg
 
-    def _gen_prompt(self) -> str:
-        prompt = jinja_render(
-            self.bot_template_fn,     # "flowagent/bot_flowbench.jinja": task_description, workflow, toolbox, current_time, history_conversation
+    def _static_infos(self) -> Dict:
+        """ the static sections of the prompt, rendered once per workflow (see `jinja_render_static`) """
+        return dict(
             task_description=self.workflow.task_description,
             workflow=self.workflow.workflow,
             toolbox=self.workflow.toolbox,
-            current_time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        )
+
+    def _gen_prompt(self) -> Union[str, List[Dict]]:
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self.cfg.llm_chat_messages:
+            return jinja_render_chat(
+                self.bot_template_fn, self.conv.to_chat_messages(Role.BOT),
+                turn_kwargs=dict(current_time=current_time), key=self.workflow.key, static=self._static_infos,
+            )
+        prompt = jinja_render_static(
+            self.bot_template_fn,     # "flowagent/bot_flowbench.jinja": task_description, workflow, toolbox, current_time, history_conversation
+            key=self.workflow.key, static=self._static_infos,
+            current_time=current_time,
             history_conversation=self.conv.to_str(),
         )
         return prompt
 
+    def _query_llm(self, prompt:Union[str, List[Dict]]) -> str:
+        if not self.cfg.bot_llm_stream:
+            return self.llm.query_one(prompt)
+        parser = ReactStreamParser()
+        stream = self.llm.query_one_stream_generator(prompt)
+        try:
+            for delta in stream:
+                is_complete = parser.feed(delta)
+                self._on_stream(parser)
+                if is_complete: break
+        finally:
+            stream.close()      # early stop
+        self._on_stream(parser, is_end=True)
+        return parser.get_output()
+
+    async def _query_llm_async(self, prompt:Union[str, List[Dict]]) -> str:
+        if not self.cfg.bot_llm_stream:
+            return await self.llm.query_one_async(prompt)
+        parser = ReactStreamParser()
+        stream = await self.llm.query_one_stream_generator_async(prompt)
+        try:
+            async for delta in stream:
+                is_complete = parser.feed(delta)
+                self._on_stream(parser)
+                if is_complete: break
+        finally:
+            await stream.aclose()
+        self._on_stream(parser, is_end=True)
+        return parser.get_output()
+
+    def _on_stream(self, parser: ReactStreamParser, is_end: bool=False) -> None:
+        if self.stream_callback is None: return
+        delta = parser.pop_response_delta()
+        if delta: self.stream_callback(delta)
+        if is_end and parser._n_popped: self.stream_callback("\n")
+
     def _process(self, prompt:str=None) -> Tuple[str, BotOutput]:
-        llm_response = self.llm.query_one(prompt)
+        llm_response = self._query_llm(prompt)
+        prediction = self.parse_react_output(llm_response)
+        return llm_response, prediction
+
+    async def _process_async(self, prompt:str=None) -> Tuple[str, BotOutput]:
+        llm_response = await self._query_llm_async(prompt)
         prediction = self.parse_react_output(llm_response)
         return llm_response, prediction
     
@@ -126,7 +275,13 @@ class PDLBot(ReactBot):
     bot_template_fn: str = "flowagent/bot_pdl.jinja"
     names = ["PDLBot", "pdl_bot"]
     
-    def _gen_prompt(self) -> str:
+    def _static_infos(self) -> Dict:
+        return dict(
+            api_infos=self.workflow.toolbox,
+            PDL=self.workflow.pdl.to_str_wo_api(),  # .to_str()
+        )
+
+    def _gen_prompt(self) -> Union[str, List[Dict]]:
         # valid_apis = self.workflow.pdl.get_valid_apis()
         # valid_apis_str = "There are no valid apis now!" if not valid_apis else f"you can call {valid_apis}"
         state_infos = {
@@ -134,17 +289,22 @@ class PDLBot(ReactBot):
             # "Current state": self.workflow.pdl.current_state,
             # "Current valid apis": valid_apis_str,
         }
-        prompt = jinja_render(
+        current_state = "\n".join(f"{k}: {v}" for k,v in state_infos.items()).strip()    # NOTE: no filters in the template, see `jinja_render_static`
+        if self.cfg.llm_chat_messages:
+            return jinja_render_chat(
+                self.bot_template_fn, self.conv.to_chat_messages(Role.BOT),
+                turn_kwargs=dict(current_state=current_state), key=self.workflow.key, static=self._static_infos,
+            )
+        prompt = jinja_render_static(
             self.bot_template_fn,       # "flowagent/bot_pdl.jinja"
-            api_infos=self.workflow.toolbox,
-            PDL=self.workflow.pdl.to_str_wo_api(),  # .to_str()
+            key=self.workflow.key, static=self._static_infos,
             conversation=self.conv.to_str(), 
-            current_state="\n".join(f"{k}: {v}" for k,v in state_infos.items()),
+            current_state=current_state,
         )
         return prompt
     
     def _process(self, prompt:str=None) -> Tuple[str, BotOutput]:
-        llm_response = self.llm.query_one(prompt)
+        llm_response = self._query_llm(prompt)
         # transform json -> react format? 
         prediction = self.parse_react_output(llm_response)
         return llm_response, prediction
@@ -3,12 +3,13 @@ InputUser: interact manually
 LLMSimulatedUserWithProfile
 """
 import re, random
-from typing import List, Tuple
+from typing import List, Dict, Tuple, Union
 from .base import BaseUser
-from ..data import UserOutput, UserProfile, OOWIntention, Role, Message, LogUtils, init_client, LLM_CFG
-from utils.jinja_templates import jinja_render
-from utils.wrappers import retry_wrapper
+from ..data import UserOutput, UserProfile, OOWIntention, Role, Message, LogUtils, init_role_client
+from utils.jinja_templates import jinja_render_static, jinja_render_chat
+from utils.wrappers import retry_wrapper, async_retry_wrapper
 from easonsi.llm.openai_client import OpenAIClient, Formater
+from easonsi.llm.call_stats import collect_call_stats, merge_call_stats
 
 
 class DummyUser(BaseUser):
@@ -49,7 +50,7 @@ class LLMSimulatedUserWithProfile(BaseUser):
     
     def __init__(self, **args) -> None:
         super().__init__(**args)
-        self.llm = init_client(llm_cfg=LLM_CFG[self.cfg.user_llm_name])
+        self.llm = init_role_client(self.cfg, "user")
         assert self.cfg.user_profile_id is not None, "cfg.user_profile or cfg.user_profile_id is None!"
         self.user_profile = self.workflow.user_profiles[self.cfg.user_profile_id]
 
@@ -62,20 +63,53 @@ class LLMSimulatedUserWithProfile(BaseUser):
         def process_with_retry(prompt):
             llm_response, prediction = self._process(prompt)
             return llm_response, prediction
-        llm_response, prediction = process_with_retry(prompt)
+        with collect_call_stats() as llm_stats:
+            llm_response, prediction = process_with_retry(prompt)
+        self._add_message(prompt, llm_response, prediction, llm_stat=merge_call_stats(llm_stats))
+        return prediction
+
+    async def process_async(self, *args, **kwargs) -> UserOutput:
+        """ async version of `process` """
+        prompt = self._gen_prompt()
+        @async_retry_wrapper(retry=self.cfg.user_retry_limit, step_name="user_process", log_fn=print)
+        async def process_with_retry(prompt):
+            llm_response, prediction = await self._process_async(prompt)
+            return llm_response, prediction
+        with collect_call_stats() as llm_stats:
+            llm_response, prediction = await process_with_retry(prompt)
+        self._add_message(prompt, llm_response, prediction, llm_stat=merge_call_stats(llm_stats))
+        return prediction
+
+    def _add_message(self, prompt:Union[str, List[Dict]], llm_response:str, prediction:UserOutput, type:str=None, llm_stat:Dict=None) -> Message:
         msg = Message(
             Role.USER, prediction.response_content, prompt=prompt, llm_response=llm_response,
-            conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id
+            conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id,
+            type=type, llm_stat=llm_stat
         )
         self.conv.add_message(msg)
         self.cnt_user_queries += 1  # stat
-        return prediction
+        return msg
 
-    def _gen_prompt(self) -> str:
-        prompt = jinja_render(
-            self.user_template_fn,  # "flowagent/user_llm.jinja": assistant_description, user_profile, history_conversation
+    @property
+    def _static_key(self) -> tuple:
+        """ identifies the static sections of the prompt: the workflow & the user profile """
+        return (*self.workflow.key, self.cfg.user_profile_id)
+
+    def _static_infos(self) -> Dict:
+        return dict(
             assistant_description=self.workflow.task_description,
             user_profile=self.user_profile.to_str(),
+        )
+
+    def _gen_prompt(self) -> Union[str, List[Dict]]:
+        if self.cfg.llm_chat_messages:
+            return jinja_render_chat(
+                self.user_template_fn, self.conv.to_chat_messages(Role.USER),
+                key=self._static_key, static=self._static_infos,
+            )
+        prompt = jinja_render_static(
+            self.user_template_fn,  # "flowagent/user_llm.jinja": assistant_description, user_profile, history_conversation
+            key=self._static_key, static=self._static_infos,
             history_conversation=self.conv.to_str()
         )
         return prompt
@@ -85,6 +119,11 @@ class LLMSimulatedUserWithProfile(BaseUser):
         prediction = self.parse_user_output(llm_response)
         return llm_response, prediction
 
+    async def _process_async(self, prompt:str=None) -> Tuple[str, UserOutput]:
+        llm_response = await self.llm.query_one_async(prompt)
+        prediction = self.parse_user_output(llm_response)
+        return llm_response, prediction
+
     @staticmethod
     def parse_user_output(s: str) -> UserOutput:
         if "```" in s:
@@ -104,43 +143,73 @@ class LLMSimulatedUserWithOOW(LLMSimulatedUserWithProfile):
     names = ["llm_oow", "LLMSimulatedUserWithOOW"]
     user_template_fn: str = "flowagent/user_llm_oow.jinja"
     
-    def _gen_prompt(self, oow_intention: OOWIntention=None) -> str:
+    def _gen_prompt(self, oow_intention: OOWIntention=None) -> Union[str, List[Dict]]:
         profile_dict = self.user_profile.profile
+        if self.cfg.llm_chat_messages:  # the (static) profile in the system message, the OOW intention in the last one
+            return jinja_render_chat(
+                self.user_template_fn, self.conv.to_chat_messages(Role.USER),
+                turn_kwargs=dict(additional_constraints=oow_intention.to_str() if oow_intention else ""),
+                key=self._static_key, static=lambda: dict(
+                    assistant_description=self.workflow.task_description,
+                    user_profile=self.user_profile.to_str(profile={k: v for k, v in profile_dict.items() if k != "additional_constraints"}),
+                ),
+            )
         profile_dict["additional_constraints"] = oow_intention.to_str() if oow_intention else ""
-        prompt = jinja_render(
+        prompt = jinja_render_static(
             self.user_template_fn,  # "flowagent/user_llm.jinja": assistant_description, user_profile, history_conversation
-            assistant_description=self.workflow.task_description,
-            user_profile=self.user_profile.to_str(profile=profile_dict),
+            key=self.workflow.key, static=lambda: dict(assistant_description=self.workflow.task_description),
+            user_profile=self.user_profile.to_str(profile=profile_dict),    # NOTE: changes with the OOW intention
             history_conversation=self.conv.to_str()
         )
         return prompt
     
-    def process(self, *args, **kwargs) -> UserOutput:
-        """ mian process logic.
-        [random] -> gen prompt -> query & process -> gen message
+    def _sample_oow_intention(self) -> OOWIntention:
+        """ randomly select an OOW intention (or None)
+        NOTE: seeded by the workflow, the user profile & the turn (the `conversation_id` is a timestamp), so that a re-run
+            draws the same intentions, and the prompts match the cache / cassette. `workflow.key` is per process, not used
         """
-        # 1. random select a oow
-        if_oow = random.random() < self.cfg.user_oow_ratio
+        seed = (self.cfg.workflow_dataset, self.cfg.workflow_type, self.cfg.workflow_id, self.cfg.user_profile_id, self.conv.current_utterance_id)
+        rng = random.Random(str(seed))
+        if_oow = rng.random() < self.cfg.user_oow_ratio
         if if_oow:
             oow_intention = self.workflow.user_oow_intentions[self.cfg.user_profile_id % len(self.workflow.user_oow_intentions)]
             # print(f"  >> using oow: {oow_intention.name}")
         else: oow_intention = None
+        return oow_intention
+
+    def process(self, *args, **kwargs) -> UserOutput:
+        """ mian process logic.
+        [random] -> gen prompt -> query & process -> gen message
+        """
+        # 1. random select a oow
+        oow_intention = self._sample_oow_intention()
         # 2. prompting & processing
         prompt = self._gen_prompt(oow_intention)
         @retry_wrapper(retry=self.cfg.user_retry_limit, step_name="user_process", log_fn=print)
         def process_with_retry(prompt):
             llm_response, prediction = self._process(prompt)
             return llm_response, prediction
-        llm_response, prediction = process_with_retry(prompt)
+        with collect_call_stats() as llm_stats:
+            llm_response, prediction = process_with_retry(prompt)
         # 3. note to add type! 
-        msg = Message(
-            Role.USER, prediction.response_content, prompt=prompt, llm_response=llm_response,
-            conversation_id=self.conv.conversation_id, utterance_id=self.conv.current_utterance_id,
-            type="" if not if_oow else oow_intention.name   # TODO the detailed OOW type? 
+        self._add_message(
+            prompt, llm_response, prediction, llm_stat=merge_call_stats(llm_stats),
+            type="" if oow_intention is None else oow_intention.name   # TODO the detailed OOW type? 
         )
-        self.conv.add_message(msg)
-        self.cnt_user_queries += 1  # stat
         return prediction
 
-
-
+    async def process_async(self, *args, **kwargs) -> UserOutput:
+        """ async version of `process` """
+        oow_intention = self._sample_oow_intention()
+        prompt = self._gen_prompt(oow_intention)
+        @async_retry_wrapper(retry=self.cfg.user_retry_limit, step_name="user_process", log_fn=print)
+        async def process_with_retry(prompt):
+            llm_response, prediction = await self._process_async(prompt)
+            return llm_response, prediction
+        with collect_call_stats() as llm_stats:
+            llm_response, prediction = await process_with_retry(prompt)
+        self._add_message(
+            prompt, llm_response, prediction, llm_stat=merge_call_stats(llm_stats),
+            type="" if oow_intention is None else oow_intention.name
+        )
+        return prediction
@@ -61,7 +61,7 @@ class CLIChecker():
     def __init__(self, cfg: Config = None) -> None:
         if cfg is None:
             cfg = Config.from_yaml(DataManager.normalize_config_name("default.yaml"))
-        self.db = DBManager(cfg.db_uri, cfg.db_name, cfg.db_message_collection_name)
+        self.db = DBManager.from_config(cfg)
         self.data_manager = DataManager(cfg)
 
     def query_run_experiments(self, exp_version: str, **customized_query):
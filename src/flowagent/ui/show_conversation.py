@@ -20,7 +20,7 @@ def show_conversation_page():
     if "db" not in st.session_state:
         assert 'cfg' in st.session_state
         cfg: Config = st.session_state.cfg
-        st.session_state.db = DBManager(cfg.db_uri, cfg.db_name, cfg.db_message_collection_name)
+        st.session_state.db = DBManager.from_config(cfg)
         st.session_state.data_manager = DataManager(cfg)
     if "run_exps" not in st.session_state:
         refresh_conversation_id()
@@ -68,7 +68,7 @@ def show_conversation_page():
     if conversation_id:
         # 1. query conversation from db ; show the conversation
         conv = db.query_messages_by_conversation_id(conversation_id)
-        if len(conv.msgs) == 0:
+        if len(conv) == 0:
             st.warning(f"Conversation `{conversation_id}` is empty.")
             return
         df = conv.to_dataframe()
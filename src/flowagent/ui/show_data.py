@@ -31,7 +31,7 @@ def show_data_page():
     if "db" not in st.session_state:
         assert 'cfg' in st.session_state
         _cfg: Config = st.session_state.cfg
-        st.session_state.db = DBManager(_cfg.db_uri, _cfg.db_name, _cfg.db_message_collection_name)
+        st.session_state.db = DBManager.from_config(_cfg)
     db:DBManager = st.session_state.db
 
     # ------------------ sidebar --------------------
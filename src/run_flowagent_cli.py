@@ -20,6 +20,7 @@ def run_cli(
     bot_mode: BotMode = typer.Option(None, help="Bot mode", case_sensitive=False), # type: ignore
     bot_template_fn: str = typer.Option(None, help="Bot template filename"),
     bot_llm_name: str = typer.Option(None, help="Bot LLM name"),
+    bot_llm_stream: bool = typer.Option(None, help="Stream the bot responses"),
     api_mode: ApiMode = typer.Option(None, help="API mode", case_sensitive=False), # type: ignore
     api_llm_name: str = typer.Option(None, help="API LLM name"),
     conversation_turn_limit: int = typer.Option(None, help="Conversation turn limit"),
@@ -39,6 +40,7 @@ def run_cli(
     if bot_mode is not None: cfg.bot_mode = bot_mode.value
     if bot_template_fn is not None: cfg.bot_template_fn = bot_template_fn
     if bot_llm_name is not None: cfg.bot_llm_name = bot_llm_name
+    if bot_llm_stream is not None: cfg.bot_llm_stream = bot_llm_stream
     if api_mode is not None: cfg.api_mode = api_mode.value
     if api_llm_name is not None: cfg.api_llm_name = api_llm_name
     if conversation_turn_limit is not None: cfg.conversation_turn_limit = conversation_turn_limit
@@ -46,6 +48,8 @@ def run_cli(
     if log_to_db is not None: cfg.log_to_db = log_to_db
 
     controller = FlowagentController(cfg)
+    if cfg.bot_llm_stream:  # show the response tokens as they arrive
+        controller.bot.stream_callback = lambda s: print(f"\033[90m{s}\033[0m", end="", flush=True)
     controller.start_conversation()
 
 if __name__ == "__main__":
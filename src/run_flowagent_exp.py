@@ -12,6 +12,7 @@ def run_exp(
     workflow_type: WorkflowTypeStr = typer.Option(None, help="Workflow type", case_sensitive=False),
     exp_version: str = typer.Option(None, help="Experiment version"),
     exp_mode: str = typer.Option(None, help="Experiment mode", case_sensitive=False),
+    exp_engine: str = typer.Option(None, help="Execution engine: thread, async", case_sensitive=False),
     user_mode: UserMode = typer.Option(None, help="User mode", case_sensitive=False), # type: ignore
     user_llm_name: str = typer.Option(None, help="User LLM name"),
     user_template_fn: str = typer.Option(None, help="User template filename"),
@@ -25,12 +26,15 @@ def run_exp(
     log_to_db: bool = typer.Option(None, help="Log to DB"),
     simulate_num_persona: int = typer.Option(None, help="Simulate num persona"),
     simulate_max_workers: int = typer.Option(None, help="Simulate max workers"),
+    judge_batch: bool = typer.Option(None, help="Judge with the batch API"),
+    judge_batch_backend: str = typer.Option(None, help="Batch backend: openai, local", case_sensitive=False),
 ):
     cfg = Config.from_yaml(DataManager.normalize_config_name(config))
     if workflow_dataset is not None: cfg.workflow_dataset = workflow_dataset
     if workflow_type is not None: cfg.workflow_type = workflow_type.value
     if exp_version is not None: cfg.exp_version = exp_version
     if exp_mode is not None: cfg.exp_mode = exp_mode
+    if exp_engine is not None: cfg.exp_engine = exp_engine
     if user_mode is not None: cfg.user_mode = user_mode.value
     if user_llm_name is not None: cfg.user_llm_name = user_llm_name
     if user_template_fn is not None: cfg.user_template_fn = user_template_fn
@@ -44,6 +48,8 @@ def run_exp(
     if log_to_db is not None: cfg.log_to_db = log_to_db
     if simulate_num_persona is not None: cfg.simulate_num_persona = simulate_num_persona
     if simulate_max_workers is not None: cfg.simulate_max_workers = simulate_max_workers
+    if judge_batch is not None: cfg.judge_batch = judge_batch
+    if judge_batch_backend is not None: cfg.judge_batch_backend = judge_batch_backend
 
     controller = Evaluator(cfg)
     controller.main()
@@ -1,5 +1,6 @@
 import jinja2
-import os
+import os, re, threading, collections
+from typing import List, Dict, Tuple, Callable, Hashable
 
 env = None
 
@@ -16,4 +17,63 @@ def jinja_render(template, **kwargs):
     global env
     return env.get_template(template).render(**kwargs)
 
+
+# (template, key, dynamic names) -> [literal, name, literal, name, ..., literal]
+_SKELETONS: "collections.OrderedDict[Tuple, List[str]]" = collections.OrderedDict()
+_SKELETONS_LOCK = threading.Lock()
+_SKELETONS_MAXSIZE = 4096
+_RE_SLOT = re.compile("\x00(\\w+)\x00")
+
+def jinja_render_static(template, key: Hashable, static: Callable[[], Dict], **dynamic) -> str:
+    """ `jinja_render` with memoised static sections: the template is rendered once per (template, key) with the
+    static kwargs `static()` and placeholders for the `dynamic` ones, then each call only fills in the dynamic values
+    USAGE:
+        prompt = jinja_render_static(
+            "flowagent/bot_pdl.jinja", key=(dataset, workflow_type, workflow_id),
+            static=lambda: dict(PDL=pdl.to_str_wo_api(), api_infos=toolbox),  # only called on a miss
+            conversation=conv.to_str(), current_state=current_state,
+        )
+    NOTE: `key` must identify the static kwargs, and the dynamic variables must be output as is (no filters/conditions on them)
+    """
+    skeleton_key = (template, key, tuple(sorted(dynamic)))
+    with _SKELETONS_LOCK:
+        parts = _SKELETONS.get(skeleton_key)
+        if parts is not None: _SKELETONS.move_to_end(skeleton_key)
+    if parts is None:
+        parts = _RE_SLOT.split(jinja_render(template, **static(), **{k: f"\x00{k}\x00" for k in dynamic}))
+        with _SKELETONS_LOCK:
+            _SKELETONS[skeleton_key] = parts
+            if len(_SKELETONS) > _SKELETONS_MAXSIZE: _SKELETONS.popitem(last=False)
+    out = [parts[0]]
+    for i in range(1, len(parts), 2):
+        out.append(str(dynamic[parts[i]]))
+        out.append(parts[i + 1])
+    return "".join(out)
+
+def jinja_clear_static() -> None:
+    with _SKELETONS_LOCK:
+        _SKELETONS.clear()
+
+def jinja_render_chat(
+    template, history: List[Dict], turn_kwargs: Dict=None, key: Hashable=None, static: Callable[[], Dict]=None, **kwargs
+) -> List[Dict]:
+    """ chat (multi-message) version of `template`, e.g. "flowagent/bot_pdl.jinja" ->
+        [system: "flowagent/bot_pdl_system.jinja" (kwargs), *history, user: "flowagent/bot_pdl_turn.jinja" (turn_kwargs)]
+    with `key` & `static` (instead of kwargs), the system message is memoised, see `jinja_render_static`
+    NOTE: keep the static context in the system template & the volatile (per-turn) fields in the turn template,
+        so that the growing prefix is byte-identical across turns and hits the prefix cache of the provider / vLLM
+    """
+    stem = template[:-len(".jinja")] if template.endswith(".jinja") else template
+    if key is not None:
+        system = jinja_render_static(f"{stem}_system.jinja", key, static)
+    else:
+        system = jinja_render(f"{stem}_system.jinja", **kwargs)
+    messages = [{"role": "system", "content": system}] + list(history)
+    turn = jinja_render(f"{stem}_turn.jinja", **(turn_kwargs or {}))
+    if messages[-1]["role"] == "user":
+        messages[-1] = {"role": "user", "content": f"{messages[-1]['content']}\n\n{turn}"}
+    else:
+        messages.append({"role": "user", "content": turn})
+    return messages
+
 jinja_init(os.path.dirname(__file__))
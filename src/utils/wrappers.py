@@ -1,4 +1,4 @@
-import time, functools
+import time, functools, asyncio
 from typing import Callable
 
 
@@ -41,4 +41,24 @@ def retry_wrapper(retry: int = 3, step_name: str = "", log_fn: Callable = print)
             else:
                 raise Exception(f"<{step_name}> failed for {retry} times!!! \n  Args: {args}, Kwargs: {kwargs}")
         return wrapped_f
-    return decorator
\ No newline at end of file
+    return decorator
+
+def async_retry_wrapper(retry: int = 3, step_name: str = "", log_fn: Callable = print):
+    """ async version of `retry_wrapper`
+    USAGE: 
+        @async_retry_wrapper(retry=3, step_name="example_function", log_fn=xxx)
+        async def example_function(xxx):
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        async def wrapped_f(*args, **kwargs):
+            for _retry in range(retry):
+                try:
+                    res = await f(*args, **kwargs)
+                    return res
+                except Exception as e:
+                    log_fn(f"  <{step_name}> [retry {_retry}/{retry}] encountered error: {e}")
+            else:
+                raise Exception(f"<{step_name}> failed for {retry} times!!! \n  Args: {args}, Kwargs: {kwargs}")
+        return wrapped_f
+    return decorator
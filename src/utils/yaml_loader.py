@@ -0,0 +1,77 @@
+""" YAML loading with the libyaml C loaders (when PyYAML is built with them) & a cache of the parsed results by content hash
+
+USAGE:
+    data = yaml_load(s)                 # `yaml.safe_load`
+    data = yaml_load(s, full=True)      # `yaml.load(s, Loader=yaml.FullLoader)`, e.g. for the PDL files
+    data = yaml_load_file(fn)
+    content = render_env_template(s)    # `jinja2.Template(s).render(os.environ)`, skipped if `s` has no template markers
+NOTE: the cached results are returned as copies, the callers can modify them
+"""
+import os, pickle, hashlib, threading, collections
+from typing import Any
+import yaml, jinja2
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+FullLoader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+# (content hash, full) -> the pickled result
+_PARSED: "collections.OrderedDict[tuple, bytes]" = collections.OrderedDict()
+_PARSED_LOCK = threading.Lock()
+_PARSED_MAXSIZE = 1024
+_STATS = {"num_hits": 0, "num_misses": 0}
+
+
+def _content_key(s: str) -> bytes:
+    return hashlib.blake2b(s.encode("utf-8"), digest_size=16).digest()
+
+def yaml_load(s: str, full: bool = False) -> Any:
+    key = (_content_key(s), full)
+    with _PARSED_LOCK:
+        data = _PARSED.get(key)
+        if data is not None:
+            _PARSED.move_to_end(key)
+            _STATS["num_hits"] += 1
+    if data is not None:
+        return pickle.loads(data)
+    obj = yaml.load(s, Loader=FullLoader if full else SafeLoader)
+    with _PARSED_LOCK:
+        _STATS["num_misses"] += 1
+        _PARSED[key] = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(_PARSED) > _PARSED_MAXSIZE:
+            _PARSED.popitem(last=False)
+    return obj
+
+def yaml_load_file(fn: str, full: bool = False) -> Any:
+    with open(fn, "r") as f:
+        return yaml_load(f.read(), full=full)
+
+def get_yaml_cache_stats() -> dict:
+    with _PARSED_LOCK:
+        return {**_STATS, "size": len(_PARSED)}
+
+def yaml_clear_cache() -> None:
+    with _PARSED_LOCK:
+        _PARSED.clear()
+        _STATS.update(num_hits=0, num_misses=0)
+
+
+# content hash -> compiled template
+_TEMPLATES: "collections.OrderedDict[bytes, jinja2.Template]" = collections.OrderedDict()
+_TEMPLATES_LOCK = threading.Lock()
+_TEMPLATES_MAXSIZE = 64
+_TEMPLATE_MARKERS = ("{{", "{%", "{#")
+
+def render_env_template(s: str) -> str:
+    """ fill in the environment variables, e.g. `db_uri: {{DB_URI}}` """
+    if not any(marker in s for marker in _TEMPLATE_MARKERS):
+        return s
+    key = _content_key(s)
+    with _TEMPLATES_LOCK:
+        template = _TEMPLATES.get(key)
+    if template is None:
+        template = jinja2.Template(s)
+        with _TEMPLATES_LOCK:
+            _TEMPLATES[key] = template
+            if len(_TEMPLATES) > _TEMPLATES_MAXSIZE:
+                _TEMPLATES.popitem(last=False)
+    return template.render(os.environ)
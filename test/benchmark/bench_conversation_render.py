@@ -0,0 +1,39 @@
+""" micro-benchmark: rendering the conversation every turn & all the prefixes of the judger, join vs. rendering buffer
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_conversation_render.py [--turns 200] [--repeat 5]
+"""
+import time, argparse
+from flowagent.data import Conversation, Message, Role
+
+
+def join_render(conv: Conversation) -> str:
+    """ the previous `Conversation.to_str` """
+    return "\n".join([msg.to_str() for msg in conv.msgs])
+
+def simulate(turns: int, render) -> float:
+    """ one `to_str` per message while building the conversation, then one per prefix (`Judger._gen_turn_prompts`) """
+    start = time.perf_counter()
+    conv = Conversation()
+    for turn in range(turns):
+        conv.add_message(Message(Role.USER if turn % 2 == 0 else Role.BOT, f"utterance of turn {turn}, with some details about the booking"))
+        render(conv)
+    for i in range(len(conv)):
+        render(conv[:i])
+    return (time.perf_counter() - start) * 1e3      # ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'turns':>6} {'join (ms)':>10} {'buffer (ms)':>12} {'speedup':>8}")
+    for turns in sorted({10, 50, args.turns}):
+        t_join = min(simulate(turns, join_render) for _ in range(args.repeat))
+        t_buffer = min(simulate(turns, Conversation.to_str) for _ in range(args.repeat))
+        print(f"{turns:>6} {t_join:>10.2f} {t_buffer:>12.2f} {t_join / t_buffer:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+""" benchmark: loading a synthetic N-workflow dataset from the directory vs. from the compiled pack
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_dataset_pack.py [--num 10000] [--workflow_type pdl]
+"""
+import json, time, shutil, argparse, tempfile
+from pathlib import Path
+from flowagent.data import Config, DataManager, Workflow, WorkflowType
+
+
+def make_dataset(root: Path, num: int) -> None:
+    """ `num` copies of the sample workflow 000 """
+    src, dst = DataManager.DIR_data_root / "sample", root / "synthetic"
+    infos = json.load(open(src / "task_infos.json"))
+    task_infos = {}
+    for subdir in ["tools", "user_profile", "pdl"] + [t.subdir for t in WorkflowType if t != WorkflowType.PDL]:
+        (dst / subdir).mkdir(parents=True, exist_ok=True)
+        fn = next((src / subdir).iterdir())
+        for i in range(num):
+            shutil.copyfile(fn, dst / subdir / f"{i:05d}{fn.suffix}")
+    for i in range(num):
+        task_infos[f"{i:05d}"] = infos["task_infos"]["000"]
+    json.dump({**infos, "task_infos": task_infos}, open(dst / "task_infos.json", "w"))
+
+def load_all(num: int, workflow_type: str, all_profiles: bool = False) -> float:
+    """ load the fields used by a simulation: the workflow, toolbox & one profile (or all of them, as the eager loading did) """
+    start = time.perf_counter()
+    cfg = Config(workflow_dataset="synthetic", workflow_type=workflow_type, exp_mode="session")
+    data_manager = DataManager(cfg)
+    for i in range(num):
+        cfg.workflow_id = f"{i:05d}"
+        workflow = Workflow(cfg, data_manager)
+        workflow.workflow, workflow.toolbox
+        profiles = list(workflow.user_profiles) if all_profiles else [workflow.user_profiles[0]]
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num", type=int, default=10000)
+    parser.add_argument("--workflow_type", type=str, default="pdl")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_dataset(Path(root), args.num)
+        DataManager.DIR_data_root = Path(root)
+        t_dir_all, t_dir = load_all(args.num, args.workflow_type, all_profiles=True), load_all(args.num, args.workflow_type)
+        start = time.perf_counter()
+        fn = DataManager.build_pack("synthetic")
+        t_build = time.perf_counter() - start
+        t_pack_all, t_pack = load_all(args.num, args.workflow_type, all_profiles=True), load_all(args.num, args.workflow_type)
+        print(f"{args.num} workflows ({args.workflow_type}), pack: {fn.stat().st_size / 2**20:.1f} MB built in {t_build:.1f}s")
+        print(f"{'profiles':>9} {'directory (s)':>14} {'pack (s)':>9} {'speedup':>8}")
+        print(f"{'all':>9} {t_dir_all:>14.2f} {t_pack_all:>9.2f} {t_dir_all / t_pack_all:>7.1f}x")
+        print(f"{'one':>9} {t_dir:>14.2f} {t_pack:>9.2f} {t_dir / t_pack:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
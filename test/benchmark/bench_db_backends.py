@@ -0,0 +1,108 @@
+""" benchmark: the DB calls of an N-conversation run (simulate -> judge -> analyze) on the embedded SQLite backend
+    - simulate: `_check_if_already_run`, record the conversation (20 messages) & its config
+    - plan: the judge tasks of the experiment, per experiment (a config & an evaluation query each, as before) vs. in bulk
+        (`EvalUtils.get_evaluation_configs`: the configs & the judged ids, 2 queries, counted in the total)
+    - judge: read the conversation, record the evaluation
+    - analyze: the evaluations & the llm stats of the experiment
+    - "remote est." adds `--rtt` per DB call, the network round trips of a remote MongoDB (0 for SQLite)
+    - with `--mongo_uri`, the same workload also runs against that MongoDB (e.g. a remote server, in a throwaway `--mongo_db`)
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_db_backends.py [--num 10000] [--rtt 0.001] [--mongo_uri mongodb://host:27017/]
+"""
+import os, time, argparse, tempfile, collections
+import pandas as pd
+from flowagent.data import Config, DBManager, Message, Conversation, Role
+from flowagent.data.db import RUN_EXPERIMENT_KEYS
+from flowagent.eval.eval_utils import EvalUtils
+
+
+def make_conversation(i: int, num_msgs: int = 20) -> Conversation:
+    conv = Conversation(f"2024-09-06 12:00:00.{i:06d}")
+    for j in range(num_msgs):
+        llm_stat = {"num_calls": 1, "prompt_tokens": 800 + j, "completion_tokens": 40, "wall_time": 0.8}
+        conv.add_message(Message(role=Role.USER if j % 2 == 0 else Role.BOT, content=f"utterance {j} " * 8, llm_stat=llm_stat))
+    return conv
+
+def make_config(i: int, conversation_id: str, exp_version: str) -> dict:
+    """ the recorded config, see `BaseController._record_to_db` """
+    cfg = Config(exp_version=exp_version, workflow_id=f"{i % 24:03d}", user_profile_id=i // 24)
+    return {"conversation_id": conversation_id, **cfg.to_dict()}
+
+def plan_per_exp(db: DBManager, cfg: Config) -> list:
+    """ the judge tasks, one config & one evaluation query per experiment (`get_evaluation_configs` & `_check_if_judged` before) """
+    tasks = []
+    for exp in db.query_run_experiments({"exp_version": cfg.exp_version}):
+        cfg_exp = Config.from_dict(db.query_config_by_conversation_id(exp["conversation_id"]))
+        if not db.query_evaluations({"conversation_id": exp["conversation_id"]}):
+            cfg_exp.judge_conversation_id = exp["conversation_id"]
+            tasks.append(cfg_exp)
+    return tasks
+
+def run(db: DBManager, num: int, exp_version: str) -> dict:
+    """ {phase: (seconds, number of DB calls)} """
+    phase2stat = collections.OrderedDict()
+    convs = [make_conversation(i) for i in range(num)]
+    configs = [make_config(i, conv.conversation_id, exp_version) for i, conv in enumerate(convs)]
+
+    start = time.perf_counter()
+    for conv, config in zip(convs, configs):
+        assert not db.query_run_experiments({k: config[k] for k in RUN_EXPERIMENT_KEYS})
+        db.insert_conversation(conv)
+        db.insert_config(config)
+    db.flush(wait=True)
+    phase2stat["simulate"] = (time.perf_counter() - start, 3 * num)
+
+    cfg = Config(exp_version=exp_version)
+    start = time.perf_counter()
+    assert len(plan_per_exp(db, cfg)) == num
+    phase2stat["plan (per exp)"] = (time.perf_counter() - start, 1 + 2 * num)
+    start = time.perf_counter()
+    tasks = EvalUtils.get_evaluation_configs(cfg, db=db)
+    phase2stat["plan (bulk)"] = (time.perf_counter() - start, 2)
+    assert len(tasks) == num
+
+    start = time.perf_counter()
+    for task in tasks:
+        cid = task.judge_conversation_id
+        conv = db.query_messages_by_conversation_id(cid)
+        db.insert_evaluation({"conversation_id": cid, "exp_version": exp_version, "judge_result": {"num_msgs": len(conv)}})
+    db.flush(wait=True)
+    phase2stat["judge"] = (time.perf_counter() - start, 2 * num)
+
+    start = time.perf_counter()
+    assert len(db.query_evaluations({"exp_version": exp_version})) == num
+    assert sum(r["num_messages"] for r in db.get_exp_llm_stats(exp_version)) == 20 * num
+    phase2stat["analyze"] = (time.perf_counter() - start, 2)
+    return phase2stat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num", type=int, default=10000)
+    parser.add_argument("--rtt", type=float, default=0.001, help="seconds per round trip to a remote MongoDB, for the estimate")
+    parser.add_argument("--write_behind", action="store_true")
+    parser.add_argument("--mongo_uri", type=str, default=None)
+    parser.add_argument("--mongo_db", type=str, default="bench_db_backends")
+    args = parser.parse_args()
+    kwargs = dict(write_behind=args.write_behind, writer_kwargs={"flush_interval": 0.05})
+
+    rows = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = DBManager(f"sqlite:///{os.path.join(tmp_dir, 'runs.db')}", **kwargs)
+        for phase, (seconds, num_calls) in run(db, args.num, "bench").items():
+            rows[phase] = {"sqlite (s)": seconds, "db calls": num_calls, "remote est. (s)": seconds + num_calls * args.rtt}
+    if args.mongo_uri:
+        db = DBManager(args.mongo_uri, args.mongo_db, **kwargs)
+        for collection in (db.collection, db.collection_meta, db.collection_eval):
+            collection.delete_many({})
+        for phase, (seconds, _) in run(db, args.num, "bench").items():
+            rows[phase]["mongo (s)"] = seconds
+        db.client.drop_database(args.mongo_db)
+    df = pd.DataFrame(rows).T
+    df.loc["total"] = df.drop(index="plan (per exp)").sum()
+    df["db calls"] = df["db calls"].astype(int)
+    print(f"{args.num} conversations, write_behind={args.write_behind}")
+    print(df.to_string(float_format=lambda x: f"{x:.2f}"))
+
+if __name__ == "__main__":
+    main()
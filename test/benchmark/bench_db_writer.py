@@ -0,0 +1,73 @@
+""" benchmark: recording N conversations from W worker threads, one round trip per insert vs. the write-behind `DBWriter`
+    - the DB is simulated by collections with a fixed round-trip latency (+ a small per-doc cost)
+    - each conversation first spends `llm_time` seconds (the LLM calls of the simulation), then records its 21 docs
+    - "db ms/conv" is the time a worker spends in the DB calls, the part of the task time we want to remove
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_db_writer.py [--num 2000] [--workers 100] [--rtt 0.002] [--llm_time 0.1]
+"""
+import time, argparse, threading, concurrent.futures
+from flowagent.data.db_writer import DBWriter
+
+
+class SimulatedCollection:
+    def __init__(self, rtt: float, per_doc: float = 2e-6) -> None:
+        self.rtt, self.per_doc, self.num_docs, self.num_round_trips = rtt, per_doc, 0, 0
+        self._lock = threading.Lock()
+
+    def _round_trip(self, n: int) -> None:
+        time.sleep(self.rtt + self.per_doc * n)
+        with self._lock:
+            self.num_docs += n
+            self.num_round_trips += 1
+
+    def insert_one(self, doc): self._round_trip(1)
+    def insert_many(self, docs, ordered=True): self._round_trip(len(docs))
+
+class SimulatedDB(dict):
+    def __init__(self, rtt: float) -> None:
+        super().__init__(messages=SimulatedCollection(rtt), config=SimulatedCollection(rtt))
+
+
+def record_sync(db: SimulatedDB, msgs: list, config: dict) -> None:
+    """ `BaseController._record_to_db` without write-behind """
+    db["messages"].insert_many(msgs)
+    db["config"].insert_one(config)
+
+def run(num: int, workers: int, rtt: float, llm_time: float, write_behind: bool) -> tuple:
+    db = SimulatedDB(rtt)
+    writer = DBWriter(db, batch_size=500, flush_interval=0.5) if write_behind else None
+    def f_exec(i: int) -> float:
+        time.sleep(llm_time)
+        msgs, config = [{"conversation_id": i, "utterance_id": j} for j in range(20)], {"conversation_id": i}
+        start = time.perf_counter()
+        if writer is None:
+            record_sync(db, msgs, config)
+        else:
+            writer.insert("messages", msgs); writer.insert("config", [config]); writer.flush()
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        worker_time = sum(executor.map(f_exec, range(num)))
+    if writer is not None: writer.close()
+    total = time.perf_counter() - start
+    assert db["messages"].num_docs == 20 * num and db["config"].num_docs == num
+    return total, worker_time / num, db["messages"].num_round_trips + db["config"].num_round_trips, writer.get_stat() if writer else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=100)
+    parser.add_argument("--rtt", type=float, default=0.002)
+    parser.add_argument("--llm_time", type=float, default=0.1)
+    args = parser.parse_args()
+    print(f"{args.num} conversations x 21 docs, {args.workers} workers, rtt {args.rtt * 1000:.1f}ms, llm time {args.llm_time}s")
+    print(f"{'':>13} {'total (s)':>10} {'db ms/conv':>11} {'round trips':>12}")
+    for name, write_behind in [("sync", False), ("write-behind", True)]:
+        total, per_conv, round_trips, stat = run(args.num, args.workers, args.rtt, args.llm_time, write_behind)
+        print(f"{name:>13} {total:>10.2f} {per_conv * 1000:>11.3f} {round_trips:>12}")
+    print(f"write-behind batches: {stat['num_batches']}, avg size {stat['avg_batch_size']:.1f}, p95 flush {stat['p95_flush_latency'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+""" micro-benchmark: encode/decode round trip of messages, `dataclasses.asdict` & constructor vs. the message codec
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_message_codec.py [--num 100000]
+"""
+import gc, time, argparse, dataclasses
+from flowagent.data import Message, Role, encode_message, decode_message
+
+
+def make_messages(num: int):
+    msgs = []
+    for i in range(num):
+        if i % 4 == 3:
+            msgs.append(Message(
+                Role.BOT, f"<Call API> check_availability({{'date': '2024-01-{i % 28 + 1:02d}'}})", conversation_id="2024-01-01 00:00:00.000000",
+                utterance_id=i, prompt=f"prompt of utterance {i} " * 20, llm_response=f"Thought: ...\nAction: check_availability",
+                type="api", apis=[{"name": "check_availability", "params": {"date": f"2024-01-{i % 28 + 1:02d}", "party_size": 4}}],
+                llm_stat={"model": "gpt-4o", "num_calls": 1, "prompt_tokens": 1200, "completion_tokens": 30},
+            ))
+        else:
+            msgs.append(Message(
+                [Role.USER, Role.BOT, Role.SYSTEM][i % 3], f"utterance {i}, with some details about the booking",
+                conversation_id="2024-01-01 00:00:00.000000", utterance_id=i, type="normal",
+            ))
+    return msgs
+
+def legacy_encode(msg: Message) -> dict:
+    """ the previous `Message.to_dict` """
+    res = dataclasses.asdict(msg)
+    res["role"] = msg.role.rolename
+    return res
+
+def legacy_decode(d: dict) -> Message:
+    """ the previous `DBManager.query_messages_by_conversation_id` (linear scan of the roles) """
+    role = next(r for r in Role if r.rolename == d["role"].lower())
+    return Message(**{**d, "role": role})
+
+def timeit(fn, repeat: int = 3):
+    """ best of `repeat` runs (with a clean heap), and the result """
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        res = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num", type=int, default=100_000)
+    args = parser.parse_args()
+
+    msgs = make_messages(args.num)
+    t_enc0, docs0 = timeit(lambda: [legacy_encode(m) for m in msgs])
+    t_dec0, out0 = timeit(lambda: [legacy_decode(d) for d in docs0])
+    t_enc1, docs1 = timeit(lambda: [encode_message(m) for m in msgs])
+    t_dec1, out1 = timeit(lambda: [decode_message(d) for d in docs1])
+    assert out0 == out1 == msgs
+    print(f"{args.num} messages")
+    print(f"{'':>8} {'legacy (s)':>11} {'codec (s)':>10} {'speedup':>8}")
+    print(f"{'encode':>8} {t_enc0:>11.3f} {t_enc1:>10.3f} {t_enc0 / t_enc1:>7.1f}x")
+    print(f"{'decode':>8} {t_dec0:>11.3f} {t_dec1:>10.3f} {t_dec0 / t_dec1:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
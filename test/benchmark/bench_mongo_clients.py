@@ -0,0 +1,87 @@
+""" benchmark: a `MongoClient` per task (the old `DBManager.__init__`) vs. the shared `MongoClientRegistry`, at 200 workers
+    - the server is a local TCP listener which accepts & holds the connections (no MongoDB needed): the accepted connections
+      are the ones opened by the clients' monitors, before any query
+    - setup: the time to init the `DBManager` of a task
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_mongo_clients.py [--tasks 1000] [--workers 200]
+"""
+import time, socket, argparse, threading, concurrent.futures
+import pymongo
+from flowagent.data import DBManager, MongoClientRegistry
+
+
+class HoldingServer:
+    """ accepts the connections and never answers """
+    def __init__(self) -> None:
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(4096)
+        self.port = self.sock.getsockname()[1]
+        self.conns = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+
+    def close(self) -> None:
+        for conn in self.conns: conn.close()
+        self.sock.close()
+
+
+def old_db_manager(uri: str) -> None:
+    """ what `DBManager.__init__` did: a new client per instance """
+    client = pymongo.MongoClient(uri)
+    db = client["pdl"]
+    db["messages"], db["config"], db["evaluations"]
+    return client
+
+def run(tasks: int, workers: int, shared: bool) -> dict:
+    server = HoldingServer()
+    uri = f"mongodb://127.0.0.1:{server.port}/?connectTimeoutMS=60000"
+    threads_before = threading.active_count()
+    clients = []
+    def f_exec(i: int) -> float:
+        start = time.perf_counter()
+        if shared:
+            DBManager(uri, "pdl", ensure_indexes=False)
+        else:
+            clients.append(old_db_manager(uri))
+        return time.perf_counter() - start
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        setup_times = sorted(executor.map(f_exec, range(tasks)))
+    time.sleep(1.0)     # let the monitors connect
+    res = {
+        "clients": len(clients) if not shared else len(MongoClientRegistry.get_stats()),
+        "connections": len(server.conns),
+        "threads": threading.active_count() - threads_before,
+        "setup_ms_avg": 1000 * sum(setup_times) / tasks,
+        "setup_ms_p95": 1000 * setup_times[int(0.95 * tasks) - 1],
+    }
+    for client in clients: client.close()
+    MongoClientRegistry.clear()
+    server.close()
+    for _ in range(100):       # wait for the monitor threads to exit
+        if threading.active_count() <= threads_before: break
+        time.sleep(0.1)
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=200)
+    args = parser.parse_args()
+    print(f"{args.tasks} tasks, {args.workers} workers")
+    print(f"{'':>18} {'clients':>8} {'connections':>12} {'threads':>8} {'setup ms avg':>13} {'setup ms p95':>13}")
+    for name, shared in [("client per task", False), ("shared client", True)]:
+        r = run(args.tasks, args.workers, shared)
+        print(f"{name:>18} {r['clients']:>8} {r['connections']:>12} {r['threads']:>8} {r['setup_ms_avg']:>13.3f} {r['setup_ms_p95']:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
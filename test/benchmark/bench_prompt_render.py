@@ -0,0 +1,52 @@
+""" micro-benchmark: per-turn cost of rendering the bot prompt, full render vs. memoised static sections
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_prompt_render.py [--turns 40] [--repeat 200]
+"""
+import time, argparse
+from flowagent.data import Config, Workflow, Conversation, Message, Role
+from utils.jinja_templates import jinja_render, jinja_render_static, jinja_clear_static
+
+
+def render_full(workflow: Workflow, conv: Conversation) -> str:
+    """ the previous `PDLBot._gen_prompt`: everything rendered from scratch """
+    return jinja_render(
+        "flowagent/bot_pdl.jinja",
+        api_infos=workflow.toolbox, PDL=workflow.pdl.to_str_wo_api(),
+        conversation=conv.to_str(), current_state="Current time: 2024-01-01 00:00:00",
+    )
+
+def render_static(workflow: Workflow, conv: Conversation) -> str:
+    return jinja_render_static(
+        "flowagent/bot_pdl.jinja", key=workflow.key,
+        static=lambda: dict(api_infos=workflow.toolbox, PDL=workflow.pdl.to_str_wo_api()),
+        conversation=conv.to_str(), current_state="Current time: 2024-01-01 00:00:00",
+    )
+
+def timeit(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat): fn()
+    return (time.perf_counter() - start) / repeat * 1e6     # us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    cfg = Config(workflow_dataset="sample", workflow_type="pdl", workflow_id="000")
+    workflow = Workflow(cfg)
+    jinja_clear_static()
+    conv = Conversation()
+    print(f"{'turn':>5} {'#chars':>8} {'full (us)':>10} {'static (us)':>12} {'speedup':>8}")
+    for turn in range(1, args.turns + 1):
+        conv.add_message(Message(Role.USER, f"user query of turn {turn}, with some details about the booking"))
+        conv.add_message(Message(Role.BOT, f"bot response of turn {turn}, asking for the next slot value"))
+        assert render_full(workflow, conv) == render_static(workflow, conv)
+        if turn == 1 or turn % 5 == 0:
+            t_full, t_static = timeit(lambda: render_full(workflow, conv), args.repeat), timeit(lambda: render_static(workflow, conv), args.repeat)
+            print(f"{turn:>5} {len(render_full(workflow, conv)):>8} {t_full:>10.1f} {t_static:>12.1f} {t_full / t_static:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
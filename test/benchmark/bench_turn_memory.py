@@ -0,0 +1,58 @@
+""" memory benchmark: a turn-mode (teacher forcing) run over long reference conversations, deepcopy vs. shared messages
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_turn_memory.py [--conversations 500] [--turns 40]
+"""
+import copy, argparse, tracemalloc
+from flowagent.data import Conversation, Message, Role
+
+
+def make_reference(turns: int) -> Conversation:
+    """ a reference conversation with an API call & response in every other turn """
+    o = []
+    for i in range(turns):
+        o.append({"role": "user", "content": f"user query of turn {i}, with some details about the booking"})
+        if i % 2:
+            o.append({"role": "bot", "content": f"<Call API> check_availability({{'date': '2024-01-{i:02d}'}})",
+                      "apis": [{"name": "check_availability", "params": {"date": f"2024-01-{i:02d}", "party_size": 4}}]})
+            o.append({"role": "system", "content": f"<API response> {{'available': true, 'slots': ['18:00', '19:00']}}"})
+        o.append({"role": "bot", "content": f"bot response of turn {i}, asking for the next slot value"})
+    return Conversation.load_from_json(o)
+
+def teacher_forcing(ref_conv: Conversation, copy_fn) -> Conversation:
+    """ `FlowagentController.conversation_teacher_forcing` with a fake bot """
+    conv = Conversation()
+    for msg in ref_conv:
+        if msg.role != Role.BOT:
+            conv.add_message(copy_fn(msg))
+        else:
+            conv.add_message(Message(Role.BOT, "predicted", prompt="<prompt>", llm_response="<llm response>", llm_stat={"num_calls": 1}))
+            conv.substitue_message(copy_fn(msg), old_to_prediction=True, idx=-1)
+    return conv
+
+def measure(refs, copy_fn) -> float:
+    """ MB allocated by the simulated conversations (kept alive, as by the judge) """
+    tracemalloc.start()
+    convs = [teacher_forcing(ref, copy_fn) for ref in refs]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(convs) == len(refs)
+    return current / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=40)
+    args = parser.parse_args()
+
+    refs = [make_reference(args.turns) for _ in range(args.conversations)]
+    _strip = lambda conv: [{**m, "conversation_id": None} for m in conv.to_list()]
+    assert _strip(teacher_forcing(refs[0], copy.deepcopy)) == _strip(teacher_forcing(refs[0], Message.copy))
+    m_deep, m_shared = measure(refs, copy.deepcopy), measure(refs, Message.copy)
+    print(f"{args.conversations} conversations x {len(refs[0])} messages")
+    print(f"{'deepcopy (MB)':>14} {'shared (MB)':>12} {'reduction':>10}")
+    print(f"{m_deep:>14.1f} {m_shared:>12.1f} {1 - m_shared / m_deep:>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
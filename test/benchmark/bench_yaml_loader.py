@@ -0,0 +1,60 @@
+""" benchmark: parsing the yaml files of the sample dataset & a synthetic one, the pure-python loaders vs. `utils.yaml_loader`
+    - cold: the C loaders only (distinct contents, nothing cached)
+    - warm: the same contents parsed again, e.g. one workflow loaded by several runs (the content-hash cache)
+NOTE: the cache keeps the last 1024 contents, larger `--num` (x3 files) measures a thrashing cache
+
+USAGE: PYTHONPATH=src python test/benchmark/bench_yaml_loader.py [--num 300] [--repeat 5]
+"""
+import os, time, argparse
+import yaml, jinja2
+from flowagent.data import DataManager
+from utils.yaml_loader import yaml_load, render_env_template, yaml_clear_cache
+
+FN_default_config = DataManager.DIR_data_root.parent / "src/flowagent/configs/default.yaml"
+
+
+def sample_files() -> list:
+    """ (content, full) of the sample dataset: the PDL files are parsed with the full loader """
+    fns = sorted((DataManager.DIR_data_root / "sample").rglob("*.yaml")) + sorted((DataManager.DIR_data_root / "meta").rglob("*.yaml"))
+    return [(fn.read_text().strip(), fn.parent.name == "pdl") for fn in fns]
+
+def synthetic_files(num: int) -> list:
+    """ `num` distinct variants of the sample files """
+    return [(f"# {i}\n{s}", full) for i in range(num) for s, full in sample_files()]
+
+def old_load(s: str, full: bool):
+    return yaml.load(s, Loader=yaml.FullLoader) if full else yaml.safe_load(s)
+
+def bench(fn, files: list, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for s, full in files: fn(s, full)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(f"libyaml: {yaml.__with_libyaml__}")
+    print(f"{'files':>10} {'#':>6} {'old (s)':>8} {'cold (s)':>9} {'warm (s)':>9} {'cold speedup':>13} {'warm speedup':>13}")
+    for name, files in [("sample", sample_files()), ("synthetic", synthetic_files(args.num))]:
+        t_old = bench(old_load, files, args.repeat) / args.repeat
+        yaml_clear_cache()
+        t_cold = bench(yaml_load, files, 1)
+        t_warm = bench(yaml_load, files, args.repeat) / args.repeat
+        print(f"{name:>10} {len(files):>6} {t_old:>8.3f} {t_cold:>9.3f} {t_warm:>9.3f} {t_old / t_cold:>12.1f}x {t_old / t_warm:>12.1f}x")
+
+    content, n = FN_default_config.read_text(), 1000
+    start = time.perf_counter()
+    for _ in range(n): yaml.safe_load(jinja2.Template(content).render(os.environ))
+    t_old = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n): yaml_load(render_env_template(content))
+    t_new = time.perf_counter() - start
+    print(f"Config.from_yaml (default.yaml) x{n}: old {t_old:.3f}s, new {t_new:.3f}s ({t_old / t_new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+""" fixtures shared by all the tests """
+import pytest
+from openai.types.chat import ChatCompletion
+
+
+def _make_completion(content: str, model: str = "gpt-4o", prompt_tokens: int = 10, completion_tokens: int = 2) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+
+@pytest.fixture
+def make_completion():
+    """ make_completion(content, model="gpt-4o", prompt_tokens=10, completion_tokens=2) -> a ChatCompletion (the fake responses) """
+    return _make_completion
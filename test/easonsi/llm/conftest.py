@@ -0,0 +1,51 @@
+""" fakes of the openai client, shared by the tests of `easonsi.llm`. The fixtures are factories """
+import time, asyncio
+from typing import Callable
+from types import SimpleNamespace
+import httpx, openai
+import pytest
+from openai.types.chat import ChatCompletion
+
+
+class FakeCompletions:
+    """ `create` answers f"{name}: {the last message}" after `delay` seconds. The first `n_fail` calls fail with a 500 """
+    def __init__(self, make_completion: Callable[..., ChatCompletion], delay: float = 0.0, n_fail: int = 0, name: str = "echo"):
+        self.make_completion = make_completion
+        self.delay, self.n_fail, self.name = delay, n_fail, name
+        self.num_calls = self.in_flight = self.max_in_flight = 0
+
+    def _start(self) -> None:
+        self.num_calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _finish(self, messages, model: str) -> ChatCompletion:
+        self.in_flight -= 1
+        if self.n_fail > 0:
+            self.n_fail -= 1
+            request = httpx.Request("POST", "https://api.test/v1/chat/completions")
+            raise openai.InternalServerError("boom", response=httpx.Response(500, request=request), body=None)
+        return self.make_completion(f"{self.name}: {messages[-1]['content']}", model=model)
+
+    def create(self, messages, **kwargs):
+        self._start()
+        time.sleep(self.delay)
+        return self._finish(messages, kwargs["model"])
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    async def create(self, messages, **kwargs):
+        self._start()
+        await asyncio.sleep(self.delay)
+        return self._finish(messages, kwargs["model"])
+
+
+@pytest.fixture
+def fake_client(make_completion):
+    """ fake_client(is_async=False, **kwargs) -> an openai-like client, served by `FakeCompletions(**kwargs)`
+    the counters are in `client.chat.completions`
+    """
+    def make(is_async: bool = False, **kwargs) -> SimpleNamespace:
+        completions = (FakeAsyncCompletions if is_async else FakeCompletions)(make_completion, **kwargs)
+        return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return make
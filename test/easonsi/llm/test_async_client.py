@@ -0,0 +1,49 @@
+import asyncio, time
+import openai
+import pytest
+from easonsi.llm.cache import LLMCache
+from easonsi.llm.openai_client import AsyncOpenAIClient
+
+
+@pytest.fixture
+def make_client(fake_client):
+    def make(cache: LLMCache = None, **kwargs) -> AsyncOpenAIClient:
+        client = AsyncOpenAIClient(model_name="gpt-4o", api_key="sk-test", cache=cache, async_client=fake_client(is_async=True, **kwargs))
+        client.backoff_factor = 0.01
+        return client
+    return make
+
+
+def test_query_one_async(make_client):
+    client = make_client()
+    res, model, usage = asyncio.run(client.query_one_async("hi", return_usage=True))
+    assert (res, model, usage["total_tokens"]) == ("echo: hi", "gpt-4o", 12)
+
+def test_queries_run_concurrently_on_one_loop(make_client):
+    client = make_client(delay=0.2)
+    async def run():
+        return await asyncio.gather(*[client.query_one_async(f"q{i}") for i in range(20)])
+    start = time.perf_counter()
+    assert asyncio.run(run()) == [f"echo: q{i}" for i in range(20)]
+    assert time.perf_counter() - start < 1.0
+    assert client.async_client.chat.completions.max_in_flight == 20
+
+def test_retries_transient_errors(make_client):
+    client = make_client(n_fail=2)
+    assert asyncio.run(client.query_one_async("hi")) == "echo: hi"
+    assert client.async_client.chat.completions.num_calls == 3
+
+def test_raises_after_the_retry_budget(make_client):
+    client = make_client(n_fail=100)
+    with pytest.raises(Exception, match="after 3 attempts") as e:
+        asyncio.run(client.query_one_async("hi"))
+    assert isinstance(e.value.__cause__, openai.InternalServerError)
+    assert client.async_client.chat.completions.num_calls == client.retries
+
+def test_identical_requests_are_coalesced(tmp_path, make_client):
+    client = make_client(cache=LLMCache(tmp_path / "cache.sqlite"), delay=0.1)
+    async def run():
+        return await asyncio.gather(*[client.query_one_async("same") for _ in range(8)])
+    assert asyncio.run(run()) == ["echo: same"] * 8
+    assert client.async_client.chat.completions.num_calls == 1
+    assert asyncio.run(client.query_one_async("same")) == "echo: same" and client.async_client.chat.completions.num_calls == 1
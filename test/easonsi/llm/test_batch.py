@@ -0,0 +1,18 @@
+import json
+from easonsi.llm.batch import BatchRunner, LocalBatchServer, make_batch_line
+from easonsi.llm.openai_client import OpenAIClient
+
+
+def test_local_batch_roundtrip(tmp_path, fake_client):
+    llm = OpenAIClient(model_name="gpt-4o", api_key="sk-test")
+    llm.client = fake_client()
+    runner = BatchRunner(LocalBatchServer(llm, max_workers=4).make_client(), poll_interval=0.01)
+    lines = [
+        make_batch_line(f"req-{i}", [{"role": "user", "content": f"q{i}"}], model="gpt-4o", max_tokens=16, **llm.extra_body)
+        for i in range(10)
+    ]
+    results = runner.run(lines, fn=tmp_path / "batch.jsonl", verbose=False)
+
+    assert json.loads((tmp_path / "batch.jsonl").read_text().splitlines()[0])["url"] == "/v1/chat/completions"
+    assert {k: v.choices[0].message.content for k, v in results.items()} == {f"req-{i}": f"echo: q{i}" for i in range(10)}
+    assert llm.client.chat.completions.num_calls == 10
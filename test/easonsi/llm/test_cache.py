@@ -0,0 +1,93 @@
+import threading, time, asyncio, sqlite3
+import pytest
+from easonsi.llm.cache import LLMCache
+from easonsi.llm.openai_client import OpenAIClient
+
+
+@pytest.fixture
+def make_client(tmp_path, fake_client):
+    def make(delay: float = 0.0) -> OpenAIClient:
+        client = OpenAIClient(model_name="gpt-4o", api_key="sk-test", cache=LLMCache(tmp_path / "cache.sqlite"))
+        client.client = fake_client(delay=delay)
+        return client
+    return make
+
+
+def test_query_one_hits_cache(make_client):
+    client = make_client()
+    assert client.query_one("hi", temperature=0) == "echo: hi"
+    res, model, usage = client.query_one("hi", temperature=0, return_usage=True)
+    assert (res, model, usage["total_tokens"]) == ("echo: hi", "gpt-4o", 0)     # no tokens spent
+    assert client.client.chat.completions.num_calls == 1
+    # different sampling parameters -> different key
+    client.query_one("hi", temperature=0.7)
+    assert client.client.chat.completions.num_calls == 2
+    assert client.cache.hits == 1
+
+
+def test_concurrent_identical_requests_are_coalesced(make_client):
+    client = make_client(delay=0.2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.query_one("same"))) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert results == ["echo: same"] * 8
+    assert client.client.chat.completions.num_calls == 1
+    assert (client.cache.misses, client.cache.hits, client.cache.coalesced) == (1, 7, 7)
+
+
+def test_created_once_when_the_owner_finishes_first(tmp_path):
+    """ the callers arriving after the owner released the key read the cache, they do not compute it again """
+    cache, calls = LLMCache(tmp_path / "cache.sqlite"), []
+    for i in range(20):
+        barrier = threading.Barrier(16)
+        def run():
+            barrier.wait()
+            cache.get_or_create(f"k{i}", lambda: calls.append(i) or "v")
+        threads = [threading.Thread(target=run) for _ in range(16)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    assert calls == list(range(20))
+    assert (cache.misses, cache.hits) == (20, 20 * 15)
+
+
+def test_aget_or_create_counts_the_coalesced_callers_as_hits(tmp_path):
+    cache = LLMCache(tmp_path / "cache.sqlite")
+    async def create():
+        await asyncio.sleep(0.05)
+        return "v"
+    async def run():
+        return await asyncio.gather(*[cache.aget_or_create("k", create) for _ in range(5)])
+    assert asyncio.run(run()) == ["v"] * 5
+    assert (cache.misses, cache.hits, cache.coalesced) == (1, 4, 4)
+
+
+def test_failed_cache_write_still_resolves_the_waiters(tmp_path, monkeypatch, capsys):
+    cache, started = LLMCache(tmp_path / "cache.sqlite"), threading.Event()
+    def fail(key, value):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(cache, "set", fail)
+    def create():
+        started.set()
+        time.sleep(0.1)
+        return "v"
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_or_create("k", create)))
+    owner.start()
+    started.wait()
+    waiter = threading.Thread(target=lambda: results.append(cache.get_or_create("k", lambda: "late")))
+    waiter.start()
+    owner.join(timeout=2); waiter.join(timeout=2)
+    assert results == ["v", "v"] and cache.coalesced == 1
+    assert "failed to write" in capsys.readouterr().out
+    assert cache.get_or_create("k", lambda: "again") == "again" and not cache._inflight     # not cached, not stuck
+
+def test_lru_eviction(tmp_path):
+    cache = LLMCache(tmp_path / "cache.sqlite", max_size_mb=2.5 / 1024)   # 2.5KB
+    for i in range(3):
+        cache.set(f"k{i}", "x" * 1024)
+        time.sleep(0.01)
+    assert cache.get("k0") is None and cache.evictions == 1
+    cache.get("k1")     # k1 is now the most recent one
+    cache.set("k3", "x" * 1024)
+    assert cache.get("k2") is None and cache.get("k1") is not None
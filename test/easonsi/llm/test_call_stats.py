@@ -0,0 +1,30 @@
+from easonsi.llm.cache import LLMCache
+from easonsi.llm.call_stats import collect_call_stats, merge_call_stats
+from easonsi.llm.hedging import Hedger
+from easonsi.llm.openai_client import OpenAIClient
+
+
+def test_stats_of_retried_and_cached_calls(tmp_path, fake_client):
+    client = OpenAIClient(model_name="gpt-4o", api_key="sk-test", cache=LLMCache(tmp_path / "cache.sqlite"))
+    client.backoff_factor = 0
+    client.client = fake_client(n_fail=2)
+    with collect_call_stats() as stats:
+        client.query_one("hi")
+        client.query_one("hi")      # cache hit
+    assert [(s["retries"], s["num_cache_hits"], s["prompt_tokens"]) for s in stats] == [(2, 0, 10), (0, 1, 0)]
+    merged = merge_call_stats(stats)
+    assert (merged["num_calls"], merged["retries"], merged["num_cache_hits"], merged["completion_tokens"]) == (2, 2, 1, 2)
+    # calls outside of a collector are not recorded
+    client.query_one("hi")
+    assert len(stats) == 2 and merge_call_stats([]) is None
+
+def test_hedges_are_counted(fake_client):
+    hedger = Hedger(quantile=0.5, max_ratio=1.0, min_samples=1)
+    hedger.record(0.01)
+    client = OpenAIClient(model_name="gpt-4o", api_key="sk-test", hedger=hedger)
+    client.client = fake_client(delay=0.05)     # every call is slower than the p50: hedged, the loser is not awaited
+    with collect_call_stats() as stats:
+        client.query_one("hi")
+    (stat, ) = stats
+    assert (stat["num_hedges"], stat["prompt_tokens"]) == (1, 10)
+    assert merge_call_stats(stats)["num_hedges"] == 1
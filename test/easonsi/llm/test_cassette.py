@@ -0,0 +1,31 @@
+import time, asyncio
+import pytest
+from easonsi.llm.cassette import Cassette, CassetteOpenAIClient, CassetteMissError
+
+
+@pytest.fixture
+def make_client(fake_client):
+    def make(fn, mode, **kwargs) -> CassetteOpenAIClient:
+        client = CassetteOpenAIClient(model_name="gpt-4o", api_key="sk-test", cassette=Cassette(fn), mode=mode, **kwargs)
+        client.client = fake_client()
+        return client
+    return make
+
+
+def test_record_then_replay(tmp_path, make_client):
+    fn = tmp_path / "cassette.jsonl"
+    recorder = make_client(fn, "record")
+    recorded = [recorder.query_one(f"q{i} @ 2024-09-19 15:20:53", return_usage=True) for i in range(3)]
+    assert recorder.client.chat.completions.num_calls == 3
+
+    player = make_client(fn, "replay", latency=0.05)
+    start = time.perf_counter()
+    # the timestamps in the prompts are masked in the fingerprint
+    replayed = [player.query_one(f"q{i} @ 2025-01-01 00:00:00", return_usage=True) for i in range(3)]
+    assert time.perf_counter() - start >= 3 * 0.05
+    assert replayed == recorded and player.client.chat.completions.num_calls == 0
+    assert asyncio.run(player.query_one_async("q0 @ 2025-01-01 00:00:00")) == recorded[0][0]
+    assert "".join(player.query_one_stream_generator("q1 @ 2025-01-01 00:00:00")) == recorded[1][0]
+
+    with pytest.raises(CassetteMissError):
+        player.query_one("not recorded")
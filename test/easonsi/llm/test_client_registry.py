@@ -0,0 +1,71 @@
+import json, asyncio, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from easonsi.llm.client_registry import LLMClientRegistry
+from easonsi.llm.openai_client import OpenAIClient, AsyncOpenAIClient
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        data = json.dumps({
+            "id": "x", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "pong"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    LLMClientRegistry.clear()
+
+
+def test_clients_share_one_pool(base_url):
+    shared = LLMClientRegistry.get_openai(base_url, "sk-test", "gpt-4o", max_connections=4)
+    assert LLMClientRegistry.get_openai(base_url, "sk-test", "gpt-4o") is shared
+    assert LLMClientRegistry.get_openai(base_url, "sk-test", "gpt-4o-mini") is not shared
+
+    clients = [OpenAIClient("gpt-4o", base_url=base_url, api_key="sk-test", client=shared) for _ in range(8)]
+    threads = [threading.Thread(target=c.query_one, args=("ping",)) for c in clients]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    stat = LLMClientRegistry.get_stats()[f"gpt-4o@{base_url}"]
+    assert stat["num_requests"] >= 8 and stat["in_flight"] == 0      # >= 8: the openai client may retry on a reset
+    assert 1 <= stat["open_connections"] <= 4
+    assert stat["idle_connections"] <= stat["open_connections"]
+    assert stat["avg_wait"] >= 0 and stat["queued_requests"] == 0
+
+
+def test_async_clients_per_event_loop(base_url):
+    """ the connections of an async client belong to its event loop: a second `asyncio.run` must not reuse them """
+    async def ping():
+        client = LLMClientRegistry.get_openai(base_url, "sk-test", "gpt-4o", is_async=True)
+        res = await client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "ping"}])
+        return client, res.choices[0].message.content
+
+    client1, content1 = asyncio.run(ping())
+    client2, content2 = asyncio.run(ping())      # raised APIConnectionError (event loop is closed) with one client per key
+    assert content1 == content2 == "pong" and client1 is not client2
+    assert len([k for k in LLMClientRegistry.get_stats() if "(async" in k]) == 1     # the clients of the closed loops are dropped
+
+def test_async_openai_client_across_event_loops(base_url):
+    client = AsyncOpenAIClient("gpt-4o", base_url=base_url, api_key="sk-test", client=LLMClientRegistry.get_openai(base_url, "sk-test", "gpt-4o"))
+    for _ in range(2):
+        assert asyncio.run(client.query_one_async("ping")) == "pong"
+    stat = next(v for k, v in LLMClientRegistry.get_stats().items() if "(async" in k)
+    assert stat["num_requests"] == 1      # no retry on a stale connection
@@ -0,0 +1,104 @@
+import time, asyncio, itertools, threading
+from types import SimpleNamespace
+import pytest
+from easonsi.llm.hedging import Hedger
+from easonsi.llm.openai_client import OpenAIClient
+
+
+def warm_up(hedger: Hedger, latency: float = 0.01, n: int = 100) -> None:
+    for _ in range(n):
+        hedger.record(latency)
+
+
+def test_slow_call_is_hedged():
+    hedger = Hedger(quantile=0.95, max_ratio=1.0, min_samples=5)
+    warm_up(hedger)
+    calls = itertools.count()
+    def fn():
+        i = next(calls)
+        time.sleep(0.5 if i == 0 else 0.01)     # the first call is a straggler
+        return i
+    start = time.perf_counter()
+    assert hedger.run(fn) == 1
+    assert time.perf_counter() - start < 0.3
+    assert (hedger.num_hedges, hedger.num_wins) == (1, 1)
+
+
+def test_hedges_are_capped():
+    hedger = Hedger(quantile=0.5, max_ratio=0.25, min_samples=5)
+    warm_up(hedger, latency=0.001)
+    for _ in range(8):
+        hedger.run(lambda: time.sleep(0.01))
+    assert hedger.num_requests == 8 and hedger.num_hedges == 2
+
+
+def test_async_loser_is_cancelled():
+    hedger = Hedger(quantile=0.95, max_ratio=1.0, min_samples=5)
+    warm_up(hedger)
+    calls, cancelled = itertools.count(), []
+    async def fn():
+        i = next(calls)
+        try:
+            await asyncio.sleep(0.5 if i == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(i)
+            raise
+        return i
+    async def main():
+        res = await hedger.arun(fn)
+        await asyncio.sleep(0)
+        return res
+    assert asyncio.run(main()) == 1
+    assert cancelled == [0] and hedger.num_wins == 1
+
+
+def test_unhedged_calls_run_on_the_callers_thread():
+    hedger = Hedger(quantile=0.95, max_ratio=0.0, min_samples=5)
+    assert hedger.run(threading.get_ident) == threading.get_ident()     # warming up
+    warm_up(hedger)
+    assert hedger.run(threading.get_ident) == threading.get_ident()     # no hedge budget
+
+
+class StragglerCompletions:
+    """ the first request is slow """
+    def __init__(self, make_completion):
+        self.make_completion = make_completion
+        self.calls = itertools.count()
+
+    def create(self, messages, **kwargs):
+        i = next(self.calls)
+        time.sleep(0.5 if i == 0 else 0.01)
+        return self.make_completion(f"call {i}", model=kwargs["model"])
+
+
+class SlowLimiter:
+    def reserve(self, n_tokens: int = 0) -> float:
+        return 0.2
+
+    def record_usage(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def make_client(make_completion):
+    def make(rate_limiter=None) -> OpenAIClient:
+        hedger = Hedger(quantile=0.95, max_ratio=1.0, min_samples=5)
+        warm_up(hedger, latency=0.05)
+        client = OpenAIClient(model_name="gpt-4o", api_key="sk-test", rate_limiter=rate_limiter, hedger=hedger)
+        client.client = SimpleNamespace(chat=SimpleNamespace(completions=StragglerCompletions(make_completion)))
+        return client
+    return make
+
+
+def test_client_hedges_the_http_request(make_client):
+    client = make_client()
+    start = time.perf_counter()
+    assert client.query_one("hi") == "call 1"
+    assert time.perf_counter() - start < 0.3 and client.hedger.num_wins == 1
+
+
+def test_limiter_wait_is_not_hedged(make_client):
+    client = make_client(rate_limiter=SlowLimiter())
+    client.client.chat.completions.calls = itertools.count(1)      # no straggler
+    assert client.query_one("hi") == "call 1"
+    assert client.hedger.num_hedges == 0
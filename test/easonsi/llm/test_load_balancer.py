@@ -0,0 +1,55 @@
+import time, asyncio
+from types import SimpleNamespace
+import pytest
+from easonsi.llm.load_balancer import Endpoint, EndpointPool, CircuitBreaker, BalancedOpenAIClient
+
+
+class FakeEndpoint(Endpoint):
+    """ endpoint with a fake openai client (`fake_client`), failing with a 500 while `down` """
+    def __init__(self, name: str, client, weight: float = 1.0, recovery_time: float = 30.0):
+        super().__init__("gpt-4o", f"http://{name}/v1", "sk-test", weight=weight, name=name,
+                         breaker=CircuitBreaker(failure_threshold=2, recovery_time=recovery_time))
+        self._client, self.completions = client, client.chat.completions
+        async def acreate(**kwargs): return self.completions.create(**kwargs)
+        self._async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=acreate)))
+
+    @property
+    def client(self): return self._client
+
+    @property
+    def async_client(self): return self._async_client
+
+    @property
+    def down(self) -> bool: return self.completions.n_fail > 0
+
+    @down.setter
+    def down(self, down: bool): self.completions.n_fail = 10**9 if down else 0
+
+    @property
+    def num_calls(self) -> int: return self.completions.num_calls
+
+
+@pytest.fixture
+def make_endpoint(fake_client):
+    return lambda name, **kwargs: FakeEndpoint(name, fake_client(name=name), **kwargs)
+
+
+def test_least_outstanding_with_weights(make_endpoint):
+    a, b = make_endpoint("a", weight=1), make_endpoint("b", weight=2)
+    pool = EndpointPool([a, b])
+    picked = [pool.acquire().name for _ in range(6)]      # none released: outstanding requests pile up
+    assert picked.count("b") == 4 and picked.count("a") == 2
+    assert (a.in_flight, b.in_flight) == (2, 4)
+
+
+def test_failover_and_recovery(make_endpoint):
+    a, b = make_endpoint("a", recovery_time=0.1), make_endpoint("b", recovery_time=0.1)
+    client = BalancedOpenAIClient(model_name="gpt-4o", pool=EndpointPool([a, b]))
+    a.down = True
+    assert all(client.query_one(f"q{i}").startswith("b:") for i in range(4))
+    assert a.breaker.state == "open" and a.num_calls == 2       # taken out after 2 failures
+    # half-open probe after the recovery time
+    a.down = False
+    time.sleep(0.15)
+    asyncio.run(client.query_one_async("probe"))
+    assert a.breaker.state == "closed" and a.num_calls == 3
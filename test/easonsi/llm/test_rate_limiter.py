@@ -0,0 +1,56 @@
+import time
+from types import SimpleNamespace
+import httpx, openai
+from easonsi.llm.rate_limiter import RateLimiter, parse_retry_after
+from easonsi.llm.openai_client import OpenAIClient
+
+
+def make_rate_limit_error(retry_after: str) -> openai.RateLimitError:
+    request = httpx.Request("POST", "http://test/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class RateLimitedCompletions:
+    """ fail with 429 for the first `n_limited` calls """
+    def __init__(self, n_limited: int, make_completion):
+        self.n_limited, self.make_completion = n_limited, make_completion
+        self.num_calls = 0
+
+    def create(self, messages, **kwargs):
+        self.num_calls += 1
+        if self.num_calls <= self.n_limited:
+            raise make_rate_limit_error("0.05")
+        return self.make_completion("ok")
+
+
+def test_reservations_queue_in_order():
+    limiter = RateLimiter(rpm=60)               # 1 request/s after the burst of 60
+    waits = [limiter.reserve() for _ in range(63)]
+    assert waits[:60] == [0.0] * 60
+    assert 0.9 < waits[60] < waits[61] < waits[62] < 3.1
+
+
+def test_token_budget_and_usage_correction():
+    limiter = RateLimiter(tpm=600)              # 10 tokens/s
+    assert limiter.reserve(600) == 0.0
+    assert limiter.reserve(100) > 9
+    limiter.record_usage(100, 0)                # the request used fewer tokens than estimated
+    assert limiter.reserve(50) < 6
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(httpx.Headers({"retry-after": "2"})) == 2.0
+    assert parse_retry_after(httpx.Headers({"retry-after-ms": "250"})) == 0.25
+    assert parse_retry_after(httpx.Headers({})) is None
+
+
+def test_429s_do_not_use_up_the_retry_budget(make_completion):
+    limiter = RateLimiter()
+    client = OpenAIClient(model_name="gpt-4o", api_key="sk-test", rate_limiter=limiter)
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=RateLimitedCompletions(n_limited=5, make_completion=make_completion)))
+    start = time.perf_counter()
+    assert client.query_one("hi") == "ok"
+    assert client.client.chat.completions.num_calls == 6 > client.retries
+    assert limiter.num_rate_limited == 5
+    assert time.perf_counter() - start >= 5 * 0.05     # honoured Retry-After
@@ -0,0 +1,131 @@
+import dataclasses
+import pytest
+from flowagent.data import Conversation, Message, Role, APICall, decode_message
+
+
+def full_render(conv: Conversation) -> str:
+    return "\n".join(msg.to_str() for msg in conv.msgs)
+
+
+def make_conversation(n: int) -> Conversation:
+    conv = Conversation()
+    for i in range(n):
+        conv.add_message(Message([Role.USER, Role.BOT, Role.SYSTEM][i % 3], f"message {i}"))
+    return conv
+
+
+def test_rendering_follows_appends_and_prefixes():
+    conv = Conversation()
+    assert conv.to_str() == ""
+    for i in range(1, 8):
+        conv.add_message(Message(Role.USER if i % 2 else Role.BOT, f"turn {i}\nsecond line"))
+        assert conv.to_str() == full_render(conv)
+    for i in range(len(conv) + 1):
+        assert conv[:i].to_str() == full_render(conv[:i])
+    assert conv[2:5].to_str() == full_render(conv[2:5]) and conv[::2].to_str() == full_render(conv[::2])
+    # a prefix can be extended on its own
+    prefix = conv[:3]
+    prefix.add_message(Message(Role.BOT, "another"))
+    assert prefix.to_str() == full_render(prefix) and conv.to_str() == full_render(conv)
+
+
+def test_rendering_follows_substitutions_and_concatenation():
+    conv = make_conversation(6)
+    conv.to_str()
+    conv.substitue_message(Message(Role.BOT, "ground truth"), idx=2)
+    assert conv.to_str() == full_render(conv) and "[BOT] ground truth" in conv.to_str()
+    conv.substitue_message(Message(Role.USER, "last"))
+    assert conv.to_str() == full_render(conv)
+
+    conv = conv + make_conversation(3)
+    assert conv.to_str() == full_render(conv)
+    conv = conv + [Message(Role.SYSTEM, "extra")]
+    assert conv.to_str() == full_render(conv)
+    # in-place edits of the list
+    conv.msgs.pop()
+    conv.msgs.append(Message(Role.USER, "replaced"))
+    assert conv.to_str() == full_render(conv)
+    assert conv.copy().to_str() == conv.to_str()
+
+
+def test_load_from_str_roundtrip():
+    conv = make_conversation(5)
+    conv.substitue_message(Message(Role.BOT, "multi\nline"), idx=1)
+    loaded = Conversation.load_from_str(conv.to_str())
+    assert loaded.to_str() == conv.to_str() == full_render(loaded)
+
+
+def test_copy_on_write():
+    conv = make_conversation(4)
+    forked = conv.copy()
+    assert forked._msgs is conv._msgs and forked[1] is conv[1]     # shared until modified
+    forked.add_message(Message(Role.BOT, "forked"))
+    forked.substitue_message(Message(Role.USER, "replaced"), idx=0)
+    assert len(conv) == 4 and conv[0].content == "message 0"
+    assert conv.to_str() == full_render(conv) and forked.to_str() == full_render(forked)
+    # the original can still be extended independently
+    conv.add_message(Message(Role.USER, "original"))
+    assert len(forked) == 5 and forked[-1].content == "forked" and conv.to_str() == full_render(conv)
+
+
+def test_message_copy_shares_values():
+    msg = Message(Role.BOT, "<Call API> check({})", apis=[{"name": "check", "params": {"a": 1}}], llm_stat={"num_calls": 1})
+    copied = msg.copy()
+    copied.utterance_id = 3
+    assert msg.utterance_id is None and copied.apis is msg.apis and copied.to_dict() == {**msg.to_dict(), "utterance_id": 3}
+
+
+def test_codec_roundtrip():
+    conv = make_conversation(3)
+    conv.add_message(Message(
+        Role.BOT, "<Call API> check({'a': 1})", prompt=[{"role": "system", "content": "p"}], llm_response="r",
+        type="api", apis=[{"name": "check", "params": {"a": 1}}], llm_stat={"num_calls": 2},
+    ))
+    conv.substitue_message(Message(Role.BOT, "<Call API> check({'a': 2})", apis=[{"name": "check", "params": {"a": 2}}]))
+    decoded = Conversation.from_dict(conv.to_dict())
+    assert decoded.conversation_id == conv.conversation_id and decoded.to_list() == conv.to_list()
+    assert [m == n for m, n in zip(decoded, conv)] == [True] * len(conv)
+    # the previous layout (`dataclasses.asdict`, no version) is still readable, e.g. from the DB
+    legacy = {**dataclasses.asdict(conv[-1]), "role": "BOT", "_id": "object id"}
+    assert decode_message(legacy) == conv[-1]
+    with pytest.raises(ValueError):
+        decode_message({**conv[0].to_dict(), "schema_version": 99})
+
+
+def test_message_is_slotted():
+    msg = Message(Role.USER, "hi", type="normal")
+    assert not hasattr(msg, "__dict__") and msg.type is Message(Role.BOT, "x", type="".join(["nor", "mal"])).type
+    with pytest.raises(AttributeError):
+        msg.unknown_field = 1
+    assert Role.get_by_rolename("Bot") is Role.BOT
+
+
+def test_api_call_index():
+    conv = make_conversation(2)
+    conv.add_message(Message(Role.BOT, "<Call API> check({'a': 1})", apis=[{"name": "check", "params": {"a": 1}}]))
+    conv.add_message(Message(Role.SYSTEM, "<API response> ok"))
+    conv.add_message(Message(Role.BOT, "<Call API> book({'b': [1, 2]})"))     # not parsed yet, e.g. loaded from old data
+    assert conv.api_calls == [(2, APICall("check", {"a": 1})), (4, APICall("book", {"b": [1, 2]}))]
+    assert conv.get_called_apis() == ["check", "book"] and conv[:4].get_called_apis() == ["check"]
+
+    # teacher forcing: the prediction is replaced by the reference, its API call is kept as `apis_predict`
+    conv.substitue_message(Message(Role.BOT, "<Call API> book({'b': [3]})", apis=[{"name": "book", "params": {"b": [3]}}]))
+    assert conv.api_calls[-1] == (4, APICall("book", {"b": [3]}))
+    assert conv[-1].get_api_call(predict=True) == APICall("book", {"b": [1, 2]})
+    conv.substitue_message(Message(Role.BOT, "no API"), idx=2)
+    assert conv.get_called_apis() == ["book"] and conv[2].get_api_call(predict=True).name == "check"
+    assert Conversation.from_dict(conv.to_dict()).api_calls == conv.api_calls
+
+
+@pytest.mark.parametrize("content, error", [("<Call API> check({'flag': true})", ValueError), ("<Call API> broken", AttributeError)])
+def test_unparseable_api_call(content, error):
+    conv = make_conversation(2)
+    conv.add_message(Message(Role.BOT, content))
+    conv.add_message(Message(Role.SYSTEM, "<API response> error"))
+    # the rendering does not parse the API calls
+    assert conv.to_str() == full_render(conv) and conv.copy().to_str() == conv.to_str()
+    assert conv[:3].to_str() == full_render(conv[:3])
+    with pytest.raises(error):
+        conv.get_called_apis()
+    conv.substitue_message(Message(Role.BOT, "<Call API> check({'flag': True})"), idx=2)
+    assert conv.get_called_apis() == ["check"] and conv[:2].api_calls == []
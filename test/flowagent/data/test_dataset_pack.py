@@ -0,0 +1,45 @@
+import shutil
+import pytest
+from flowagent.data import Config, DataManager, Workflow, WorkflowType, WorkflowRegistry
+from flowagent.data.pack import DatasetPack, LazyList
+
+
+@pytest.fixture
+def data_root(tmp_path, monkeypatch):
+    shutil.copytree(DataManager.DIR_data_root / "sample", tmp_path / "sample")
+    shutil.copytree(DataManager.DIR_data_root / "meta", tmp_path / "meta")
+    monkeypatch.setattr(DataManager, "DIR_data_root", tmp_path)
+    WorkflowRegistry.clear()
+    yield tmp_path
+    WorkflowRegistry.clear()
+
+
+@pytest.mark.parametrize("workflow_type", [t.subdir for t in WorkflowType])
+def test_pack_matches_directory(data_root, workflow_type):
+    cfg = Config(workflow_dataset="sample", workflow_type=workflow_type, workflow_id="000", exp_mode="session", user_mode="llm_oow")
+    expected = Workflow(cfg)
+    fn = DataManager.build_pack("sample")
+    assert fn == data_root / "sample.pack" and DataManager(cfg).pack is not None
+    workflow = Workflow(cfg)
+    assert isinstance(workflow.user_profiles, LazyList) and workflow.num_user_profile == expected.num_user_profile
+    assert workflow.user_profiles[-1] == expected.user_profiles[-1] and list(workflow.user_profiles) == list(expected.user_profiles)
+    for attr in ["name", "task_description", "workflow", "toolbox", "pdl", "user_oow_intentions"]:
+        assert getattr(workflow, attr) == getattr(expected, attr), attr
+    assert Workflow.source_files(cfg, DataManager(cfg)) == [fn, data_root / "meta/oow.yaml"]
+
+
+def test_pack_rebuild_and_fallback(data_root):
+    cfg = Config(workflow_dataset="sample", workflow_type="pdl", workflow_id="000", exp_mode="session")
+    DataManager.build_pack("sample")
+    workflow = WorkflowRegistry.get(cfg)
+    assert WorkflowRegistry.get(cfg) is workflow
+    # rebuilding the pack reloads the workflow
+    (data_root / "sample/task_infos.json").write_text((data_root / "sample/task_infos.json").read_text().replace(workflow.name, "renamed"))
+    DataManager.build_pack("sample")
+    assert WorkflowRegistry.get(cfg).name == "renamed"
+    # without the pack, load from the directory
+    (data_root / "sample.pack").unlink()
+    assert DataManager(cfg).pack is None and Workflow(cfg).name == "renamed"
+    with pytest.raises(ValueError):
+        (data_root / "bad.pack").write_bytes(b"not a pack" * 4)
+        DatasetPack(data_root / "bad.pack")
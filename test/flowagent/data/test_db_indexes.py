@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+import pytest
+from flowagent.data import DBManager
+from flowagent.data.db import INDEXES, RUN_EXPERIMENT_KEYS, plan_stages
+
+
+@pytest.fixture
+def db():
+    # NOTE: `MongoClient` connects lazily, no server is needed to build the queries
+    return DBManager("mongodb://localhost:27017/", "test_db", ensure_indexes=False)
+
+
+def _filter_and_sort(command: dict):
+    if "find" in command: return command["filter"], command.get("sort", {})
+    if "distinct" in command: return command["query"], {}
+    match = command["pipeline"][0]["$match"]
+    return {k: v for k, v in match.items() if k != "llm_stat"}, {}
+
+def _served_by(index: list, query: dict, sort: dict) -> bool:
+    """ the equality fields are a prefix of the index, followed by the sort fields (in either direction) """
+    fields = [k for k, _ in index]
+    n = len(query)
+    if set(fields[:n]) != set(query): return False
+    sort_fields = [(k, d) for k, d in index[n:n + len(sort)]]
+    directions = {d * s for (k, d), s in zip(sort_fields, sort.values())}
+    return [k for k, _ in sort_fields] == list(sort) and len(directions) <= 1
+
+def test_hot_queries_are_indexed(db):
+    sample = {"conversation_id": "2024-09-06 12:00:00.000000", **{k: "x" for k in RUN_EXPERIMENT_KEYS}}
+    name2indexes = {getattr(db, attr).name: indexes for attr, indexes in INDEXES.items()}
+    for name, command in db._hot_queries(sample):
+        query, sort = _filter_and_sort(command)
+        indexes = name2indexes[next(iter(command.values()))]
+        assert any(_served_by(index, query, sort) for index in indexes), name
+
+
+@pytest.mark.parametrize("explain, expected", [
+    # classic engine
+    ({"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "conversation_id_1"}},
+                       "rejectedPlans": [{"stage": "COLLSCAN"}]}}, ["FETCH", "IXSCAN"]),
+    ({"queryPlanner": {"winningPlan": {"stage": "COLLSCAN", "direction": "forward"}, "rejectedPlans": []}}, ["COLLSCAN"]),
+    # slot-based engine
+    ({"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}},
+                                       "slotBasedPlan": {"stages": "[2] sort ..."}}}}, ["SORT", "COLLSCAN"]),
+    # aggregation, classic engine
+    ({"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}}},
+                 {"$group": {}}]}, ["FETCH", "IXSCAN"]),
+])
+def test_plan_stages(explain, expected):
+    assert plan_stages(explain) == expected
+
+
+def test_llm_stats_rollup(db, monkeypatch):
+    pipelines = []
+    def aggregate(pipeline):
+        pipelines.append(pipeline)
+        return [{"_id": {"conversation_id": "c1", "role": "bot"}, "num_messages": 2, "num_calls": 3, "num_hedges": 1}]
+    monkeypatch.setattr(db, "collection", SimpleNamespace(aggregate=aggregate))
+    monkeypatch.setattr(db, "collection_meta", SimpleNamespace(distinct=lambda key, query: ["c1"]))
+    assert db.get_exp_llm_stats("v1") == [{"conversation_id": "c1", "role": "bot", "num_messages": 2, "num_calls": 3, "num_hedges": 1}]
+    match, group = pipelines[0][0]["$match"], pipelines[0][1]["$group"]
+    assert match == {"conversation_id": {"$in": ["c1"]}, "llm_stat": {"$ne": None}}
+    assert group["_id"] == {"conversation_id": "$conversation_id", "role": "$role"}
+    assert group["num_cache_hits"] == {"$sum": "$llm_stat.num_cache_hits"} and group["num_hedges"] == {"$sum": "$llm_stat.num_hedges"}
+    db.get_conversation_llm_stats("c1")
+    assert pipelines[1][0]["$match"]["conversation_id"] == "c1" and pipelines[1][1]["$group"]["_id"] == {"role": "$role"}
+
+
+def test_deletes_return_the_count(db, monkeypatch):
+    deleted = SimpleNamespace(deleted_count=2)
+    monkeypatch.setattr(db, "collection_meta", SimpleNamespace(delete_many=lambda query: deleted))
+    monkeypatch.setattr(db, "collection_eval", SimpleNamespace(delete_many=lambda query: deleted))
+    assert db.delete_run_experiments({"exp_version": "v1"}) == 2 and db.delete_evaluations({"exp_version": "v1"}) == 2
@@ -0,0 +1,120 @@
+import pytest
+from flowagent.data import DBManager, MongoDBManager, SQLiteDBManager, Message, Conversation, Role
+from flowagent.data.db_sqlite import where_clause
+from flowagent.data.db_writer import DBWriter
+
+
+@pytest.fixture
+def db(tmp_path):
+    return DBManager(f"sqlite:///{tmp_path}/runs.db", "test_db")
+
+def _conversation(conversation_id: str, n: int = 3) -> Conversation:
+    conv = Conversation(conversation_id)
+    for i in range(n):
+        llm_stat = {"num_calls": 1, "prompt_tokens": 10, "completion_tokens": 2, "wall_time": 0.5}
+        conv.add_message(Message(role=Role.USER if i % 2 == 0 else Role.BOT, content=f"msg {i}", llm_stat=llm_stat))
+    return conv
+
+def _config(conversation_id: str, exp_version: str = "v1", **kwargs) -> dict:
+    return {
+        "conversation_id": conversation_id, "exp_version": exp_version, "exp_mode": "session", "workflow_dataset": "STAR",
+        "workflow_type": "pdl", "workflow_id": "000", "user_profile_id": 0, "extra": {"turns": 3}, **kwargs
+    }
+
+
+def test_backend_by_scheme(tmp_path):
+    assert type(DBManager(f"sqlite:///{tmp_path}/a.db")) is SQLiteDBManager
+    assert type(DBManager("mongodb://localhost:27017/", ensure_indexes=False)) is MongoDBManager
+    with pytest.raises(ValueError):
+        DBManager("redis://localhost:6379/")
+
+def test_backends_implement_the_interface():
+    assert not MongoDBManager.__abstractmethods__ and not SQLiteDBManager.__abstractmethods__
+    class PartialDBManager(DBManager):
+        schemes = ["partial"]
+    with pytest.raises(TypeError, match="abstract"):
+        DBManager("partial://x")
+
+def test_messages(db):
+    db.insert_conversation(_conversation("c1"))
+    db.insert_message(Message(role=Role.BOT, content="late", conversation_id="c1", utterance_id=3))
+    conv = db.query_messages_by_conversation_id("c1")
+    assert [m.content for m in conv] == ["msg 0", "msg 1", "msg 2", "late"]
+    assert [m.utterance_id for m in conv] == [0, 1, 2, 3]
+    assert len(db.query_messages_by_conversation_id("missing")) == 0
+
+def test_llm_stats(db):
+    db.insert_conversation(_conversation("c1"))
+    db.insert_conversation(_conversation("c2", n=2))
+    db.insert_config(_config("c1"))
+    db.insert_config(_config("c2", exp_version="v2"))
+    role2stat = {r["role"]: r for r in db.get_conversation_llm_stats("c1")}
+    assert role2stat["user"]["num_messages"] == 2 and role2stat["user"]["prompt_tokens"] == 20
+    assert role2stat["bot"]["wall_time"] == 0.5 and role2stat["bot"]["cached_tokens"] == 0
+    rows = db.get_exp_llm_stats("v1")
+    assert {r["conversation_id"] for r in rows} == {"c1"} and sum(r["num_calls"] for r in rows) == 3
+
+def test_run_experiments(db):
+    for i in range(5):
+        assert db.insert_config(_config(f"c{i}", exp_version="v1" if i < 3 else "v2", user_profile_id=i)) is None
+    assert [r["conversation_id"] for r in db.query_run_experiments({"exp_version": "v1"})] == ["c2", "c1", "c0"]
+    assert db.query_run_experiments({"exp_version": "v1"}, limit=1)[0]["extra"] == {"turns": 3}
+    assert db.get_most_recent_unique_conversation_ids({"user_profile_id": {"$gte": 3}}) == ["c4", "c3"]
+    assert db.query_config_by_conversation_id("c3")["user_profile_id"] == 3
+    assert db.query_config_by_conversation_id("missing") is None
+    assert sorted(db.get_all_run_exp_versions()) == ["v1", "v2"]
+    assert db.delete_run_experiments({"exp_version": "v2"}) == 2
+    assert len(db.query_run_experiments()) == 3
+
+def test_evaluations(db):
+    db.insert_evaluation({"conversation_id": "c1", "exp_version": "v1", "judge_result": {"score": 1}})
+    db.insert_evaluation({"conversation_id": "c2", "exp_version": "v1", "judge_result": {"score": 0}})
+    assert len(db.query_evaluations({"exp_version": "v1"})) == 2
+    assert db.query_evaluations({"judge_result.score": 1})[0]["conversation_id"] == "c1"
+    assert sorted(db.query_evaluated_conversation_ids({"exp_version": "v1"})) == ["c1", "c2"]
+    assert db.delete_evaluations({"conversation_id": "c1"}) == 1
+    assert [r["conversation_id"] for r in db.query_evaluations()] == ["c2"]
+
+@pytest.mark.parametrize("query, expected", [
+    ({"workflow_id": "001"}, ["c1"]),
+    ({"workflow_id": {"$in": ["000", "001"]}, "user_profile_id": 0}, ["c0"]),
+    ({"workflow_id": {"$nin": ["000"]}}, ["c2", "c1"]),
+    ({"note": None}, ["c1", "c0"]),                 # missing
+    ({"note": {"$ne": "x"}}, ["c1", "c0"]),
+    ({"note": {"$exists": True}}, ["c2"]),
+    ({"extra.turns": {"$gt": 3, "$lte": 5}}, ["c2"]),
+])
+def test_query_operators(db, query, expected):
+    db.insert_config(_config("c0"))
+    db.insert_config(_config("c1", workflow_id="001", user_profile_id=1))
+    db.insert_config(_config("c2", workflow_id="002", user_profile_id=2, note="x", extra={"turns": 5}))
+    assert [r["conversation_id"] for r in db.query_run_experiments(query)] == expected
+
+@pytest.mark.parametrize("query", [{"a": {"$regex": "x"}}, {"a; DROP TABLE config": 1}, {"a": {"b": 1}}])
+def test_unsupported_queries(query):
+    with pytest.raises(ValueError):
+        where_clause(query, [])
+
+def test_write_behind(tmp_path):
+    db = DBManager(f"sqlite:///{tmp_path}/runs.db", "test_db", write_behind=True, writer_kwargs={"flush_interval": 0.05})
+    assert isinstance(db.writer, DBWriter)
+    db.insert_conversation(_conversation("c1"))
+    db.insert_config(_config("c1"))
+    assert db.flush(wait=True, timeout=10)
+    assert len(db.query_messages_by_conversation_id("c1")) == 3
+    assert db.query_config_by_conversation_id("c1")["exp_version"] == "v1"
+
+def test_hot_queries_use_indexes(db):
+    db.insert_conversation(_conversation("c1"))
+    db.insert_config(_config("c1"))
+    rows = db.explain_hot_queries()
+    assert len(rows) == 9
+    assert not [r["query"] for r in rows if r["collscan"]]
+
+def test_delete_flushes_the_queued_inserts(tmp_path):
+    db = DBManager(f"sqlite:///{tmp_path}/runs.db", "test_db", write_behind=True, writer_kwargs={"flush_interval": 60})
+    db.insert_config(_config("c1"))
+    db.insert_evaluation({"conversation_id": "c1", "exp_version": "v1"})
+    assert db.delete_evaluations({"conversation_id": "c1"}) == 1
+    assert db.delete_run_experiments({"conversation_id": "c1"}) == 1
+    assert db.flush(wait=True, timeout=10) and not db.query_evaluations() and not db.query_run_experiments()
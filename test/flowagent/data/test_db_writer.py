@@ -0,0 +1,102 @@
+import time, threading
+import pymongo.errors
+import pytest
+from flowagent.data.db_writer import DBWriter
+
+
+class FakeCollection:
+    def __init__(self, delay: float = 0.0, fail_times: int = 0, write_errors: list = None) -> None:
+        self.docs, self.batches = [], []
+        self.delay, self.fail_times = delay, fail_times
+        self.write_errors = write_errors or []      # [(index, code)] of the docs failing in the next call
+
+    def insert_many(self, docs, ordered=True):
+        assert not ordered
+        time.sleep(self.delay)
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise pymongo.errors.AutoReconnect("connection reset")
+        for doc in docs: doc.setdefault("_id", id(doc))     # as pymongo does
+        errors, self.write_errors = self.write_errors, []
+        failed = {i for i, _ in errors}
+        self.batches.append(len(docs))
+        self.docs.extend(doc for i, doc in enumerate(docs) if i not in failed)
+        if errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": [{"index": i, "code": code, "errmsg": "error"} for i, code in errors]})
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+def test_coalesce_by_size():
+    db = FakeDB()
+    writer = DBWriter(db, batch_size=10, flush_interval=60)
+    writer.insert("messages", [{"i": i} for i in range(25)])
+    writer.insert("config", [{"i": 0}])
+    assert writer.flush(wait=True, timeout=5)
+    assert [d["i"] for d in db["messages"].docs] == list(range(25)) and len(db["config"].docs) == 1
+    assert db["messages"].batches[:2] == [10, 10]
+    stat = writer.get_stat()
+    assert stat["num_written"] == 26 and stat["queue_depth"] == 0 and stat["max_batch_size"] == 10
+    writer.close()
+
+
+def test_flush_by_time():
+    db = FakeDB()
+    writer = DBWriter(db, batch_size=100, flush_interval=0.05)
+    writer.insert("messages", [{"i": 0}, {"i": 1}])
+    for _ in range(100):
+        if len(db["messages"].docs) == 2: break
+        time.sleep(0.01)
+    assert db["messages"].batches == [2]
+    writer.close()
+
+
+def test_backpressure():
+    db = FakeDB()
+    db["messages"] = FakeCollection(delay=0.05)
+    writer = DBWriter(db, batch_size=2, flush_interval=0.01, max_queue_size=2)
+    threads = [threading.Thread(target=writer.insert, args=("messages", [{"t": t, "i": i} for i in range(5)])) for t in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join(timeout=10)
+    writer.close()
+    stat = writer.get_stat()
+    assert len(db["messages"].docs) == 20 and stat["num_written"] == 20
+    assert stat["num_blocked"] > 0 and stat["max_queue_depth"] <= 2
+
+
+def test_retry_and_close():
+    db = FakeDB()
+    db["messages"] = FakeCollection(fail_times=1)
+    writer = DBWriter(db, batch_size=100, flush_interval=60)
+    writer.insert("messages", [{"i": 0}])
+    writer.close()      # writes the queued docs
+    assert len(db["messages"].docs) == 1 and writer.get_stat()["num_dropped"] == 0
+    with pytest.raises(RuntimeError):
+        writer.insert("messages", [{"i": 1}])
+    assert writer.flush(wait=True)
+
+
+def test_caller_docs_are_not_modified():
+    db = FakeDB()
+    writer = DBWriter(db, batch_size=100, flush_interval=60)
+    docs = [{"i": 0}, {"i": 1}]
+    writer.insert("messages", docs)
+    assert writer.flush(wait=True, timeout=5)
+    assert docs == [{"i": 0}, {"i": 1}] and all("_id" in d for d in db["messages"].docs)
+    writer.close()
+
+
+@pytest.mark.parametrize("code, written", [(121, [0, 1, 2]), (11000, [0, 2])])
+def test_bulk_write_errors(code, written):
+    """ the failed docs are retried, except the duplicated keys """
+    db = FakeDB()
+    db["messages"] = FakeCollection(write_errors=[(1, code)])
+    writer = DBWriter(db, batch_size=100, flush_interval=60)
+    writer.insert("messages", [{"i": i} for i in range(3)])
+    writer.close()
+    assert sorted(d["i"] for d in db["messages"].docs) == written
+    stat = writer.get_stat()
+    assert (stat["num_written"], stat["num_dropped"]) == (len(written), 3 - len(written))
@@ -0,0 +1,67 @@
+import os, shutil, threading
+import pytest
+from flowagent.data import Config, Conversation, DataManager, Workflow, WorkflowRegistry
+from flowagent.roles.base import BaseRole
+from flowagent.roles.bot import PDLBot
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    shutil.copytree(DataManager.DIR_data_root / "sample", tmp_path / "sample")
+    shutil.copytree(DataManager.DIR_data_root / "meta", tmp_path / "meta")
+    monkeypatch.setattr(DataManager, "DIR_data_root", tmp_path)
+    WorkflowRegistry.clear()
+    yield Config(workflow_dataset="sample", workflow_type="pdl", workflow_id="000", exp_mode="session")
+    WorkflowRegistry.clear()
+
+
+def test_loaded_once_and_shared(cfg):
+    workflows = []
+    threads = [threading.Thread(target=lambda: workflows.append(WorkflowRegistry.get(cfg))) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert all(w is workflows[0] for w in workflows)
+    assert workflows[0].to_str() == Workflow(cfg).to_str() and workflows[0].num_user_profile == Workflow(cfg).num_user_profile
+    (stat, ) = WorkflowRegistry.get_stats().values()
+    assert stat["num_loads"] == 1 and stat["num_hits"] == 7
+    with pytest.raises(AttributeError):
+        workflows[0].name = "modified"
+    # other loading options are other entries
+    assert WorkflowRegistry.get(Config(**{**cfg.to_dict(), "user_mode": "llm_oow"})).user_oow_intentions
+
+
+def test_reloaded_on_modification(cfg):
+    workflow = WorkflowRegistry.get(cfg)
+    fn = DataManager.DIR_data_root / "sample/tools/000.yaml"
+    st = os.stat(fn)
+    os.utime(fn, (st.st_atime, st.st_mtime + 10))
+    reloaded = WorkflowRegistry.get(cfg)
+    assert reloaded is not workflow and WorkflowRegistry.get(cfg) is reloaded
+    (stat, ) = WorkflowRegistry.get_stats().values()
+    assert stat["num_loads"] == 2 and stat["num_hits"] == 1
+
+
+def test_fields_loaded_lazily(cfg):
+    workflow = Workflow(cfg)
+    lazy_fields = ["workflow", "toolbox", "pdl", "user_profiles", "user_oow_intentions", "reference_conversations"]
+    assert not set(lazy_fields) & set(vars(workflow))
+    profile = workflow.user_profiles[2]
+    assert workflow.user_profiles[2] is profile and set(vars(workflow)) >= {"user_profiles"} and "pdl" not in vars(workflow)
+    assert workflow.user_oow_intentions is None and workflow.reference_conversations is None
+    # the shared workflows cache their fields too
+    shared = WorkflowRegistry.get(cfg)
+    assert shared.pdl is shared.pdl and shared.workflow == workflow.workflow
+
+
+def test_prompts_follow_the_reloaded_workflow(cfg):
+    def bot_prompt() -> str:
+        bot = PDLBot.__new__(PDLBot)        # no LLM client
+        BaseRole.__init__(bot, Config(**{**cfg.to_dict(), "bot_template_fn": "flowagent/bot_pdl.jinja"}), conv=Conversation(), workflow=WorkflowRegistry.get(cfg))
+        return bot._gen_prompt()
+    assert "flight booking" in bot_prompt()
+    fn = DataManager.DIR_data_root / "sample/pdl/000.yaml"
+    st = os.stat(fn)
+    fn.write_text(fn.read_text().replace("flight booking", "train booking"))
+    os.utime(fn, (st.st_atime, st.st_mtime + 10))
+    prompt = bot_prompt()
+    assert "train booking" in prompt and "flight booking" not in prompt
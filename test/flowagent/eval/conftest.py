@@ -0,0 +1,79 @@
+""" a simulated experiment on the `sample` dataset (copied to tmp_path, SQLite DB), the LLMs are served by `FakeLLM` """
+import time, asyncio, shutil
+from typing import Callable
+import pytest
+from openai.types.chat import ChatCompletion
+from easonsi.llm.call_stats import note_upstream
+from easonsi.llm.openai_client import OpenAIClient, AsyncOpenAIClient
+from flowagent.data import Config, DataManager, WorkflowRegistry, UserProfile
+from flowagent.data.base_llm import LLM_CFG
+
+
+class FakeLLM:
+    """ canned responses by the role of the prompt, `delay` seconds per call (on the event loop for the async clients) """
+    def __init__(self, make_completion: Callable[..., ChatCompletion], delay: float = 0.0):
+        self._make_completion = make_completion
+        self.delay = delay
+        self.num_calls = self.in_flight = self.max_in_flight = 0
+        self.judge_session_output = "Reason: ok\nTotal number of goals: 2\nNumber of accomplished goals: 2\nResult: yes"
+
+    def respond(self, prompt: str) -> str:
+        if "real-life server" in prompt:
+            return 'Status Code: 200\nData: {"ok": true}'
+        if "real-life user" in prompt:
+            return "Response: [END]" if "ok done" in prompt else "Response: I want to book"
+        if "Total number of goals" in prompt:
+            return self.judge_session_output
+        if "Score:" in prompt:
+            return "Score: 9"
+        if "<Call API>" not in prompt and "Action: checkAvailability" not in prompt:
+            return 'Thought: check\nAction: checkAvailability\nAction Input: {"a": 1}'
+        return "Thought: done\nResponse: ok done"
+
+    def make_completion(self, content: str, model: str = "gpt-4o") -> ChatCompletion:
+        return self._make_completion(content, model=model, prompt_tokens=100, completion_tokens=10)
+
+    def _start(self) -> None:
+        note_upstream()     # stands in for `_chat_completion`, i.e. not served by the cache
+        self.num_calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _finish(self, messages, model: str) -> ChatCompletion:
+        self.in_flight -= 1
+        return self.make_completion(self.respond("\n".join(m["content"] for m in messages)), model=model)
+
+    def chat_completion(self, client, messages, **args) -> ChatCompletion:
+        self._start()
+        time.sleep(self.delay)
+        return self._finish(messages, args["model"])
+
+    async def achat_completion(self, client, messages, **args) -> ChatCompletion:
+        self._start()
+        await asyncio.sleep(self.delay)
+        return self._finish(messages, args["model"])
+
+
+@pytest.fixture
+def llm(monkeypatch, make_completion):
+    llm = FakeLLM(make_completion)
+    monkeypatch.setattr(OpenAIClient, "_chat_completion", lambda client, messages, **args: llm.chat_completion(client, messages, **args))
+    monkeypatch.setattr(AsyncOpenAIClient, "_achat_completion", lambda client, messages, **args: llm.achat_completion(client, messages, **args))
+    for model in ["gpt-4o", "gpt-4o-mini"]:
+        monkeypatch.setitem(LLM_CFG, model, {**LLM_CFG[model], "api_key": "sk-test"})
+    return llm
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch, llm):
+    shutil.copytree(DataManager.DIR_data_root / "sample", tmp_path / "sample")
+    shutil.copytree(DataManager.DIR_data_root / "meta", tmp_path / "meta")
+    monkeypatch.setattr(DataManager, "DIR_data_root", tmp_path)
+    monkeypatch.setattr(UserProfile, "required_apis", ["checkAvailability"])
+    WorkflowRegistry.clear()
+    yield Config(
+        workflow_dataset="sample", workflow_type="pdl", workflow_id="000", exp_mode="session", exp_engine="async",
+        exp_version="async_test", bot_mode="pdl_bot", bot_template_fn="flowagent/bot_pdl.jinja",
+        db_uri=f"sqlite:///{tmp_path}/runs.db", log_utterence_time=False, judge_log_to="none",
+        api_llm_cache=False, judge_llm_cache=False,     # no shared on-disk cache, the calls are counted
+    )
+    WorkflowRegistry.clear()
@@ -0,0 +1,41 @@
+import pytest
+from flowagent.data import DBManager
+from flowagent.controller.flowagent import FlowagentController
+from flowagent.eval.analyzer import Analyzer
+from flowagent.eval.eval_utils import EvalUtils
+from flowagent.eval.judger import Judger
+
+
+@pytest.fixture
+def db(cfg):
+    """ two simulated & judged conversations, 5 LLM calls per conversation + 1 judge call (100/10 tokens each) """
+    cfg.exp_engine = "thread"
+    for i in range(2):
+        cfg.user_profile_id = i
+        FlowagentController(cfg).start_conversation(verbose=False)
+    db = DBManager.from_config(cfg)
+    for task in EvalUtils.get_evaluation_configs(cfg, db=db):
+        Judger(task).judge(verbose=False)
+    return db
+
+
+def test_get_conversation_llm_stats(cfg, db):
+    (cid, _) = db.get_most_recent_unique_conversation_ids({"exp_version": cfg.exp_version})
+    role2stat = {r["role"]: r for r in db.get_conversation_llm_stats(cid)}
+    assert {role: (r["num_messages"], r["num_calls"], r["prompt_tokens"]) for role, r in role2stat.items()} == {
+        "user": (2, 2, 200), "bot": (2, 2, 200), "system": (1, 1, 100)
+    }
+    assert all(r["num_cache_hits"] == r["num_hedges"] == 0 for r in role2stat.values())
+
+def test_get_exp_llm_stats(cfg, db):
+    rows = db.get_exp_llm_stats(cfg.exp_version)
+    assert len(rows) == 6 and len({r["conversation_id"] for r in rows}) == 2
+    assert sum(r["num_calls"] for r in rows) == 10 and sum(r["completion_tokens"] for r in rows) == 100
+    assert db.get_exp_llm_stats("missing") == []
+
+def test_stat_llm_usage(cfg, db):
+    analyzer = Analyzer(cfg)
+    analyzer.stat_judge_session()
+    metrics = analyzer.stat_llm_usage()
+    assert (metrics["tokens_per_conversation"], metrics["tokens_per_success"]) == (660, 660)
+    assert metrics["llm_time_per_conversation"] > 0 and analyzer.stat_dict["tokens_per_success"] == 660
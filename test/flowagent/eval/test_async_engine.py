@@ -0,0 +1,91 @@
+import asyncio, json
+import pytest
+from flowagent.data import Config, DataManager, DBManager, Role
+from flowagent.controller.flowagent import FlowagentController
+from flowagent.eval.evaluator import Evaluator, ENGINE2TASKS
+from flowagent.eval.eval_utils import EvalUtils
+from flowagent.eval.judger import Judger
+
+
+def _session_tasks(cfg: Config, num: int):
+    return [Config.from_dict({**cfg.to_dict(), "user_profile_id": i}) for i in range(num)]
+
+
+def test_process_async(cfg):
+    controller = FlowagentController(cfg)
+    asyncio.run(controller.user.process_async())
+    bot_output = asyncio.run(controller.bot.process_async())
+    assert bot_output.action == "checkAvailability"
+    asyncio.run(controller.api.process_async(bot_output))
+    msgs = controller.conv.msgs
+    assert [m.role for m in msgs] == [Role.USER, Role.BOT, Role.SYSTEM]
+    assert all(m.llm_stat["num_calls"] == 1 and m.llm_stat["prompt_tokens"] == 100 for m in msgs)
+
+def test_conversation_async(cfg, llm):
+    conv = asyncio.run(FlowagentController(cfg).conversation_async(verbose=False))
+    assert [m.role for m in conv.msgs] == [Role.USER, Role.BOT, Role.SYSTEM, Role.BOT, Role.USER]
+    assert conv.msgs[-1].content == "[END]" and llm.num_calls == 5
+
+@pytest.mark.parametrize("is_async", [False, True])
+def test_sync_and_async_loops_are_the_same(cfg, llm, is_async):
+    controller = FlowagentController(cfg)
+    conv = asyncio.run(controller.conversation_async(verbose=False)) if is_async else controller.conversation(verbose=False)
+    assert [m.role for m in conv.msgs] == [Role.USER, Role.BOT, Role.SYSTEM, Role.BOT, Role.USER] and llm.num_calls == 5
+
+@pytest.mark.parametrize("is_async", [False, True])
+def test_role_errors_are_raised(cfg, monkeypatch, is_async):
+    controller = FlowagentController(cfg)
+    def fail(*args):
+        raise RuntimeError("api down")
+    async def afail(*args):
+        fail()
+    monkeypatch.setattr(controller.api, "process", fail)
+    monkeypatch.setattr(controller.api, "process_async", afail)
+    with pytest.raises(RuntimeError, match="api down"):
+        asyncio.run(controller.conversation_async(verbose=False)) if is_async else controller.conversation(verbose=False)
+    assert [m.role for m in controller.conv.msgs] == [Role.USER, Role.BOT]
+
+def test_conversation_teacher_forcing_async(cfg):
+    ref = [{"role": "user", "content": "I want to book"}, {"role": "bot", "content": "Sure, which date?"},
+           {"role": "user", "content": "Tomorrow"}, {"role": "bot", "content": "Booked."}]
+    dir_conv = DataManager.DIR_data_root / "sample/user_profile_w_conversation"
+    dir_conv.mkdir()
+    with open(dir_conv / "000.json", "w") as f:
+        json.dump([{"user_intention": "book a flight", "conversation": ref}], f)
+    cfg.exp_mode = "turn"
+    conv = asyncio.run(FlowagentController(cfg).conversation_teacher_forcing_async(verbose=False))
+    assert [m.content for m in conv.msgs] == [m["content"] for m in ref]
+    assert [m.content_predict for m in conv.msgs if m.role == Role.BOT] == ["<Call API> checkAvailability({'a': 1})"] * 2
+
+def test_simulate_and_judge(cfg, llm):
+    llm.delay = 0.05
+    f_simulate, f_judge = ENGINE2TASKS["async"]["session"]
+    Evaluator.run_tasks_async(_session_tasks(cfg, 3), f_simulate, max_concurrency=2)
+    assert llm.max_in_flight == 2
+    db = DBManager.from_config(cfg)
+    assert len(db.query_run_experiments({"exp_version": cfg.exp_version})) == 3
+
+    tasks = EvalUtils.get_evaluation_configs(cfg, db=db)
+    Evaluator.run_tasks_async(tasks, f_judge, max_concurrency=10)
+    evals = db.query_evaluations({"exp_version": cfg.exp_version})
+    assert len(evals) == 3 and all(e["judge_session_result"]["Result"] == "yes" for e in evals)
+    assert not EvalUtils.get_evaluation_configs(cfg, db=db)
+
+def test_failed_tasks_are_retried_and_isolated(cfg, capsys):
+    calls = []
+    async def f_task(task: Config):
+        calls.append(task.user_profile_id)
+        if task.user_profile_id == 0: raise RuntimeError("boom")
+    Evaluator.run_tasks_async(_session_tasks(cfg, 3), f_task, max_concurrency=1)     # does not raise
+    assert calls.count(0) == 3 and calls.count(1) == calls.count(2) == 1
+    assert "Task failed after 3 retrys" in capsys.readouterr().out
+
+def test_judge_async_unparseable_output(cfg, llm):
+    asyncio.run(FlowagentController(cfg).start_conversation_async(verbose=False))
+    db = DBManager.from_config(cfg)
+    (task, ) = EvalUtils.get_evaluation_configs(cfg, db=db)
+    llm.judge_session_output = "I cannot judge this."
+    with pytest.raises(Exception):
+        asyncio.run(Judger(task).judge_async(verbose=False))
+    assert llm.num_calls == 5 + cfg.judge_retry_limit
+    assert not db.query_evaluations({"conversation_id": task.judge_conversation_id})
@@ -0,0 +1,30 @@
+import pytest
+from flowagent.data import Config, DBManager
+from flowagent.eval.eval_utils import EvalUtils
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = DBManager(f"sqlite:///{tmp_path}/runs.db", "test_db")
+    for i in range(5):
+        db.insert_config({"conversation_id": f"c{i}", **Config(exp_version="v1", user_profile_id=i).to_dict()})
+    db.insert_config({"conversation_id": "other", **Config(exp_version="v2").to_dict()})
+    for cid in ["c1", "c3", "other"]:
+        db.insert_evaluation({"conversation_id": cid, "exp_version": "v2" if cid == "other" else "v1"})
+    # the planning reads the configs & the judged ids in bulk, not per experiment
+    monkeypatch.setattr(db, "query_config_by_conversation_id", lambda *args: pytest.fail("per-experiment query"))
+    monkeypatch.setattr(db, "query_evaluations", lambda *args, **kwargs: pytest.fail("per-experiment query"))
+    return db
+
+def test_get_evaluation_configs(db):
+    cfg = Config(exp_version="v1", judge_model_name="judge-model")
+    tasks = EvalUtils.get_evaluation_configs(cfg, db=db)
+    assert [t.judge_conversation_id for t in tasks] == ["c4", "c2", "c0"]
+    assert [t.user_profile_id for t in tasks] == [4, 2, 0]
+    assert all(t.judge_planned and t.judge_model_name == "judge-model" for t in tasks)
+
+@pytest.mark.parametrize("kwargs, cfg_kwargs", [({"skip_judged": False}, {}), ({}, {"judge_force_rejudge": True})])
+def test_get_evaluation_configs_all(db, kwargs, cfg_kwargs):
+    tasks = EvalUtils.get_evaluation_configs(Config(exp_version="v1", **cfg_kwargs), db=db, **kwargs)
+    assert [t.judge_conversation_id for t in tasks] == ["c4", "c3", "c2", "c1", "c0"]
+    assert not any(t.judge_planned for t in tasks)
@@ -0,0 +1,72 @@
+import json
+import pytest
+from flowagent.data import DBManager, Role
+from flowagent.controller.flowagent import FlowagentController
+from flowagent.eval import evaluator
+from flowagent.eval.eval_utils import EvalUtils
+from flowagent.eval.judger import Judger
+
+
+@pytest.fixture
+def task(cfg):
+    """ the judge task of one simulated conversation """
+    cfg.exp_engine = "thread"
+    FlowagentController(cfg).start_conversation(verbose=False)
+    (task, ) = EvalUtils.get_evaluation_configs(cfg, db=DBManager.from_config(cfg))
+    return task
+
+
+def test_gen_batch_prompts(task):
+    cid = task.judge_conversation_id
+    ((custom_id, prompt), ) = Judger(task).gen_batch_prompts(mode="session", verbose=False)
+    assert custom_id == f"{cid}/session" and "Total number of goals" in prompt
+    conv = DBManager.from_config(task).query_messages_by_conversation_id(cid)
+    bot_idxs = [i for i, msg in enumerate(conv) if msg.role == Role.BOT]
+    assert [k for k, _ in Judger(task).gen_batch_prompts(mode="turn", verbose=False)] == [f"{cid}/turn/{i}" for i in bot_idxs]
+
+def test_judge_from_batch(task, llm):
+    judger = Judger(task)
+    ((custom_id, _), ) = judger.gen_batch_prompts(mode="session", verbose=False)
+    num_calls = llm.num_calls
+    output = "Reason: x\nTotal number of goals: 3\nNumber of accomplished goals: 1\nResult: no"
+    out = judger.judge_from_batch({custom_id: llm.make_completion(output)}, mode="session", verbose=False)
+    assert out["judge_session_result"]["Result"] == "no" and out["judge_session_result"]["Total number of goals"] == 3
+    assert llm.num_calls == num_calls         # no interactive query
+    (evaluation, ) = DBManager.from_config(task).query_evaluations({"conversation_id": task.judge_conversation_id})
+    assert evaluation["judge_session_details"]["llm_response"] == output
+    task.judge_planned = False
+    assert Judger(task).gen_batch_prompts(mode="session", verbose=False) == []      # judged
+
+@pytest.mark.parametrize("kind", ["unparseable", "failed", "missing"])
+def test_judge_from_batch_falls_back_to_interactive(task, llm, kind):
+    judger = Judger(task)
+    ((custom_id, _), ) = judger.gen_batch_prompts(mode="session", verbose=False)
+    results = {
+        "unparseable": {custom_id: llm.make_completion("I cannot judge this.")},
+        "failed": {custom_id: "request_failed: boom"},
+        "missing": {},
+    }[kind]
+    num_calls = llm.num_calls
+    out = judger.judge_from_batch(results, mode="session", verbose=False)
+    assert out["judge_session_result"]["Result"] == "yes" and llm.num_calls == num_calls + 1
+
+def test_judge_from_batch_turn(task, llm):
+    judger = Judger(task)
+    prompts = judger.gen_batch_prompts(mode="turn", verbose=False)
+    results = {custom_id: llm.make_completion("Score: 7") for custom_id, _ in prompts[1:]}     # the first one is missing
+    num_calls = llm.num_calls
+    out = judger.judge_from_batch(results, mode="turn", verbose=False)
+    assert [jr["Score"] for jr in out["judge_turn_result"]] == ["9"] + ["7"] * (len(prompts) - 1)
+    assert llm.num_calls == num_calls + 1
+
+def test_run_evaluations_batch(cfg, llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(evaluator, "DIR_cache", tmp_path)
+    cfg.exp_engine, cfg.judge_batch_backend, cfg.judge_batch_poll_interval = "thread", "local", 0.01
+    for i in range(2):
+        cfg.user_profile_id = i
+        FlowagentController(cfg).start_conversation(verbose=False)
+    evaluator.Evaluator(cfg).run_evaluations_batch()
+    assert len(DBManager.from_config(cfg).query_evaluations({"exp_version": cfg.exp_version})) == 2
+    (fn, ) = (tmp_path / "judge_batch").glob("*.jsonl")
+    bodies = [json.loads(line)["body"] for line in fn.read_text().splitlines()]
+    assert len(bodies) == 2 and all(body["model"] == cfg.judge_model_name and "enable_thinking" not in body for body in bodies)
@@ -0,0 +1,41 @@
+from flowagent.roles.bot import ReactBot, ReactStreamParser
+from flowagent.data import BotOutputType
+
+
+def feed_in_chunks(text: str, size: int = 3):
+    """ feed `text` in chunks, return (parser, #chunks consumed) """
+    parser = ReactStreamParser()
+    for n, i in enumerate(range(0, len(text), size), 1):
+        if parser.feed(text[i:i + size]): break
+    return parser, n
+
+
+def test_stop_after_response():
+    text = "Thought: greet\nResponse: Hello!\nHow can I help?\n[USER] I want to book a table\n[BOT] ..."
+    parser, n = feed_in_chunks(text)
+    assert parser.get_output() == "Thought: greet\nResponse: Hello!\nHow can I help?"
+    assert n < len(text) / 3
+    prediction = ReactBot.parse_react_output(parser.get_output())
+    assert prediction.action_type == BotOutputType.RESPONSE and prediction.response == "Hello!\nHow can I help?"
+
+
+def test_stop_after_action_input():
+    text = 'Thought: check\nAction: API_check\nAction Input: {"name": "a}b", "n": [1, {"x": 2}]}\nObservation: ...'
+    parser, _ = feed_in_chunks(text)
+    assert parser.get_output().endswith('[1, {"x": 2}]}')
+    prediction = ReactBot.parse_react_output(parser.get_output())
+    assert (prediction.action, prediction.action_input) == ("check", {"name": "a}b", "n": [1, {"x": 2}]})
+
+
+def test_response_deltas_hold_back_markers():
+    parser, deltas = ReactStreamParser(), []
+    for chunk in ["Thought: x\nRes", "ponse: Hi", " there\n[US", "ER] next"]:
+        parser.feed(chunk)
+        deltas.append(parser.pop_response_delta())
+    assert deltas == ["", "Hi", " there", ""]
+    assert "".join(deltas).strip() == ReactBot.parse_react_output(parser.get_output()).response
+
+
+def test_incomplete_stream_keeps_everything():
+    parser, _ = feed_in_chunks("Thought: x\nResponse: no more tokens")
+    assert parser.end is None and parser.get_output() == "Thought: x\nResponse: no more tokens"
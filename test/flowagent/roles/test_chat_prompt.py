@@ -0,0 +1,39 @@
+from flowagent.data import Conversation, Message, Role
+from utils.jinja_templates import jinja_render, jinja_render_static, jinja_render_chat
+
+
+def render(conv: Conversation, time: str):
+    return jinja_render_chat(
+        "flowagent/bot_pdl.jinja", conv.to_chat_messages(Role.BOT),
+        turn_kwargs=dict(current_state=f"Current time: {time}"), api_infos="<apis>", PDL="<pdl>",
+    )
+
+
+def test_static_prefix_is_stable_across_turns():
+    conv = Conversation()
+    conv.add_message(Message(Role.USER, "I want to book"))
+    first = render(conv, "2024-01-01 00:00:00")
+    conv.add_message(Message(Role.BOT, "<Call API> check({})", llm_response='Thought: t\nAction: check\nAction Input: {}'))
+    conv.add_message(Message(Role.SYSTEM, "<API response> ok"))
+    conv.add_message(Message(Role.USER, "thanks"))
+    second = render(conv, "2024-01-01 00:00:05")
+
+    assert [m["role"] for m in second] == ["system", "user", "assistant", "user"]
+    assert second[0] == first[0] and "<pdl>" in first[0]["content"] and "Current time" not in first[0]["content"]
+    # the history is a prefix, the volatile state comes last
+    assert first[1]["content"].startswith(second[1]["content"])
+    assert second[2]["content"].startswith("Thought: t")
+    assert second[3]["content"].startswith("[SYSTEM] <API response> ok\n[USER] thanks")
+    assert second[3]["content"].rstrip().endswith("Use one of the two output templates above.")
+
+
+def test_static_render_matches_full_render():
+    calls = []
+    def static():
+        calls.append(1)
+        return dict(PDL="name: x\nprocedure: |\n  a()", api_infos=[{"API": "check", "params": {"a": "{{ not a var }}"}}])
+    for i in range(3):
+        dynamic = dict(conversation=f"[USER] hi {i}\n[BOT] {{ }}", current_state=f" Current time: {i}\n")
+        prompt = jinja_render_static("flowagent/bot_pdl.jinja", key=("test", "pdl", "x"), static=static, **dynamic)
+        assert prompt == jinja_render("flowagent/bot_pdl.jinja", **static(), **dynamic)
+    assert len(calls) == 1 + 3      # one miss, then only the reference renders above
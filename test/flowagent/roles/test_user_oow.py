@@ -0,0 +1,26 @@
+import random
+from types import SimpleNamespace
+from flowagent.data import Config, Conversation, Message, Role
+from flowagent.roles.base import BaseRole
+from flowagent.roles.user import LLMSimulatedUserWithOOW
+
+
+def sample_oow_intentions(user_profile_id: int, num_turns: int = 20) -> list:
+    """ the OOW intentions drawn at each turn of a new conversation """
+    user = LLMSimulatedUserWithOOW.__new__(LLMSimulatedUserWithOOW)     # no LLM client
+    workflow = SimpleNamespace(user_oow_intentions=["intent_a", "intent_b"])
+    BaseRole.__init__(user, Config(user_oow_ratio=0.5, user_profile_id=user_profile_id), conv=Conversation(), workflow=workflow)
+    intentions = []
+    for _ in range(num_turns):
+        intentions.append(user._sample_oow_intention())
+        user.conv.add_message(Message(Role.USER, "hi"))
+    return intentions
+
+
+def test_oow_draws_are_reproducible():
+    random.seed(0)
+    first = sample_oow_intentions(user_profile_id=1)
+    random.seed(1)
+    assert sample_oow_intentions(user_profile_id=1) == first
+    assert {None, "intent_b"} == set(first)     # both outcomes over the turns
+    assert sample_oow_intentions(user_profile_id=2) != first
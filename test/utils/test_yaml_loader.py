@@ -0,0 +1,46 @@
+import yaml
+import pytest
+from flowagent.data import Config, DataManager
+from utils import yaml_loader
+from utils.yaml_loader import yaml_load, render_env_template, get_yaml_cache_stats, yaml_clear_cache
+
+SAMPLE_FILES = sorted(
+    list((DataManager.DIR_data_root / "sample").rglob("*.yaml")) + list((DataManager.DIR_data_root / "meta").rglob("*.yaml"))
+)
+
+
+@pytest.mark.parametrize("fn", SAMPLE_FILES, ids=lambda fn: fn.relative_to(DataManager.DIR_data_root).as_posix())
+def test_same_as_pure_loaders(fn):
+    s = fn.read_text()
+    assert yaml_load(s) == yaml.load(s, Loader=yaml.SafeLoader)
+    if fn.parent.name == "pdl":
+        assert yaml_load(s.strip(), full=True) == yaml.load(s.strip(), Loader=yaml.FullLoader)
+
+
+def test_cache_returns_copies():
+    yaml_clear_cache()
+    s = "a: [1, 2]\nb: {c: d}\n"
+    first = yaml_load(s)
+    first["a"].append(3)
+    assert yaml_load(s) == {"a": [1, 2], "b": {"c": "d"}}
+    assert get_yaml_cache_stats() == {"num_hits": 1, "num_misses": 1, "size": 1}
+    # the safe & full results are cached separately
+    yaml_load(s, full=True)
+    assert get_yaml_cache_stats()["size"] == 2
+
+
+def test_render_env_template(monkeypatch):
+    monkeypatch.setenv("DB_URI", "mongodb://test:27017")
+    assert render_env_template("db_uri: {{DB_URI}}") == "db_uri: mongodb://test:27017"
+    plain = "db_uri: mongodb://localhost:27017\n"
+    assert render_env_template(plain) is plain
+    monkeypatch.setattr(yaml_loader.jinja2, "Template", None)      # the cached template is reused
+    assert render_env_template("db_uri: {{DB_URI}}") == "db_uri: mongodb://test:27017"
+
+
+def test_config_from_yaml(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_URI", "mongodb://test:27017")
+    fn = tmp_path / "cfg.yaml"
+    fn.write_text("workflow_dataset: sample\ndb_uri: \"{{DB_URI}}\"\n")
+    cfg = Config.from_yaml(fn)
+    assert cfg.workflow_dataset == "sample" and cfg.db_uri == "mongodb://test:27017"